@@ -0,0 +1,106 @@
+import numpy as np
+from .resources import BASE_RESOURCE_TYPES as RESOURCE_TYPES
+
+
+class AllocationMatrix:
+    '''
+    Allocation of the users of a VM as a (users x resources) array with index maps.
+
+    Sums, normalization, clipping and unit conversion are vectorized over the array; the nested dict format
+    ({user: {"cache": ..., "mem_bw": ...}}) is only produced at the edges (to_dict()/update_dict()).
+    '''
+    __slots__ = ("users", "resource_types", "user_index", "resource_index", "values")
+
+    def __init__(self, users: list, resource_types=RESOURCE_TYPES, values=None):
+        self.users = list(users)
+        self.resource_types = list(resource_types)
+        self.user_index = {user: i for i, user in enumerate(self.users)}
+        self.resource_index = {res_type: j for j, res_type in enumerate(self.resource_types)}
+        if values is None:
+            self.values = np.zeros((len(self.users), len(self.resource_types)))
+        else:
+            self.values = np.array(values, dtype=float).reshape(len(self.users), len(self.resource_types))
+
+    @classmethod
+    def from_dict(cls, allocation: dict, users: list = None, resource_types=RESOURCE_TYPES):
+        """
+        Args:
+            allocation: user -> {resource type: value, ...}; other keys (e.g., "price") are ignored
+            users: rows in this order (default: the keys of the allocation)
+        """
+        users = list(allocation.keys()) if users is None else list(users)
+        values = [[float(allocation[user].get(res_type, 0.)) for res_type in resource_types] for user in users]
+        return cls(users, resource_types, values if users else None)
+
+    def copy(self):
+        return AllocationMatrix(self.users, self.resource_types, self.values.copy())
+
+    def __contains__(self, user):
+        return user in self.user_index
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, user, res_type):
+        return float(self.values[self.user_index[user], self.resource_index[res_type]])
+
+    def set(self, user, res_type, value):
+        self.values[self.user_index[user], self.resource_index[res_type]] = value
+
+    def row(self, user):
+        return {res_type: float(value) for res_type, value in zip(self.resource_types, self.values[self.user_index[user]])}
+
+    def set_row(self, user, alloc: dict):
+        i = self.user_index[user]
+        for res_type, j in self.resource_index.items():
+            if res_type in alloc:
+                self.values[i, j] = alloc[res_type]
+
+    def _to_vector(self, per_resource):
+        # scalar or dict (resource type -> value) to a vector over the resource types
+        if isinstance(per_resource, dict):
+            return np.array([per_resource[res_type] for res_type in self.resource_types], dtype=float)
+        return np.full(len(self.resource_types), float(per_resource))
+
+    def sum(self):
+        """
+        Returns:
+            dict: resource type -> total over the users
+        """
+        totals = self.values.sum(axis=0) if len(self.users) else np.zeros(len(self.resource_types))
+        return {res_type: float(total) for res_type, total in zip(self.resource_types, totals)}
+
+    def normalize(self, capacity=1.):
+        """
+        Scale down every resource whose total exceeds the capacity (scalar or per-resource dict)
+        """
+        capacity = self._to_vector(capacity)
+        totals = self.values.sum(axis=0)
+        over = totals > capacity
+        if np.any(over):
+            self.values[:, over] *= capacity[over] / totals[over]
+        return self
+
+    def clip(self, lower=0., upper=float("inf")):
+        """
+        Clip every entry to [lower, upper] (scalars or per-resource dicts)
+        """
+        np.clip(self.values, self._to_vector(lower), self._to_vector(upper), out=self.values)
+        return self
+
+    def scale(self, factors):
+        """
+        New matrix with each resource multiplied by its factor (scalar or per-resource dict), e.g., shares to MB/Mbps
+        """
+        return AllocationMatrix(self.users, self.resource_types, self.values * self._to_vector(factors))
+
+    def to_dict(self):
+        return {user: self.row(user) for user in self.users}
+
+    def update_dict(self, allocation: dict):
+        """
+        Write the values back into an allocation dict, keeping its other keys
+        """
+        for user in self.users:
+            allocation.setdefault(user, {}).update(self.row(user))
+        return allocation
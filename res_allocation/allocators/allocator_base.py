@@ -4,6 +4,10 @@ import time
 import numpy as np
 from utils.logger import Logger
 from tqdm import tqdm
+from utils import metrics
+from utils.profiling import PhaseTimer
+from .quantizer import AllocationQuantizer
+from .resources import BASE_RESOURCE_TYPES, get_extra_resource_types, get_resource_types, get_capacity, get_limits
 
 base_search_granularity = float(1. / 200.)    # 2app: 0.125 / 4.0, 4apps: 0.125 / 8.0
 
@@ -14,7 +18,8 @@ class AllocatorParams:
         self.retrain = requires_retrain
 
 class ResourceAllocator:
-    def __init__(self, config_path: str, resource_scale: {} = {"cache": 1.0, "mem_bw": 1.0}, estimator=None, monitor=None, deployer=None):
+    def __init__(self, config_path: str, resource_scale: {} = {"cache": 1.0, "mem_bw": 1.0}, estimator=None, monitor=None, deployer=None,
+                 logger_name: str = 'spirit_ceei_allocator'):
         self.config_path = config_path
         self.resource_scale = resource_scale
         if estimator is None:
@@ -25,11 +30,32 @@ class ResourceAllocator:
         self.deployer = deployer
         # Logging
         self.logger = Logger()
-        self.logger.prepare_logger('spirit_ceei_allocator')
+        self.logger.prepare_logger(logger_name)
         self.parameters: AllocatorParams = None
         self.e2e_last_allocation = None
+        # optional ControllerSnapshot published once per round for the API server
+        self.snapshot = None
+        # per-phase timing of each round and optional on-demand profiling (see utils.profiling)
+        self.phase_timer = PhaseTimer()
+        self.profile_capture = None
+        # optional outer market dividing the memory-node bandwidth across VMs (see allocators.global_market)
+        self.global_market = None
+        # maps the fractional allocation of each round to enforcer units (see allocators.quantizer)
+        self.quantizer = AllocationQuantizer(resource_scale)
+        # optional work-conserving lending of idle resources after the solve (see allocators.slack)
+        self.slack_redistributor = None
+        # set by allocate_and_parse() when it reuses the previous allocation without solving
+        self.round_skipped = False
+        # VMs of the apps with a phase change, re-solved by an out-of-band round (None: all VMs)
+        self.out_of_band_vms = None
+        # the collection of a round lasts cadence_backoff times the nominal interval while no app changes phase
+        self.cadence_backoff = 1
+        # optional alternative allocators run in shadow on the monitor state of each round (see allocators.shadow)
+        self.shadow_evaluator = None
 
     def cleanup(self):
+        if self.shadow_evaluator is not None:
+            self.shadow_evaluator.close()
         self.logger.close()
 
     def initialize(self, param: AllocatorParams=AllocatorParams()):
@@ -42,61 +68,248 @@ class ResourceAllocator:
 
         self.logger.log_msg("Start resource allocator.")
         self.parameters = param
+        equal_split = [res_type for res_type in get_extra_resource_types(self.resource_scale)
+                       if res_type not in self.get_market_resource_types()]
+        if equal_split:
+            self.logger.log_msg(f"{type(self).__name__} does not price {equal_split}; they are split equally within each VM")
         # initialize the estimator (loading models, etc)
         self.estimator.initialize(self.config_path, self.parameters.search_granularity)
 
     def get_last_allocation(self):
         return self.e2e_last_allocation
 
-    def start(self, max_iteration: int=1e6, init_timer: int=180, skip_monitoring=False, verification_th=0.025):
+    def set_snapshot(self, snapshot):
+        self.snapshot = snapshot
+
+    def set_global_market(self, global_market):
+        self.global_market = global_market
+
+    def set_profile_capture(self, profile_capture):
+        self.profile_capture = profile_capture
+
+    def set_shadow_evaluator(self, shadow_evaluator):
+        self.shadow_evaluator = shadow_evaluator
+
+    def set_quantizer(self, quantizer):
+        self.quantizer = quantizer
+
+    def set_slack_redistributor(self, slack_redistributor):
+        self.slack_redistributor = slack_redistributor
+
+    def get_market_resource_types(self):
+        """
+        Resources the allocator decides on; the extra resources of the cluster are left to the equal split of
+        fill_extra_resources()
+        """
+        return list(BASE_RESOURCE_TYPES)
+
+    def get_vm_capacity(self, vm_id):
+        """
+        Capacity of a VM in enforcer units (MB, Mbps, and the units of the extra resources)
+        """
+        return {res_type: get_capacity(self.resource_scale, res_type) for res_type in get_resource_types(self.resource_scale)}
+
+    def fill_extra_resources(self, allocation):
+        """
+        Equal split of each VM's extra resources (e.g., CPU cores) among its users, for the users the allocator
+        left without one; allocators without a market for a resource leave it to this split
+        """
+        extra_resource_types = get_extra_resource_types(self.resource_scale)
+        if not extra_resource_types or not allocation:
+            return allocation
+        vm_to_app_map = self.monitor.get_vm_to_app_mapping() or {}
+        # entries that are not dicts are left to the deployer, which skips them
+        users = [user for user, alloc in allocation.items() if isinstance(alloc, dict)]
+        groups = {vm_id: [user for user in app_ids if user in users] for vm_id, app_ids in vm_to_app_map.items()}
+        grouped_users = set(user for group in groups.values() for user in group)
+        # users without a VM share one VM's worth of each resource
+        groups[None] = [user for user in users if user not in grouped_users]
+        for vm_id, group in groups.items():
+            if not group:
+                continue
+            capacity = self.get_vm_capacity(vm_id)
+            for res_type in extra_resource_types:
+                min_value, max_value = get_limits(self.resource_scale, res_type)
+                for user in group:
+                    if res_type not in allocation[user]:
+                        allocation[user][res_type] = min(max_value, max(min_value, capacity[res_type] / len(group)))
+        return allocation
+
+    def quantize_allocation(self, allocation):
+        """
+        Round the allocation of allocate_and_parse() to enforcer units under the capacity of each VM
+        """
+        allocation = self.fill_extra_resources(allocation)
+        vm_to_app_map = self.monitor.get_vm_to_app_mapping() or {}
+        vm_capacities = {vm_id: self.get_vm_capacity(vm_id) for vm_id in vm_to_app_map}
+        return self.quantizer.quantize(allocation, vm_to_app_map, vm_capacities)
+
+    def redistribute_slack(self, allocation):
+        """
+        Lend persistently idle resources of the allocation of allocate_and_parse() within each VM
+        """
+        if self.slack_redistributor is None:
+            return allocation
+        allocation = self.slack_redistributor.redistribute(
+            allocation, self.monitor.get_vm_to_app_mapping(), self.monitor, self.estimator)
+        if self.slack_redistributor.lent:
+            self.logger.log_msg(f"Slack lent: {self.slack_redistributor.lent} | borrowed: {self.slack_redistributor.borrowed}")
+        return allocation
+
+    def publish_snapshot(self, iteration):
+        if self.snapshot is None:
+            return
+        with self.monitor.lock:
+            self.snapshot.publish(self, iteration)
+
+    def get_checkpoint_state(self):
+        state = {"e2e_last_allocation": self.e2e_last_allocation}
+        if self.slack_redistributor is not None:
+            state["slack_state"] = self.slack_redistributor.get_state()
+        # learned state of online estimators
+        if hasattr(self.estimator, "get_checkpoint_state"):
+            state["estimator_state"] = self.estimator.get_checkpoint_state()
+        return state
+
+    def load_checkpoint_state(self, state):
+        self.e2e_last_allocation = state["e2e_last_allocation"]
+        if self.slack_redistributor is not None and "slack_state" in state:
+            self.slack_redistributor.load_state(state["slack_state"])
+        if hasattr(self.estimator, "load_checkpoint_state") and "estimator_state" in state:
+            self.estimator.load_checkpoint_state(state["estimator_state"])
+
+    def start(self, max_iteration: int=1e6, init_timer: int=180, skip_monitoring=False, verification_th=0.025, checkpoint=None, no_wait=False):
         if self.parameters is None:
             raise ValueError("Resource allocator is not initialized.")
 
-        # pre-running
-        # run algorithm to get new allocation
-        allocation = self.allocate_and_parse(skip_monitoring=skip_monitoring)
-        # send allocation to the controller
-        time.sleep(10)  # to enforce the initial allocation
-        self.deployer.deploy(allocation)
-        self.e2e_last_allocation = allocation
-        # set last allocation to estimator
-        self.monitor.set_last_allocation(allocation)
         sleep_interval: float = self.parameters.allocation_interval_in_sec / float(self.parameters.measurements_per_alloc)
         print(f"Max iteration: {max_iteration}, Allocation interval: {self.parameters.allocation_interval_in_sec} sec, #measurement per alloc: {self.parameters.measurements_per_alloc}, sleep interval: {sleep_interval} sec", flush=True)
-        print(f"Initial wait for {init_timer} seconds (cache-warm up).")
-        for _ in tqdm(range(init_timer, 0, -1)):
-            time.sleep(1)
-
-        for iteration in range(int(max_iteration)):
+        # warm restart from a fresh checkpoint: resume the dynamic allocation immediately
+        if checkpoint is not None and checkpoint.restore(self.monitor, self) and self.e2e_last_allocation:
+            print(f"Resumed from checkpoint: {checkpoint.path}", flush=True)
+            self.deployer.deploy(self.e2e_last_allocation)
+            self.monitor.set_last_allocation(self.e2e_last_allocation)
+            self.publish_snapshot(-1)
+        else:
+            # pre-running
             # run algorithm to get new allocation
-            allocation = self.allocate_and_parse(skip_monitoring=skip_monitoring)
+            allocation = self.quantize_allocation(self.allocate_and_parse(skip_monitoring=skip_monitoring))
             # send allocation to the controller
+            if not no_wait:
+                time.sleep(10)  # to enforce the initial allocation
             self.deployer.deploy(allocation)
             self.e2e_last_allocation = allocation
             # set last allocation to estimator
             self.monitor.set_last_allocation(allocation)
+            self.publish_snapshot(-1)
+            if not no_wait:
+                print(f"Initial wait for {init_timer} seconds (cache-warm up).")
+                for _ in tqdm(range(init_timer, 0, -1)):
+                    time.sleep(1)
+
+        for iteration in range(int(max_iteration)):
+            # replayed traces end when all recorded responses are consumed
+            if self.monitor.is_exhausted():
+                print(f"Monitor exhausted after {iteration} iterations", flush=True)
+                break
+            self.phase_timer.start_round()
+            if self.profile_capture is not None:
+                self.profile_capture.on_round_start()
+            # run algorithm to get new allocation (API writes such as resets wait for the round)
+            alloc_start_time = time.perf_counter()
+            with self.phase_timer.phase("allocate"), self.monitor.lock:
+                allocation = self.allocate_and_parse(skip_monitoring=skip_monitoring)
+                if not skip_monitoring:
+                    allocation = self.redistribute_slack(allocation)
+                allocation = self.quantize_allocation(allocation)
+            metrics.ALLOCATION_LATENCY.observe(time.perf_counter() - alloc_start_time, allocator=type(self).__name__)
+            metrics.ALLOCATION_ROUNDS.inc(allocator=type(self).__name__)
+            # alternative allocators decide on the same monitor state in the background
+            if self.shadow_evaluator is not None and not skip_monitoring:
+                with self.phase_timer.phase("shadow"), self.monitor.lock:
+                    self.shadow_evaluator.submit(self, allocation, iteration)
+            # send allocation to the controller
+            with self.phase_timer.phase("deploy"):
+                # the enforcer already runs an unchanged allocation
+                if self.round_skipped and allocation == self.e2e_last_allocation:
+                    metrics.DEPLOY_SKIPS.inc(allocator=type(self).__name__)
+                else:
+                    self.deployer.deploy(allocation)
+            with self.monitor.lock:
+                # estimated change of the deployed allocation, checked against the measurements (see estimators.calibration)
+                if not skip_monitoring and hasattr(self.estimator, "record_deployment"):
+                    self.estimator.record_deployment(self.e2e_last_allocation, allocation)
+                self.e2e_last_allocation = allocation
+                # set last allocation to estimator
+                self.monitor.set_last_allocation(allocation)
             # collect data for a while
-            for _ in range(self.parameters.measurements_per_alloc):
+            change_points = {}
+            for _ in range(self.parameters.measurements_per_alloc * self.cadence_backoff):
                 # sleep for a while
-                sleep(sleep_interval)
+                if not no_wait:
+                    with self.phase_timer.phase("sleep"):
+                        sleep(sleep_interval)
                 # collect data from monitor
-                self.monitor.collect(verification_th)
+                with self.phase_timer.phase("collect"):
+                    self.monitor.collect(verification_th)
+                # a phase change cuts the round short
+                change_points = self.monitor.pop_change_points()
+                if change_points:
+                    break
+            self._update_cadence(iteration, change_points)
 
             # consume buffered/collected data
             if not skip_monitoring:
-                self.monitor.comsume_collected_data()
-                if self.parameters.retrain:
-                    # call estimator for profile update
-                    self.estimator.update_profile(
-                        self.monitor, self.parameters.init_phase_interval,
-                        search_granularity=self.parameters.search_granularity,
-                        retraining_interval=self.parameters.init_phase_interval, retraining_data_size=3)
+                with self.monitor.lock:
+                    with self.phase_timer.phase("consume"):
+                        self.monitor.comsume_collected_data()
+                        if hasattr(self.monitor, "update_footprint_metrics"):
+                            self.monitor.update_footprint_metrics()
+                        if hasattr(self.estimator, "update_calibration"):
+                            self.estimator.update_calibration()
+                    if self.parameters.retrain:
+                        # call estimator for profile update
+                        with self.phase_timer.phase("retrain"):
+                            self.estimator.update_profile(
+                                self.monitor, self.parameters.init_phase_interval,
+                                search_granularity=self.parameters.search_granularity,
+                                retraining_interval=self.parameters.init_phase_interval, retraining_data_size=3)
+
+            # store the learned state for warm restarts
+            if checkpoint is not None and checkpoint.need_save(iteration):
+                with self.phase_timer.phase("checkpoint"), self.monitor.lock:
+                    checkpoint.save(self.monitor, self)
+            with self.phase_timer.phase("snapshot"):
+                self.publish_snapshot(iteration)
+
+            if self.profile_capture is not None:
+                self.profile_capture.on_round_end()
+            phase_times = self.phase_timer.end_round()
+            self.logger.log_msg(f"Iter: {iteration} | Phase time (ms): { {name: round(value, 3) for name, value in phase_times.items()} }")
+            # the round overran its budget if anything but the sleeps took longer than the interval
+            busy_time = phase_times.get("total", 0.) - phase_times.get("sleep", 0.)
+            if not no_wait and busy_time > self.parameters.allocation_interval_in_sec * 1e3:
+                self.logger.log_msg(f"Iter: {iteration} | Round overran: {busy_time:.1f} ms busy > {self.parameters.allocation_interval_in_sec} sec interval", level='warning')
 
             print(f"{datetime.datetime.now()} Iter: {iteration} | Search granularity: {self.parameters.search_granularity}")
 
     def allocate_and_parse(self, skip_monitoring=False):
         raise Exception("Not implemented.")
 
+    def _update_cadence(self, iteration, change_points):
+        """
+        Back the cadence off while no app changes phase; on a change, reallocate the VMs of the changed apps right away
+        """
+        if change_points:
+            app_to_vm = {app_id: vm_id for vm_id, app_ids in (self.monitor.get_vm_to_app_mapping() or {}).items() for app_id in app_ids}
+            self.out_of_band_vms = {app_to_vm[app_id] for app_id in change_points if app_id in app_to_vm} or None
+            self.cadence_backoff = 1
+            metrics.OUT_OF_BAND_ROUNDS.inc(allocator=type(self).__name__)
+            self.logger.log_msg(f"Iter: {iteration} | Phase change of apps {sorted(change_points)}, out-of-band reallocation of VMs {self.out_of_band_vms}")
+        else:
+            self.out_of_band_vms = None
+            self.cadence_backoff = min(self.cadence_backoff * 2, self.monitor.max_cadence_backoff)
+
     def get_num_vms(self):
         # Get the number of VMs from the config
         num_vms = 1  # Default to 1 VM
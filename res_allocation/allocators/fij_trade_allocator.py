@@ -3,6 +3,7 @@ import time
 import statistics
 import numpy as np
 from .allocator_base import ResourceAllocator, AllocatorParams, base_search_granularity
+from .allocation_matrix import AllocationMatrix
 
 
 _search_granularity = base_search_granularity
@@ -14,9 +15,13 @@ class FijTradeAllocatorParams(AllocatorParams):
         init_phase_interval: float = 6, # 2 was for 30 sec interval, so we will use 6 for 10 sec interval
         search_granularity: float = _search_granularity,    # 2app: 0.125 / 4.0, 4apps: 0.125 / 8.0
         measurements_per_alloc: float = 0.25,  # it's per second
+        step_multipliers: tuple = (1, 2, 4, 8),   # trade sizes probed per round, in search_granularity units
+        max_trades_per_round: int = None,   # disjoint trades per VM per round (None: as many as pairs)
     ) -> None:
         super().__init__(search_granularity, allocation_interval_in_sec)
         self.init_phase_interval = init_phase_interval
+        self.step_multipliers = tuple(sorted(set(int(k) for k in step_multipliers if int(k) > 0)))
+        self.max_trades_per_round = max_trades_per_round
         self.measurements_per_alloc = (
             int(allocation_interval_in_sec * measurements_per_alloc)
         )
@@ -30,8 +35,9 @@ class FijTradeAllocator(ResourceAllocator):
         estimator=None,
         monitor=None,
         deployer=None,
+        logger_name: str = 'spirit_ceei_allocator',
     ):
-        super().__init__(config_path, resource_scale, estimator, monitor, deployer)
+        super().__init__(config_path, resource_scale, estimator, monitor, deployer, logger_name)
         self.last_allocation = None
         self.last_static_allocation = None
         self.last_static_performance = None
@@ -43,6 +49,23 @@ class FijTradeAllocator(ResourceAllocator):
         super().initialize(param)
         self.parameters: FijTradeAllocatorParams = param
 
+    def get_checkpoint_state(self):
+        state = super().get_checkpoint_state()
+        state.update({
+            "last_allocation": self.last_allocation,
+            "last_static_allocation": self.last_static_allocation,
+            "last_static_performance": self.last_static_performance,
+            "last_adjusted_users": self.last_adjusted_users,
+        })
+        return state
+
+    def load_checkpoint_state(self, state):
+        super().load_checkpoint_state(state)
+        self.last_allocation = state["last_allocation"]
+        self.last_static_allocation = state["last_static_allocation"]
+        self.last_static_performance = state["last_static_performance"]
+        self.last_adjusted_users = state["last_adjusted_users"]
+
     def is_static_allocation(self, skip_monitoring):
         static_alloc = True
 
@@ -102,7 +125,6 @@ class FijTradeAllocator(ResourceAllocator):
             )
             if key == "mem_bw":
                 allocation[key] *= 1024  # gb to mb
-            allocation[key] = int(allocation[key])
             last_allocation[key] = 1. / float(num_users)
 
         return allocation, last_allocation
@@ -339,7 +361,6 @@ class FijTradeAllocator(ResourceAllocator):
                         )
                         if key == "mem_bw":
                             allocation[user][key] *= 1024.0  # gb to mb
-                        allocation[user][key] = int(allocation[user][key])
                 if user <= verbose_n_user:
                     self.logger.log_msg(f"VM {vm_id} - Current allocation for user {user}: {vm_cur_alloc[user]} // {allocation[user]}")
 
@@ -388,24 +409,17 @@ class FijTradeAllocator(ResourceAllocator):
         # Initialize current allocation
         cur_alloc = self._initialize_allocation(users, resource_types)
 
-        # Find cache and bandwidth sensitivity for each user
+        # Find cache and bandwidth sensitivity for each user (all step sizes in one batched pass)
         sensitivity_scores = self._calculate_sensitivity_scores(vm_id, users, cur_alloc, resource_units)
 
-        # Find best cache-sensitive and bw-sensitive users
-        cache_sensitive_user = self._find_most_cache_sensitive_user(sensitivity_scores)
-        bw_sensitive_user = self._find_most_bw_sensitive_user(sensitivity_scores, exclude_user=cache_sensitive_user)
-
-        # Perform trade if we found suitable users
-        if cache_sensitive_user and bw_sensitive_user:
-            self._trade_resources(vm_id, cur_alloc, cache_sensitive_user, bw_sensitive_user, resource_units)
-
-            # Add these users to the last adjusted users set
-            if vm_id not in self.last_adjusted_users:
-                self.last_adjusted_users[vm_id] = set()
-            self.last_adjusted_users[vm_id].add(cache_sensitive_user)
-            self.last_adjusted_users[vm_id].add(bw_sensitive_user)
+        # Pick disjoint (cache-sensitive, bw-sensitive) pairs and the trade size of each pair
+        trades = self._select_trades(sensitivity_scores)
 
-            self.logger.log_msg(f"Traded resources between cache-sensitive user {cache_sensitive_user} and bw-sensitive user {bw_sensitive_user}")
+        # Perform the trades
+        for cache_sensitive_user, bw_sensitive_user, multiplier in trades:
+            trade_units = {key: unit * multiplier for key, unit in resource_units.items()}
+            self._trade_resources(vm_id, cur_alloc, cache_sensitive_user, bw_sensitive_user, trade_units)
+            self.logger.log_msg(f"Traded resources ({multiplier} units) between cache-sensitive user {cache_sensitive_user} and bw-sensitive user {bw_sensitive_user}")
 
         # Normalize allocations to ensure they sum to 1.0
         self._normalize_allocations(cur_alloc, resource_types, users)
@@ -418,6 +432,9 @@ class FijTradeAllocator(ResourceAllocator):
     def _calculate_sensitivity_scores(self, vm_id, users, cur_alloc, resource_units):
         """
         Calculate sensitivity scores for each user to determine if they are cache-sensitive or bw-sensitive.
+        All probes of a user (current allocation and every step size in both directions) are
+        estimated in a single batched call. The calls are not batched across users: the estimator
+        models each user separately (its MRC, usage and calibration), so a round costs one call per user.
 
         Args:
             vm_id: VM identifier
@@ -426,9 +443,17 @@ class FijTradeAllocator(ResourceAllocator):
             resource_units: Resource units dict
 
         Returns:
-            dict: Sensitivity scores for each user
+            dict: Sensitivity scores for each user; "cache_gains"/"bw_gains" map a step multiplier to the
+                relative performance gain of trading that many units of mem_bw for cache (or vice versa)
         """
         sensitivity_scores = {}
+        step_multipliers = getattr(self.parameters, "step_multipliers", (1,))
+
+        # Get normalized min/max values
+        min_cache_norm = self.resource_scale.get("min_cache", 0.0) / self.resource_scale["cache"]
+        max_cache_norm = self.resource_scale.get("max_cache", self.resource_scale["cache"]) / self.resource_scale["cache"]
+        min_mem_bw_norm = self.resource_scale.get("min_mem_bw", 0.0) / self.resource_scale["mem_bw"]
+        max_mem_bw_norm = self.resource_scale.get("max_mem_bw", self.resource_scale["mem_bw"]) / self.resource_scale["mem_bw"]
 
         for user in users:
             # Skip if user not in current allocation
@@ -443,123 +468,97 @@ class FijTradeAllocator(ResourceAllocator):
             cache_alloc = cur_alloc[user]["cache"]
             mem_bw_alloc = cur_alloc[user]["mem_bw"]
 
-            # Calculate absolute values for resource allocation
-            abs_cache = cache_alloc * self.resource_scale["cache"]
-            abs_mem_bw = mem_bw_alloc * self.resource_scale["mem_bw"]
-
-            # Get current performance
-            current_perf = self.estimator.get_estimation(user, abs_cache, abs_mem_bw)
-
-            # Calculate performance with more cache but less mem_bw
-            more_cache_less_bw_perf = None
-            # Get normalized min/max values
-            min_cache_norm = self.resource_scale.get("min_cache", 0.0) / self.resource_scale["cache"]
-            max_cache_norm = self.resource_scale.get("max_cache", self.resource_scale["cache"]) / self.resource_scale["cache"]
-            min_mem_bw_norm = self.resource_scale.get("min_mem_bw", 0.0) / self.resource_scale["mem_bw"]
-            max_mem_bw_norm = self.resource_scale.get("max_mem_bw", self.resource_scale["mem_bw"]) / self.resource_scale["mem_bw"]
-
-            if (cache_alloc + resource_units["cache"] <= max_cache_norm and
-                mem_bw_alloc - resource_units["mem_bw"] >= min_mem_bw_norm):
-                more_cache_abs = (cache_alloc + resource_units["cache"]) * self.resource_scale["cache"]
-                less_bw_abs = (mem_bw_alloc - resource_units["mem_bw"]) * self.resource_scale["mem_bw"]
-                more_cache_less_bw_perf = self.estimator.get_estimation(user, more_cache_abs, less_bw_abs)
-
-            # Calculate performance with less cache but more mem_bw
-            less_cache_more_bw_perf = None
-            if (cache_alloc - resource_units["cache"] >= min_cache_norm and
-                mem_bw_alloc + resource_units["mem_bw"] <= max_mem_bw_norm):
-                less_cache_abs = (cache_alloc - resource_units["cache"]) * self.resource_scale["cache"]
-                more_bw_abs = (mem_bw_alloc + resource_units["mem_bw"]) * self.resource_scale["mem_bw"]
-                less_cache_more_bw_perf = self.estimator.get_estimation(user, less_cache_abs, more_bw_abs)
-
-            # Calculate sensitivity scores
-            cache_sensitivity = 0
-            bw_sensitivity = 0
-
-            if current_perf is not None:
-                if more_cache_less_bw_perf is not None:
-                    cache_sensitivity = (more_cache_less_bw_perf - current_perf) / current_perf
-
-                if less_cache_more_bw_perf is not None:
-                    bw_sensitivity = (less_cache_more_bw_perf - current_perf) / current_perf
-
-            # Store sensitivity scores
+            # Probes: current allocation, then (+k cache, -k bw) and (-k cache, +k bw) within the limits
+            probes = [("current", None, cache_alloc, mem_bw_alloc)]
+            for k in step_multipliers:
+                cache_step = resource_units["cache"] * k
+                mem_bw_step = resource_units["mem_bw"] * k
+                if cache_alloc + cache_step <= max_cache_norm and mem_bw_alloc - mem_bw_step >= min_mem_bw_norm:
+                    probes.append(("cache", k, cache_alloc + cache_step, mem_bw_alloc - mem_bw_step))
+                if cache_alloc - cache_step >= min_cache_norm and mem_bw_alloc + mem_bw_step <= max_mem_bw_norm:
+                    probes.append(("mem_bw", k, cache_alloc - cache_step, mem_bw_alloc + mem_bw_step))
+
+            perfs = self.estimator.get_estimations(
+                user,
+                [probe[2] * self.resource_scale["cache"] for probe in probes],
+                [probe[3] * self.resource_scale["mem_bw"] for probe in probes])
+            current_perf = float(perfs[0])
+
+            # Calculate sensitivity scores (relative gain per step size)
+            cache_gains = {}
+            bw_gains = {}
+            if current_perf > 0:
+                for (direction, k, _, _), perf in zip(probes[1:], perfs[1:]):
+                    if perf < 0:
+                        continue
+                    gain = (float(perf) - current_perf) / current_perf
+                    if direction == "cache":
+                        cache_gains[k] = gain
+                    else:
+                        bw_gains[k] = gain
+
+            # Store sensitivity scores (single-unit scores as before)
             sensitivity_scores[user] = {
-                "cache_sensitivity": cache_sensitivity,
-                "bw_sensitivity": bw_sensitivity,
+                "cache_sensitivity": cache_gains.get(1, 0),
+                "bw_sensitivity": bw_gains.get(1, 0),
+                "cache_gains": cache_gains,
+                "bw_gains": bw_gains,
                 "current_perf": current_perf
             }
 
             # Log sensitivity scores
-            self.logger.log_msg(f"User {user} - Cache sensitivity: {cache_sensitivity}, BW sensitivity: {bw_sensitivity}")
+            self.logger.log_msg(f"User {user} - Cache sensitivity: {cache_gains}, BW sensitivity: {bw_gains}")
 
         # Reset the last adjusted users for this VM
         self.last_adjusted_users[vm_id] = set()
 
         return sensitivity_scores
 
-    def _find_most_cache_sensitive_user(self, sensitivity_scores):
-        """
-        Find the user who would benefit most from trading BW for cache.
-        A negative cache sensitivity means the user prefers cache over BW.
-
-        Args:
-            sensitivity_scores: Dict of sensitivity scores
-
-        Returns:
-            str: User ID of the most cache-sensitive user, or None if none found
-        """
-        most_cache_sensitive_user = None
-        best_score = 0
-
-        for user, scores in sensitivity_scores.items():
-            # For cache-sensitive user, we want someone who benefits from more cache
-            # and is harmed by less cache (negative bw_sensitivity)
-            cache_score = scores["cache_sensitivity"]
-            bw_score = scores["bw_sensitivity"]
-
-            # User is cache-sensitive if they benefit more from additional cache
-            # than from additional bandwidth
-            if cache_score > 0 and cache_score > bw_score:
-                if most_cache_sensitive_user is None or cache_score > best_score:
-                    most_cache_sensitive_user = user
-                    best_score = cache_score
+    @staticmethod
+    def _get_marginal_rate(gains):
+        """Best relative gain per traded unit over the probed step sizes (the user's MRS gap)"""
+        rates = [gain / k for k, gain in gains.items() if gain > 0]
+        return max(rates) if rates else 0.
 
-        return most_cache_sensitive_user
-
-    def _find_most_bw_sensitive_user(self, sensitivity_scores, exclude_user=None):
+    def _select_trades(self, sensitivity_scores):
         """
-        Find the user who would benefit most from trading cache for BW.
-        A negative BW sensitivity means the user prefers BW over cache.
+        Select disjoint trades for one round.
 
-        Args:
-            sensitivity_scores: Dict of sensitivity scores
-            exclude_user: User ID to exclude (typically the cache-sensitive user)
+        Users are ranked by their marginal-rate-of-substitution gap: the best per-unit gain of
+        buying cache with mem_bw (cache buyers) or mem_bw with cache (bw buyers). Buyers are paired
+        in rank order, and each pair trades the step size that maximizes the combined gain while
+        both users still gain.
 
         Returns:
-            str: User ID of the most BW-sensitive user, or None if none found
+            list: [(cache_sensitive_user, bw_sensitive_user, step multiplier)]
         """
-        most_bw_sensitive_user = None
-        best_score = 0
-
+        cache_buyers = []
+        bw_buyers = []
         for user, scores in sensitivity_scores.items():
-            # Skip the excluded user
-            if user == exclude_user:
+            cache_rate = self._get_marginal_rate(scores["cache_gains"])
+            bw_rate = self._get_marginal_rate(scores["bw_gains"])
+            # User is cache-sensitive if they benefit more from additional cache than from additional bandwidth
+            if cache_rate > 0 and cache_rate > bw_rate:
+                cache_buyers.append((cache_rate, user))
+            elif bw_rate > 0 and bw_rate > cache_rate:
+                bw_buyers.append((bw_rate, user))
+        cache_buyers.sort(key=lambda entry: (-entry[0], entry[1]))
+        bw_buyers.sort(key=lambda entry: (-entry[0], entry[1]))
+
+        max_trades = self.parameters.max_trades_per_round if getattr(self.parameters, "max_trades_per_round", None) else len(sensitivity_scores)
+        trades = []
+        for (_, cache_user), (_, bw_user) in zip(cache_buyers, bw_buyers):
+            if len(trades) >= max_trades:
+                break
+            cache_gains = sensitivity_scores[cache_user]["cache_gains"]
+            bw_gains = sensitivity_scores[bw_user]["bw_gains"]
+            candidates = [(cache_gains[k] + bw_gains[k], k) for k in cache_gains.keys() & bw_gains.keys()
+                          if cache_gains[k] > 0 and bw_gains[k] > 0]
+            if not candidates:
                 continue
-
-            # For BW-sensitive user, we want someone who benefits from more BW
-            # and is harmed by less BW
-            cache_score = scores["cache_sensitivity"]
-            bw_score = scores["bw_sensitivity"]
-
-            # User is BW-sensitive if they benefit more from additional bandwidth
-            # than from additional cache
-            if bw_score > 0 and bw_score > cache_score:
-                if most_bw_sensitive_user is None or bw_score > best_score:
-                    most_bw_sensitive_user = user
-                    best_score = bw_score
-
-        return most_bw_sensitive_user
+            _, multiplier = max(candidates)
+            trades.append((cache_user, bw_user, multiplier))
+        return trades
 
     def _trade_resources(self, vm_id, cur_alloc, cache_sensitive_user, bw_sensitive_user, resource_units):
         """
@@ -638,11 +637,7 @@ class FijTradeAllocator(ResourceAllocator):
             resource_types: List of resource types
             users: List of user IDs
         """
-        for res_type in resource_types:
-            total = sum(cur_alloc[user][res_type] for user in users)
-            if total > 1:
-                for user in users:
-                    cur_alloc[user][res_type] /= total
+        AllocationMatrix.from_dict(cur_alloc, users, resource_types).normalize().update_dict(cur_alloc)
 
     def _get_current_performance(self, user):
         """
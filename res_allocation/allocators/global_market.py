@@ -0,0 +1,134 @@
+import numpy as np
+from .allocator_base import base_search_granularity
+
+
+def upper_concave_hull(xs, ys):
+    """
+    Upper concave envelope of a sampled utility curve (xs ascending).
+
+    Returns:
+        list of (slope, length) segments with non-increasing slopes
+    """
+    hull = []
+    for x, y in zip(xs, ys):
+        # pop the last point while it lies on or below the chord to the new point
+        while len(hull) >= 2:
+            (x0, y0), (x1, y1) = hull[-2], hull[-1]
+            if (y1 - y0) * (x - x0) <= (y - y0) * (x1 - x0):
+                hull.pop()
+            else:
+                break
+        hull.append((x, y))
+    return [((y1 - y0) / (x1 - x0), x1 - x0) for (x0, y0), (x1, y1) in zip(hull[:-1], hull[1:])]
+
+
+class GlobalBandwidthMarket:
+    '''
+    Outer market of the two-level allocation: divides the memory-node bandwidth across the compute VMs.
+
+    Each app contributes the concave envelope of its estimated performance over its bandwidth range
+    (at its current cache allocation); the node bandwidth is water-filled over the segments of all apps
+    in the order of their marginal utility, and a VM's share is the sum over its apps. The per-VM allocator
+    then clears cache and bandwidth within the share of its VM.
+
+    Shares are in the unit of resource_scale["mem_bw"], i.e., 1.0 is the nominal bandwidth of a single VM.
+    '''
+    def __init__(self, total_mem_bw_in_gbps: float, resource_scale: dict,
+                 search_granularity: float = base_search_granularity * 5,
+                 smoothing: float = 0.5):
+        self.resource_scale = resource_scale
+        self.total_share = float(total_mem_bw_in_gbps) / resource_scale["mem_bw"]
+        self.search_granularity = search_granularity
+        # weight of the new shares against the previous ones, to damp oscillation between rounds
+        self.smoothing = smoothing
+        self.last_vm_shares = {}
+
+    def get_equal_shares(self, vm_ids: list):
+        """
+        Shares of the static allocation: equal split of the node, at most the nominal bandwidth per VM
+        """
+        if not vm_ids:
+            return {}
+        share = min(1., self.total_share / len(vm_ids))
+        return dict.fromkeys(vm_ids, share)
+
+    def _get_demand_segments(self, user, cache_in_mb, estimator, min_share, max_share):
+        grid = np.arange(min_share, max_share + 1e-9, self.search_granularity)
+        if len(grid) < 2:
+            return []
+        if hasattr(estimator, "get_estimations"):
+            utils = estimator.get_estimations(user, np.full(len(grid), cache_in_mb), grid * self.resource_scale["mem_bw"])
+        else:
+            utils = np.array([estimator.get_estimation(user, cache_in_mb, share * self.resource_scale["mem_bw"]) for share in grid])
+        if np.any(np.asarray(utils) < 0):
+            return None
+        return upper_concave_hull(grid, utils)
+
+    def get_vm_shares(self, vm_to_users: dict, estimator, last_allocation: dict):
+        """
+        Args:
+            vm_to_users: vm_id -> list of user IDs
+            estimator: performance estimator (get_estimation/get_estimations)
+            last_allocation: user -> {"cache": share, "mem_bw": share} of the previous round
+
+        Returns:
+            dict: vm_id -> bandwidth share of the VM
+        """
+        min_share = self.resource_scale["min_mem_bw"] / self.resource_scale["mem_bw"]
+        max_share = self.resource_scale["max_mem_bw"] / self.resource_scale["mem_bw"]
+        equal_shares = self.get_equal_shares(list(vm_to_users.keys()))
+
+        # every app starts from its minimum bandwidth
+        user_shares = {}
+        segments = []
+        for vm_id, users in vm_to_users.items():
+            for user in users:
+                user_shares[user] = min_share
+                alloc = (last_allocation or {}).get(user)
+                cache_share = alloc["cache"] if alloc and "cache" in alloc else 1. / len(users)
+                user_segments = self._get_demand_segments(
+                    user, cache_share * self.resource_scale["cache"], estimator, min_share, max_share)
+                if user_segments is None:
+                    # no estimate: bid for the equal split of its VM share
+                    user_segments = [(float("inf"), max(0., equal_shares[vm_id] / len(users) - min_share))]
+                segments.extend((slope, length, user) for slope, length in user_segments)
+
+        remaining = self.total_share - len(user_shares) * min_share
+        if remaining < 0:
+            # the node cannot serve the minimum of every app; scale the minimums down
+            scale = self.total_share / (len(user_shares) * min_share)
+            user_shares = {user: share * scale for user, share in user_shares.items()}
+            remaining = 0.
+
+        # water-filling in the order of marginal utility
+        segments.sort(key=lambda segment: segment[0], reverse=True)
+        for slope, length, user in segments:
+            if remaining <= 0. or slope <= 0.:
+                break
+            grant = min(length, remaining)
+            user_shares[user] += grant
+            remaining -= grant
+
+        vm_shares = {vm_id: float(sum(user_shares[user] for user in users)) for vm_id, users in vm_to_users.items()}
+
+        # bandwidth nobody benefits from is split across VMs with headroom instead of being stranded
+        while remaining > 1e-9:
+            headroom = {vm_id: len(users) * max_share - vm_shares[vm_id] for vm_id, users in vm_to_users.items()
+                        if len(users) * max_share - vm_shares[vm_id] > 1e-9}
+            if not headroom:
+                break
+            grant = remaining / len(headroom)
+            for vm_id, room in headroom.items():
+                vm_shares[vm_id] += min(grant, room)
+                remaining -= min(grant, room)
+
+        # damp the change from the previous round, then fit the node capacity again
+        for vm_id in vm_shares:
+            if vm_id in self.last_vm_shares:
+                vm_shares[vm_id] = self.smoothing * vm_shares[vm_id] + (1. - self.smoothing) * self.last_vm_shares[vm_id]
+        total = sum(vm_shares.values())
+        if total > self.total_share:
+            vm_shares = {vm_id: share * self.total_share / total for vm_id, share in vm_shares.items()}
+
+        self.last_vm_shares = vm_shares
+        return vm_shares
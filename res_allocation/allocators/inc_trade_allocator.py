@@ -1,8 +1,10 @@
 import copy
 import time
+import heapq
 import statistics
 import numpy as np
 from .allocator_base import ResourceAllocator, AllocatorParams, base_search_granularity
+from .allocation_matrix import AllocationMatrix
 
 
 _search_granularity = base_search_granularity
@@ -14,9 +16,19 @@ class IncrementalTradeAllocatorParams(AllocatorParams):
         init_phase_interval: float = 6, # 2 was for 30 sec interval, so we will use 6 for 10 sec interval
         search_granularity: float = _search_granularity,    # 2app: 0.125 / 4.0, 4apps: 0.125 / 8.0
         measurements_per_alloc: float = 0.25,  # it's per second
+        max_adjustments_per_round: int = None,  # None: half of the users in the VM
+        step_growth: float = 2.0,   # step multiplier after an improvement (or a tolerated harvest)
+        step_shrink: float = 0.5,   # step multiplier after a regression
+        max_step_multiplier: float = 8.0,
+        pending_effect_timeout: int = 3,    # rounds to wait for measurements after an adjustment
     ) -> None:
         super().__init__(search_granularity, allocation_interval_in_sec)
         self.init_phase_interval = init_phase_interval
+        self.max_adjustments_per_round = max_adjustments_per_round
+        self.step_growth = step_growth
+        self.step_shrink = step_shrink
+        self.max_step_multiplier = max_step_multiplier
+        self.pending_effect_timeout = pending_effect_timeout
         self.measurements_per_alloc = (
             int(allocation_interval_in_sec * measurements_per_alloc)
         )
@@ -30,8 +42,9 @@ class IncrementalTradeAllocator(ResourceAllocator):
         estimator=None,
         monitor=None,
         deployer=None,
+        logger_name: str = 'spirit_ceei_allocator',
     ):
-        super().__init__(config_path, resource_scale, estimator, monitor, deployer)
+        super().__init__(config_path, resource_scale, estimator, monitor, deployer, logger_name)
         self.last_allocation = None
         self.last_static_allocation = None
         self.last_static_performance = None
@@ -56,13 +69,44 @@ class IncrementalTradeAllocator(ResourceAllocator):
         # each should be in range of [0, 1]
         self.remaining_resources = {'cache': 0, 'mem_bw': 0}
 
-        # Track users whose resources were adjusted in the previous iteration for each VM
-        self.last_adjusted_users = {}
+        # Adjustments whose effect has not been measured yet
+        # Structure: vm_id -> user_id -> {'res_type', 'direction', 'performance', 'units', 'iteration'}
+        self.pending_effects = {}
+
+        # Adaptive step size per user, as a multiple of the search granularity
+        # Structure: user_id -> {'cache': float, 'mem_bw': float}
+        self.user_step_multipliers = {}
 
     def initialize(self, param: AllocatorParams = IncrementalTradeAllocatorParams(1.0)):
         super().initialize(param)
         self.parameters: IncrementalTradeAllocatorParams = param
 
+    def get_checkpoint_state(self):
+        state = super().get_checkpoint_state()
+        state.update({
+            "last_allocation": self.last_allocation,
+            "last_static_allocation": self.last_static_allocation,
+            "last_static_performance": self.last_static_performance,
+            "user_performances": self.user_performances,
+            "vm_allocation_decisions": self.vm_allocation_decisions,
+            "remaining_resources": self.remaining_resources,
+            "pending_effects": self.pending_effects,
+            "user_step_multipliers": self.user_step_multipliers,
+        })
+        return state
+
+    def load_checkpoint_state(self, state):
+        super().load_checkpoint_state(state)
+        self.last_allocation = state["last_allocation"]
+        self.last_static_allocation = state["last_static_allocation"]
+        self.last_static_performance = state["last_static_performance"]
+        self.user_performances = state["user_performances"]
+        self.vm_allocation_decisions = state["vm_allocation_decisions"]
+        self.remaining_resources = state["remaining_resources"]
+        # checkpoints from before the adaptive steps have no pending effects
+        self.pending_effects = state.get("pending_effects", {})
+        self.user_step_multipliers = state.get("user_step_multipliers", {})
+
     def is_static_allocation(self, skip_monitoring):
         static_alloc = True
 
@@ -122,7 +166,6 @@ class IncrementalTradeAllocator(ResourceAllocator):
             )
             if key == "mem_bw":
                 allocation[key] *= 1024  # gb to mb
-            allocation[key] = int(allocation[key])
             last_allocation[key] = 1. / float(num_users)
 
         return allocation, last_allocation
@@ -362,7 +405,6 @@ class IncrementalTradeAllocator(ResourceAllocator):
                         )
                         if key == "mem_bw":
                             allocation[user][key] *= 1024.0  # gb to mb
-                        allocation[user][key] = int(allocation[user][key])
                 if user <= verbose_n_user:
                     self.logger.log_msg(f"VM {vm_id} - Current allocation for user {user}: {vm_cur_alloc[user]} // {allocation[user]}")
 
@@ -384,6 +426,11 @@ class IncrementalTradeAllocator(ResourceAllocator):
         """
         Allocate resources for users in a specific VM.
 
+        Users are visited in the order of a min-heap over their performance ratios (current / static baseline).
+        Up to max_adjustments_per_round of the worst performers receive resources from the pool, or from the
+        best performers (max-heap) when the pool is empty. Users whose last adjustment has not been measured
+        yet (pending effect) are left out until the effect is evaluated.
+
         Args:
             vm_id: Identifier of the VM
             users: List of user IDs in this VM
@@ -400,10 +447,8 @@ class IncrementalTradeAllocator(ResourceAllocator):
         # Initialize VM tracking if this is the first time seeing this VM
         if vm_id not in self.vm_allocation_decisions:
             self.vm_allocation_decisions[vm_id] = {}
-
-        # Clear the set of adjusted users from previous iteration for this VM
-        if vm_id not in self.last_adjusted_users:
-            self.last_adjusted_users[vm_id] = set()
+        if vm_id not in self.pending_effects:
+            self.pending_effects[vm_id] = {}
 
         # Define resource types and constants
         resource_types = ["cache", "mem_bw"]
@@ -412,41 +457,50 @@ class IncrementalTradeAllocator(ResourceAllocator):
         # Initialize current allocation
         cur_alloc = self._initialize_allocation(users, resource_types)
 
-        # Check performance changes for previously adjusted users in this VM
-        _ = self._check_performance_changes(vm_id, users, resource_units)
+        # Evaluate the adjustments whose effect has been measured (adapts step sizes and resource types)
+        self._check_performance_changes(vm_id, users, cur_alloc)
 
-        # Find worst performer
-        worst_user, performance_ratios = self._find_worst_performer_for_allocation(vm_id, users, resource_types, resource_units, cur_alloc)
+        # Heaps over the performance ratios of the users without pending effects
+        receiver_heap, donor_heap = self._build_performance_heaps(vm_id, users)
 
         # Skip further steps if no worst user found
-        if worst_user is None:
+        if not receiver_heap:
             self.logger.log_msg("No worst user found, returning current allocation")
             return cur_alloc, runtime_list
 
-        # Get resource type to adjust for worst user
-        res_type_to_adjust = self._get_resource_type_for_user(vm_id, worst_user)
+        max_adjustments = self.parameters.max_adjustments_per_round
+        if max_adjustments is None:
+            max_adjustments = max(1, len(users) // 2)
 
-        # Try allocating resources first, then fall back to harvesting if needed
-        adjustment_made = self._allocate_resources(
-            vm_id, worst_user, res_type_to_adjust, resource_units, cur_alloc
-        )
+        adjusted_users = set()
+        num_adjustments = 0
+        while receiver_heap and num_adjustments < max_adjustments:
+            ratio, worst_user = heapq.heappop(receiver_heap)
+            # donors of this round are not receivers
+            if worst_user in adjusted_users:
+                continue
 
-        # If no adjustment was made and we need to harvest resources
-        if not adjustment_made:
-            best_user = self._harvest_resources(
-                vm_id, res_type_to_adjust,
-                resource_units, performance_ratios, cur_alloc
-            )
-            # Reset last_adjusted_users for this VM
-            self.last_adjusted_users[vm_id] = set()
-            # Add this user to the set of users whose resources were adjusted in this iteration
-            if best_user is not None:
-                self.last_adjusted_users[vm_id].add(best_user)
-        else:
-            # Reset last_adjusted_users for this VM
-            self.last_adjusted_users[vm_id] = set()
-            # Add this user to the set of users whose resources were adjusted in this iteration
-            self.last_adjusted_users[vm_id].add(worst_user)
+            # Get resource type and step size to adjust for worst user
+            res_type_to_adjust = self._get_resource_type_for_user(vm_id, worst_user)
+            _, max_share = self._get_share_bounds(res_type_to_adjust)
+            units = min(self._get_step_units(worst_user, res_type_to_adjust, resource_units),
+                        max_share - cur_alloc[worst_user][res_type_to_adjust])
+            if units <= 0:
+                continue
+
+            # Harvest resources into the pool first if needed, then allocate from the pool
+            if self.remaining_resources[res_type_to_adjust] <= 0:
+                best_user = self._harvest_resources(
+                    vm_id, worst_user, ratio, res_type_to_adjust,
+                    resource_units, donor_heap, adjusted_users, cur_alloc
+                )
+                if best_user is None:
+                    continue
+                adjusted_users.add(best_user)
+
+            if self._allocate_resources(vm_id, worst_user, res_type_to_adjust, units, cur_alloc):
+                adjusted_users.add(worst_user)
+                num_adjustments += 1
 
         # Normalize allocations to ensure they sum to 1.0
         self._normalize_allocations(cur_alloc, resource_types, users)
@@ -501,101 +555,143 @@ class IncrementalTradeAllocator(ResourceAllocator):
 
         return cur_alloc
 
-    def _check_performance_changes(self, vm_id, users, resource_units,
+    def _get_share_bounds(self, res_type):
+        """
+        Returns:
+            tuple: (min, max) share of a user for the resource type, from the limits in self.resource_scale
+        """
+        return (self.resource_scale[f"min_{res_type}"] / self.resource_scale[res_type],
+                self.resource_scale[f"max_{res_type}"] / self.resource_scale[res_type])
+
+    def _get_step_units(self, user, res_type, resource_units):
+        """
+        Adjustment step of a user for the resource type, i.e., resource unit scaled by the adaptive step multiplier.
+        """
+        multiplier = self.user_step_multipliers.get(user, {}).get(res_type, 1.0)
+        return resource_units[res_type] * multiplier
+
+    def _update_step_multiplier(self, user, res_type, factor):
+        multipliers = self.user_step_multipliers.setdefault(user, {"cache": 1.0, "mem_bw": 1.0})
+        multipliers[res_type] = min(max(multipliers[res_type] * factor, 1.0), self.parameters.max_step_multiplier)
+
+    def _record_pending_effect(self, vm_id, user, res_type, direction, performance, units):
+        """
+        Record an adjustment whose effect is evaluated once the monitor has new measurements of the user.
+        """
+        self.pending_effects[vm_id][user] = {
+            "res_type": res_type,
+            "direction": direction,
+            "performance": performance,
+            "units": units,
+            "iteration": self.monitor.collection_iteration_count,
+        }
+
+    def _is_effect_measured(self, user, effect):
+        if user not in self.monitor.collected_data:
+            return False
+        return self.monitor.collected_data[user].get("last_update_iteration", -1) > effect["iteration"]
+
+    def _check_performance_changes(self, vm_id, users, cur_alloc,
             perf_margin=0.01, revoke_margin=0.1):
         """
-        Check performance changes for the most recently adjusted user in this VM.
+        Evaluate pending adjustments of the users in this VM whose effect has been measured.
+        Steps grow after an improvement (or a tolerated harvest) and shrink after a regression.
 
         Args:
             vm_id: VM identifier
             users: List of user IDs in this VM
-            resource_units: Resource units dict
+            cur_alloc: Current allocation dict
             perf_margin: Performance margin for comparison
             revoke_margin: Margin for revoking previous allocation
         Returns:
-            str or None: ID of the adjusted user, or None if no adjustment was found
+            list: IDs of the users whose adjustment was evaluated
         """
         opposite_resource = {"cache": "mem_bw", "mem_bw": "cache"}
-        adjusted_user = None
+        evaluated_users = []
 
-        if not self.vm_allocation_decisions.get(vm_id):
-            return None
+        for user, effect in list(self.pending_effects.get(vm_id, {}).items()):
+            # The user has left the VM
+            if user not in users:
+                del self.pending_effects[vm_id][user]
+                continue
 
-        # Find the most recently updated user for this VM
-        last_updated_time = 0
-        last_adjusted_user = None
+            if not self._is_effect_measured(user, effect):
+                if self.monitor.collection_iteration_count - effect["iteration"] > self.parameters.pending_effect_timeout:
+                    self.logger.log_msg(f"No measurement after adjustment for user {user}. Dropping pending effect")
+                    del self.pending_effects[vm_id][user]
+                continue
+            del self.pending_effects[vm_id][user]
 
-        for user, decision in self.vm_allocation_decisions[vm_id].items():
-            if user in users and decision.get('last_updated', 0) > last_updated_time:
-                last_updated_time = decision['last_updated']
-                last_adjusted_user = user
+            current_perf = self._get_current_performance(user)
+            # Skip if no current performance data
+            if current_perf is None or effect["performance"] is None:
+                continue
+            evaluated_users.append(user)
+
+            res_type = effect["res_type"]
+            decision = self.vm_allocation_decisions[vm_id].get(user, {
+                "res_type": res_type, "direction": effect["direction"], "last_updated": time.time()})
+
+            # Check performance change based on direction of last adjustment
+            if effect["direction"] == "down":
+                # If we reduced resources and performance degraded, switch resource type
+                if current_perf < effect["performance"] - perf_margin:
+                    if current_perf < effect["performance"] - revoke_margin:
+                        # Revoke the previous harvest
+                        cur_alloc[user][res_type] += effect["units"]
+                        self.last_allocation[user][res_type] += effect["units"]
+                        # Reduce the pool of remaining resources
+                        self.remaining_resources[res_type] -= effect["units"]
+                        self.remaining_resources[res_type] = max(0, self.remaining_resources[res_type])
+                    self._update_step_multiplier(user, res_type, self.parameters.step_shrink)
+                    # Switch resource type
+                    decision["res_type"] = opposite_resource[decision["res_type"]]
+                    self.logger.log_msg(f"Performance degraded after reduction for user {user}. Switching resource type to {decision['res_type']}")
+                else:
+                    # The user tolerates the harvest, take larger steps from it
+                    self._update_step_multiplier(user, res_type, self.parameters.step_growth)
+
+            elif effect["direction"] == "up":
+                # If we increased resources but performance didn't improve, switch resource type
+                if current_perf <= effect["performance"] - perf_margin:
+                    self._update_step_multiplier(user, res_type, self.parameters.step_shrink)
+                    decision["res_type"] = opposite_resource[decision["res_type"]]
+                    self.logger.log_msg(f"Performance not improved after increase for user {user}. Switching resource type to {decision['res_type']}")
+                elif current_perf > effect["performance"] + perf_margin:
+                    self._update_step_multiplier(user, res_type, self.parameters.step_growth)
+
+            # Update the performance record
+            decision["performance"] = current_perf
+            self.vm_allocation_decisions[vm_id][user] = decision
+
+            # Also update in user_performances for global tracking
+            self.user_performances[user] = {
+                "res_type": decision["res_type"],
+                "direction": decision["direction"],
+                "performance": current_perf
+            }
 
-        # Check performance for this user
-        if last_adjusted_user:
-            adjusted_user = last_adjusted_user
-            decision = self.vm_allocation_decisions[vm_id][adjusted_user]
-            current_perf = self._get_current_performance(adjusted_user)
+        return evaluated_users
 
-            # Skip if no current performance data
-            if current_perf is not None:
-                # Check performance change based on direction of last adjustment
-                if decision["direction"] == "down":
-                    # If we reduced resources and performance degraded, switch resource type
-                    if current_perf < decision["performance"] - perf_margin:
-                        if current_perf < decision["performance"] - revoke_margin:
-                            # Revoke the previous allocation by updating the last_allocation
-                            self.last_allocation[adjusted_user][decision["res_type"]] += resource_units[decision["res_type"]]
-                            # Reduce the pool of remaining resources
-                            self.remaining_resources[decision["res_type"]] -= resource_units[decision["res_type"]]
-                            self.remaining_resources[decision["res_type"]] = max(0, self.remaining_resources[decision["res_type"]])
-                        # Switch resource type
-                        decision["res_type"] = opposite_resource[decision["res_type"]]
-                        self.logger.log_msg(f"Performance degraded after reduction for user {adjusted_user}. Switching resource type to {decision['res_type']}")
-
-                elif decision["direction"] == "up":
-                    # If we increased resources but performance didn't improve, switch resource type
-                    if current_perf <= decision["performance"] - perf_margin:
-                        decision["res_type"] = opposite_resource[decision["res_type"]]
-                        self.logger.log_msg(f"Performance not improved after increase for user {adjusted_user}. Switching resource type to {decision['res_type']}")
-
-                # Update the performance record
-                decision["performance"] = current_perf
-                self.vm_allocation_decisions[vm_id][adjusted_user] = decision
-
-                # Also update in user_performances for global tracking
-                self.user_performances[adjusted_user] = {
-                    "res_type": decision["res_type"],
-                    "direction": decision["direction"],
-                    "performance": current_perf
-                }
-
-        return adjusted_user
-
-    def _find_worst_performer_for_allocation(self, vm_id, users, resource_types, resource_units, cur_alloc):
+    def _build_performance_heaps(self, vm_id, users):
         """
-        Find the user with the worst performance compared to baseline.
+        Build the heaps over the performance ratios (current / static baseline) of the users without pending effects.
 
         Args:
             vm_id: VM identifier
             users: List of user IDs
-            resource_types: List of resource types
-            resource_units: Resource units dict
-            cur_alloc: Current allocation dict
 
         Returns:
-            tuple: (worst user ID or None, performance ratios dict)
+            tuple: (min-heap of (ratio, user) for allocation, max-heap of (-ratio, user) for harvest)
         """
-        worst_user = None
-        worst_ratio = float('inf')
-        performance_ratios = {}
-
-        # Get the set of users whose resources were adjusted in the previous iteration for this VM
-        previously_adjusted_users = self.last_adjusted_users.get(vm_id, set())
+        receiver_heap = []
+        donor_heap = []
+        pending_users = self.pending_effects.get(vm_id, {})
 
         for user in users:
-            # Skip users that had their resources adjusted in the previous iteration
-            if user in previously_adjusted_users:
-                self.logger.log_msg(f"Skipping user {user} as its resources were adjusted in the previous iteration")
+            # Skip users whose last adjustment has not been measured yet
+            if user in pending_users:
+                self.logger.log_msg(f"Skipping user {user} as the effect of its last adjustment is pending")
                 continue
 
             current_perf = self._get_current_performance(user)
@@ -608,25 +704,13 @@ class IncrementalTradeAllocator(ResourceAllocator):
             if self.last_static_performance and user in self.last_static_performance:
                 baseline_perf = self.last_static_performance[user]
                 ratio = current_perf / baseline_perf if baseline_perf > 0 else float('inf')
-                performance_ratios[user] = ratio
                 self.logger.log_msg(f"User {user} - Current performance: {current_perf} // Baseline performance: {baseline_perf} // Ratio: {ratio}")
+                receiver_heap.append((ratio, user))
+                donor_heap.append((-ratio, user))
 
-                # Find user with worst performance (lowest ratio)
-                if ratio < worst_ratio:
-                    # check if the adjust resource will not violate the resource limit in self.resource_scale
-                    res_type_to_adjust = self._get_resource_type_for_user(vm_id, user)
-                    if res_type_to_adjust == "cache":
-                        if cur_alloc[user]["cache"] + resource_units["cache"]\
-                            > self.resource_scale["max_cache"] / self.resource_scale["cache"]:
-                            continue
-                    elif res_type_to_adjust == "mem_bw":
-                        if cur_alloc[user]["mem_bw"] + resource_units["mem_bw"]\
-                            > self.resource_scale["max_mem_bw"] / self.resource_scale["mem_bw"]:
-                            continue
-                    worst_ratio = ratio
-                    worst_user = user
-
-        return worst_user, performance_ratios
+        heapq.heapify(receiver_heap)
+        heapq.heapify(donor_heap)
+        return receiver_heap, donor_heap
 
     def _get_resource_type_for_user(self, vm_id, user):
         """
@@ -651,7 +735,7 @@ class IncrementalTradeAllocator(ResourceAllocator):
 
         return res_type
 
-    def _allocate_resources(self, vm_id, worst_user, res_type_to_adjust, resource_units, cur_alloc):
+    def _allocate_resources(self, vm_id, worst_user, res_type_to_adjust, units, cur_alloc):
         """
         Allocate resources to the worst performer if resources are available.
 
@@ -659,7 +743,7 @@ class IncrementalTradeAllocator(ResourceAllocator):
             vm_id: VM identifier
             worst_user: User ID of worst performer
             res_type_to_adjust: Resource type to adjust
-            resource_units: Resource units dict
+            units: Amount of the resource to allocate (share in [0, 1])
             cur_alloc: Current allocation dict
 
         Returns:
@@ -668,22 +752,24 @@ class IncrementalTradeAllocator(ResourceAllocator):
 
         # Check if we have remaining resources
         if self.remaining_resources[res_type_to_adjust] > 0:
+            units = min(units, self.remaining_resources[res_type_to_adjust])
             # Reduce remaining resources
-            self.remaining_resources[res_type_to_adjust] -= resource_units[res_type_to_adjust]
+            self.remaining_resources[res_type_to_adjust] -= units
 
             # Record old performance
             old_performance = self._get_current_performance(worst_user)
 
             # Increase allocation
-            cur_alloc[worst_user][res_type_to_adjust] += resource_units[res_type_to_adjust]
+            cur_alloc[worst_user][res_type_to_adjust] += units
 
-            # Record in VM allocation decisions for next iteration
+            # Record in VM allocation decisions and pending effects for next iterations
             self.vm_allocation_decisions[vm_id][worst_user] = {
                 "res_type": res_type_to_adjust,
                 "direction": "up",
                 "performance": old_performance,
                 "last_updated": time.time()
             }
+            self._record_pending_effect(vm_id, worst_user, res_type_to_adjust, "up", old_performance, units)
 
             # Also update global user performances
             self.user_performances[worst_user] = {
@@ -692,30 +778,58 @@ class IncrementalTradeAllocator(ResourceAllocator):
                 "performance": old_performance
             }
 
-            self.logger.log_msg(f"Allocated {resource_units[res_type_to_adjust]} of {res_type_to_adjust} to user {worst_user}")
+            self.logger.log_msg(f"Allocated {units} of {res_type_to_adjust} to user {worst_user}")
             return True
 
         return False
 
-    def _harvest_resources(self, vm_id, res_type_to_adjust,
-                          resource_units, performance_ratios, cur_alloc):
+    def _harvest_resources(self, vm_id, worst_user, worst_ratio, res_type_to_adjust,
+                          resource_units, donor_heap, adjusted_users, cur_alloc):
         """
-        Harvest resources from best performer and recycle them to the resource pool.
+        Harvest resources from the best performer and recycle them to the resource pool.
 
         Args:
             vm_id: VM identifier
+            worst_user: User ID of the receiver
+            worst_ratio: Performance ratio of the receiver
             res_type_to_adjust: Resource type to adjust
             resource_units: Resource units dict
-            performance_ratios: Performance ratios dict
+            donor_heap: Max-heap of (-ratio, user)
+            adjusted_users: Users already adjusted in this round
             cur_alloc: Current allocation dict
 
         Returns:
             str or None: User ID of best performer, or None if none found
         """
         opposite_resource = {"cache": "mem_bw", "mem_bw": "cache"}
+        min_share, _ = self._get_share_bounds(res_type_to_adjust)
 
         # Find user with best performance to harvest from
-        best_user = self._find_best_performer_for_harvest(vm_id, performance_ratios, res_type_to_adjust, resource_units, cur_alloc)
+        best_user = None
+        units = 0
+        skipped = []
+        while donor_heap:
+            neg_ratio, user = heapq.heappop(donor_heap)
+            if user in adjusted_users:
+                continue
+            if user == worst_user:
+                skipped.append((neg_ratio, user))
+                continue
+            # No donor performs better than the receiver
+            if -neg_ratio < worst_ratio:
+                skipped.append((neg_ratio, user))
+                break
+            # check if the adjust resource will not violate the resource limit in self.resource_scale
+            units = min(self._get_step_units(user, res_type_to_adjust, resource_units),
+                        cur_alloc[user][res_type_to_adjust] - min_share)
+            if units <= 0:
+                # may still donate the other resource type
+                skipped.append((neg_ratio, user))
+                continue
+            best_user = user
+            break
+        for entry in skipped:
+            heapq.heappush(donor_heap, entry)
 
         if best_user is None:
             self.logger.log_msg("No suitable user to harvest resources from")
@@ -725,20 +839,19 @@ class IncrementalTradeAllocator(ResourceAllocator):
         old_performance = self._get_current_performance(best_user)
 
         # Decrease allocation for best user
-        cur_alloc[best_user][res_type_to_adjust] -= resource_units[res_type_to_adjust]
-        if cur_alloc[best_user][res_type_to_adjust] < 0:
-            cur_alloc[best_user][res_type_to_adjust] = 0
+        cur_alloc[best_user][res_type_to_adjust] -= units
 
         # Increase resource pool of the SAME resource type we harvested
-        self.remaining_resources[res_type_to_adjust] += resource_units[res_type_to_adjust]
+        self.remaining_resources[res_type_to_adjust] += units
 
-        # Record in VM allocation decisions for next iteration
+        # Record in VM allocation decisions and pending effects for next iterations
         self.vm_allocation_decisions[vm_id][best_user] = {
             "res_type": opposite_resource[res_type_to_adjust],
             "direction": "down",
             "performance": old_performance,
             "last_updated": time.time()
         }
+        self._record_pending_effect(vm_id, best_user, res_type_to_adjust, "down", old_performance, units)
 
         # Also update global user performances
         self.user_performances[best_user] = {
@@ -747,48 +860,7 @@ class IncrementalTradeAllocator(ResourceAllocator):
             "performance": old_performance
         }
 
-        self.logger.log_msg(f"Harvested {resource_units[res_type_to_adjust]} of {res_type_to_adjust} from user {best_user}")
-        return best_user
-
-    def _find_best_performer_for_harvest(self, vm_id, performance_ratios, res_type_to_adjust, resource_units, cur_alloc):
-        """
-        Find the user with the best performance.
-
-        Args:
-            vm_id: VM identifier
-            performance_ratios: Performance ratios dict
-            res_type_to_adjust: Resource type to adjust
-            resource_units: Resource units dict
-            cur_alloc: Current allocation dict
-
-        Returns:
-            str or None: User ID of best performer, or None if none found
-        """
-        best_user = None
-        best_ratio = -float('inf')
-
-        # Get the set of users whose resources were adjusted in the previous iteration for this VM
-        previously_adjusted_users = self.last_adjusted_users.get(vm_id, set())
-
-        # Find user with best performance (highest ratio)
-        for user, ratio in performance_ratios.items():
-            # Skip users that had their resources adjusted in the previous iteration
-            if user in previously_adjusted_users:
-                self.logger.log_msg(f"Skipping user {user} as its resources were adjusted in the previous iteration")
-                continue
-            # check if the adjust resource will not violate the resource limit in self.resource_scale
-            if ratio > best_ratio:
-                if res_type_to_adjust == "cache":
-                    if cur_alloc[user]["cache"] - resource_units["cache"]\
-                        < self.resource_scale["min_cache"] / self.resource_scale["cache"]:
-                        continue
-                elif res_type_to_adjust == "mem_bw":
-                    if cur_alloc[user]["mem_bw"] - resource_units["mem_bw"]\
-                        < self.resource_scale["min_mem_bw"] / self.resource_scale["mem_bw"]:
-                        continue
-                best_ratio = ratio
-                best_user = user
-
+        self.logger.log_msg(f"Harvested {units} of {res_type_to_adjust} from user {best_user}")
         return best_user
 
     def _normalize_allocations(self, cur_alloc, resource_types, users):
@@ -800,11 +872,7 @@ class IncrementalTradeAllocator(ResourceAllocator):
             resource_types: List of resource types
             users: List of user IDs
         """
-        for res_type in resource_types:
-            total = sum(cur_alloc[user][res_type] for user in users)
-            if total > 1:
-                for user in users:
-                    cur_alloc[user][res_type] /= total
+        AllocationMatrix.from_dict(cur_alloc, users, resource_types).normalize().update_dict(cur_alloc)
 
     def _get_current_performance(self, user):
         """
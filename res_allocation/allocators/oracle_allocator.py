@@ -40,8 +40,9 @@ class OracleAllocator(ResourceAllocator):
         estimator=None,
         monitor=None,
         deployer=None,
+        logger_name: str = 'spirit_ceei_allocator',
     ):
-        super().__init__(config_path, resource_scale, estimator, monitor, deployer)
+        super().__init__(config_path, resource_scale, estimator, monitor, deployer, logger_name)
         self.last_allocation = None
 
     def initialize(self, param: AllocatorParams = OracleAllocatorParams(1.0)):
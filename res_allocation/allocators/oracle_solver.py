@@ -0,0 +1,207 @@
+import statistics
+import numpy as np
+from .resources import get_limits
+
+OBJECTIVES = ("max-min", "welfare")
+
+
+class OracleSolver:
+    '''
+    Offline optimal allocations of cache and mem_bw per VM from per-app performance surfaces.
+
+    The allocation of each app is a point of a (num_steps + 1) x (num_steps + 1) lattice over the capacity of the
+    VM, within the min/max limits of resource_scale. An app's utility table is its performance on the lattice
+    normalized by its best performance within the limits; resources an app does not use can stay idle (free
+    disposal), so each table is closed to be non-decreasing in both resources.
+
+    - welfare: maximum sum of the utilities, by a max-plus dynamic program over the lattice of the resources used
+      by the apps so far. Only the points of an app that are not dominated (no other point with fewer resources and
+      at least the same utility) are tried, each as one shifted vector maximum over the whole state lattice.
+    - max-min: the largest minimum utility, by a binary search over the utility values; a threshold is feasible
+      if the apps reach it within the capacity, which is a min-plus program over the cache used (the least mem_bw
+      per cache amount). Ties are broken by the maximum welfare among the allocations reaching the threshold.
+
+    Both are exact on the lattice; resources left idle by the solution are split equally afterwards.
+    '''
+    def __init__(self, resource_scale: dict, num_steps: int = 32):
+        self.resource_scale = resource_scale
+        self.num_steps = int(num_steps)
+        # lattice in MB and Mbps
+        self.cache_grid = np.linspace(0., resource_scale["cache"], self.num_steps + 1)
+        self.mem_bw_grid = np.linspace(0., resource_scale["mem_bw"] * 1024., self.num_steps + 1)  # gb to mb
+        # index ranges of the limits of an app on the lattice (no max: the upper limit is inf, clamped to the lattice)
+        self.bounds = []
+        for res_type, grid in (("cache", self.cache_grid), ("mem_bw", self.mem_bw_grid)):
+            lower, upper = get_limits(resource_scale, res_type)
+            step = grid[1] - grid[0]
+            self.bounds.append((int(np.ceil(lower / step - 1e-9)), int(min(self.num_steps, np.floor(upper / step + 1e-9)))))
+
+    # = Utility tables =
+    def _finalize_table(self, perf):
+        """
+        Close under free disposal, mask the lattice points outside the limits (-inf) and normalize
+        """
+        table = np.maximum.accumulate(np.maximum.accumulate(perf, axis=0), axis=1)
+        (cache_min, cache_max), (bw_min, bw_max) = self.bounds
+        masked = np.full_like(table, -np.inf)
+        masked[cache_min:cache_max + 1, bw_min:bw_max + 1] = table[cache_min:cache_max + 1, bw_min:bw_max + 1]
+        # best performance the app can reach within its limits
+        peak = masked.max()
+        return masked / peak if peak > 0 else np.where(np.isfinite(masked), 0., masked)
+
+    def tabulate_measurements(self, datapoints: dict):
+        """
+        Utility table from measured performance (the datapoints of the monitor: cache (MB) -> mem_bw (Mbps) -> [(perf, iteration)]).
+        A measurement counts for the lattice points with at least its resources; points below every measurement have utility 0.
+        """
+        perf = np.zeros((self.num_steps + 1, self.num_steps + 1))
+        cache_step, bw_step = self.cache_grid[1], self.mem_bw_grid[1]
+        for cache_size, cache_data in datapoints.items():
+            for mem_bw_in_mbps, records in cache_data.items():
+                if not records:
+                    continue
+                i = int(np.ceil(float(cache_size) / cache_step - 1e-9))
+                j = int(np.ceil(float(mem_bw_in_mbps) / bw_step - 1e-9))
+                if i <= self.num_steps and j <= self.num_steps:
+                    perf[i, j] = max(perf[i, j], statistics.median(record[0] for record in records))
+        return self._finalize_table(perf)
+
+    def tabulate_profile(self, profile: dict, estimator):
+        """
+        Utility table from an MRC profile (see RuntimeEstimator.get_profile()): the slowdown model of the estimator
+        relative to the profiled allocation and usage
+        """
+        caches, mem_bws = np.meshgrid(self.cache_grid, self.mem_bw_grid, indexing="ij")
+        cur_mr = max(float(estimator.estimate_miss_rates(profile["mrc"], [profile["allocation"]["cache"]])[0]), 1e-12)
+        tar_mr = np.maximum(estimator.estimate_miss_rates(profile["mrc"], caches.ravel()), 1e-12)
+        slowdown, _ = estimator._estimate_slow_downs(cur_mr, tar_mr, profile["usage"]["mem_bw"], mem_bws.ravel(),
+                                                     profile["allocation"]["mem_bw"])
+        perf = 1. / np.maximum(1e-4, slowdown)
+        return self._finalize_table(perf.reshape(caches.shape))
+
+    def tabulate_equal_share(self, num_apps: int):
+        """
+        Table of an app without a performance surface: it only holds its equal share of the VM (within the limits),
+        with the top utility so that it constrains neither objective
+        """
+        table = np.full((self.num_steps + 1, self.num_steps + 1), -np.inf)
+        (cache_min, cache_max), (bw_min, bw_max) = self.bounds
+        share = self.num_steps // max(1, num_apps)
+        table[min(max(share, cache_min), cache_max):, min(max(share, bw_min), bw_max):] = 1.
+        return table
+
+    # = Solvers =
+    @staticmethod
+    def _get_candidates(table):
+        """
+        Lattice points not dominated by a point with fewer resources: (cache index, mem_bw index, utility) arrays
+        """
+        padded = np.pad(table, ((1, 0), (1, 0)), constant_values=-np.inf)
+        keep = np.isfinite(table) & (table > padded[:-1, 1:]) & (table > padded[1:, :-1])
+        cache_idx, bw_idx = np.nonzero(keep)
+        return cache_idx, bw_idx, table[cache_idx, bw_idx]
+
+    def _max_welfare(self, tables):
+        """
+        Returns:
+            (total utility, [(cache index, mem_bw index)] per table), or (-inf, None) if infeasible
+        """
+        size = self.num_steps + 1
+        # best total utility with (cache, mem_bw) lattice units used by the apps so far
+        state = np.full((size, size), -np.inf)
+        state[0, 0] = 0.
+        stages = []
+        for table in tables:
+            cache_idx, bw_idx, utils = self._get_candidates(table)
+            new_state = np.full((size, size), -np.inf)
+            choice = np.full((size, size), -1, dtype=int)
+            for k in range(len(utils)):
+                c, b = cache_idx[k], bw_idx[k]
+                candidate = state[:size - c, :size - b] + utils[k]
+                region = new_state[c:, b:]
+                better = candidate > region
+                region[better] = candidate[better]
+                choice[c:, b:][better] = k
+            state = new_state
+            stages.append((cache_idx, bw_idx, choice))
+        end = np.unravel_index(int(np.argmax(state)), state.shape)
+        total = float(state[end])
+        if not np.isfinite(total):
+            return total, None
+        points = []
+        c, b = end
+        for cache_idx, bw_idx, choice in reversed(stages):
+            k = choice[c, b]
+            points.append((int(cache_idx[k]), int(bw_idx[k])))
+            c, b = c - cache_idx[k], b - bw_idx[k]
+        return total, points[::-1]
+
+    def _is_feasible(self, tables, threshold):
+        """
+        True if every app reaches the threshold within the capacity
+        """
+        size = self.num_steps + 1
+        # least mem_bw units with a given number of cache units used by the apps so far
+        state = np.full(size, np.inf)
+        state[0] = 0.
+        for table in tables:
+            reached = table >= threshold
+            need = np.where(reached.any(axis=1), np.argmax(reached, axis=1), np.inf)
+            new_state = np.full(size, np.inf)
+            for c in np.nonzero(np.isfinite(need))[0]:
+                new_state[c:] = np.minimum(new_state[c:], state[:size - c] + need[c])
+            state = new_state
+        return bool(np.min(state) <= self.num_steps)
+
+    def _max_min(self, tables):
+        values = np.unique(np.concatenate([table[np.isfinite(table)] for table in tables]))
+        if len(values) == 0 or not self._is_feasible(tables, values[0]):
+            return -np.inf, None
+        # largest feasible utility value
+        low, high = 0, len(values) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._is_feasible(tables, values[mid]):
+                low = mid
+            else:
+                high = mid - 1
+        threshold = values[low]
+        _, points = self._max_welfare([np.where(table >= threshold, table, -np.inf) for table in tables])
+        return float(threshold), points
+
+    def _fill_idle(self, points):
+        """
+        Split the lattice units left idle equally across the apps, within their max limits
+        """
+        points = [list(point) for point in points]
+        for axis, (_, upper) in enumerate(self.bounds):
+            idle = self.num_steps - sum(point[axis] for point in points)
+            while idle > 0:
+                open_apps = [point for point in points if point[axis] < upper]
+                if not open_apps:
+                    break
+                for point in open_apps[:idle]:
+                    point[axis] += 1
+                    idle -= 1
+        return points
+
+    def solve(self, tables: dict, objective: str = "max-min"):
+        """
+        Args:
+            tables: app_id -> utility table of the apps of one VM
+        Returns:
+            (allocation: app_id -> {"cache": MB, "mem_bw": Mbps}, utilities: app_id -> utility at the solution),
+            or (None, None) if the limits are infeasible
+        """
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown objective: {objective} (expected one of {OBJECTIVES})")
+        app_ids = list(tables.keys())
+        table_list = [tables[app_id] for app_id in app_ids]
+        _, points = self._max_min(table_list) if objective == "max-min" else self._max_welfare(table_list)
+        if points is None:
+            return None, None
+        allocation, utilities = {}, {}
+        for app_id, table, (c, b) in zip(app_ids, table_list, self._fill_idle(points)):
+            allocation[app_id] = {"cache": int(self.cache_grid[c]), "mem_bw": int(self.mem_bw_grid[b])}
+            utilities[app_id] = float(table[c, b])
+        return allocation, utilities
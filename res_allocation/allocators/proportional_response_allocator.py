@@ -0,0 +1,185 @@
+import time
+import numpy as np
+from utils import metrics
+from .spirit_allocator import SpiritAllocator, SpiritAllocatorParams
+from .resources import get_share_limits
+
+
+class ProportionalResponseAllocatorParams(SpiritAllocatorParams):
+    def __init__(
+        self,
+        allocation_interval_in_sec: float,
+        table_points: int = 17,     # grid points per resource of the utility tables of each user
+        max_steps: int = 200,
+        tolerance: float = 1e-4,    # largest relative change of a share between two steps to stop
+        damping: float = 0.5,       # weight of the new allocation in each step
+        **kwargs,
+    ) -> None:
+        super().__init__(allocation_interval_in_sec, **kwargs)
+        self.table_points = table_points
+        self.max_steps = max_steps
+        self.tolerance = tolerance
+        self.damping = damping
+
+
+class ProportionalResponseAllocator(SpiritAllocator):
+    '''
+    CEEI by proportional-response dynamics instead of the price search of SpiritAllocator.
+
+    Each user's utility is tabulated once per round with the batched estimator. In each step, every user splits its
+    budget across the resources in proportion to the marginal utility it gets from its current holding (x * du/dx),
+    prices are the total bids, and the allocation is the bid over the price; the dynamics converge to the
+    Fisher-market equilibrium. A step is a few vector operations over all users of the VM.
+
+    The market covers cache and mem_bw; the extra resources of the cluster are split equally (see fill_extra_resources()).
+    Everything else (static phase, per-VM plumbing, global market, change gate) is inherited from SpiritAllocator.
+    '''
+    def initialize(self, param: ProportionalResponseAllocatorParams = ProportionalResponseAllocatorParams(1.0)):
+        super().initialize(param)
+
+    def _update_search_ranges(self, users: list, cur_alloc: dict):
+        # no PTAS search window to adapt
+        return
+
+    def _get_share_bounds(self, resource_types):
+        bounds = [get_share_limits(self.resource_scale, key) for key in resource_types]
+        return np.array([bound[0] for bound in bounds]), np.array([bound[1] for bound in bounds])
+
+    @staticmethod
+    def _project(shares, lower, upper):
+        """
+        Clip the shares (users x resources) to [lower, upper] and scale down the over-subscribed resources so that
+        they sum to 1 within the limits: s * shares clipped to the limits, where the sum is piecewise linear in s
+        between the breakpoints lower / shares and upper / shares. Requires num_users * lower <= 1.
+        """
+        clipped = np.clip(shares, lower, upper)
+        for j in np.nonzero(clipped.sum(axis=0) > 1. + 1e-12)[0]:
+            column = np.maximum(shares[:, j], 0.)
+            positive = column[column > 0.]
+            scales = np.concatenate(([0., 1.], lower[j] / positive, upper[j] / positive))
+            scales = np.unique(scales[scales <= 1.])
+            sums = np.clip(np.outer(scales, column), lower[j], upper[j]).sum(axis=1)
+            # last breakpoint that fits, and the linear piece after it
+            k = int(np.searchsorted(sums, 1., side="right")) - 1
+            scale = scales[k]
+            if k + 1 < len(scales) and sums[k + 1] > sums[k]:
+                scale += (scales[k + 1] - scales[k]) * (1. - sums[k]) / (sums[k + 1] - sums[k])
+            clipped[:, j] = np.clip(column * scale, lower[j], upper[j])
+        return clipped
+
+    def _get_estimations(self, user, points: dict):
+        """
+        Args:
+            points: resource type -> array of allocations in the units of resource_scale
+        Returns:
+            utilities of the user
+        """
+        if hasattr(self.estimator, "get_estimations"):
+            return np.asarray(self.estimator.get_estimations(user, points["cache"], points["mem_bw"]), dtype=float)
+        return np.array([self.estimator.get_estimation(user, cache, mem_bw) for cache, mem_bw in zip(points["cache"], points["mem_bw"])])
+
+    def _build_utility_tables(self, users, resource_types, lower, upper):
+        """
+        Full grid over two resources.
+
+        Returns:
+            grids: (first resource grid, second resource grid) in shares
+            tables: (users x grid x grid) utilities; a user without an estimate has a flat table
+        """
+        num_points = max(2, int(self.parameters.table_points))
+        grids = (np.linspace(lower[0], upper[0], num_points), np.linspace(lower[1], upper[1], num_points))
+        meshes = np.meshgrid(*grids, indexing="ij")
+        points = {key: mesh.ravel() * self.resource_scale[key] for key, mesh in zip(resource_types, meshes)}
+        tables = np.zeros((len(users), num_points, num_points))
+        for i, user in enumerate(users):
+            utils = self._get_estimations(user, points)
+            if np.any(utils < 0):
+                self.logger.log_msg(f"User: {user} | No estimation available, keeping its bids")
+                continue
+            tables[i] = utils.reshape(num_points, num_points)
+        return grids, tables
+
+    def _get_marginal_fn(self, users, resource_types, lower, upper):
+        """
+        Returns:
+            function: shares (users x resources) -> marginal utilities (users x resources), interpolated on the tables
+        """
+        rows = np.arange(len(users))
+        (grid_0, grid_1), tables = self._build_utility_tables(users, resource_types, lower, upper)
+        step_0 = grid_0[1] - grid_0[0] if grid_0[1] > grid_0[0] else 1.
+        step_1 = grid_1[1] - grid_1[0] if grid_1[1] > grid_1[0] else 1.
+        grads = np.stack(np.gradient(tables, step_0, step_1, axis=(1, 2)), axis=-1)
+
+        def get_marginal(shares):
+            # bilinear interpolation of the marginal utilities at the current shares
+            pos_0 = np.clip((shares[:, 0] - grid_0[0]) / step_0, 0, len(grid_0) - 1)
+            pos_1 = np.clip((shares[:, 1] - grid_1[0]) / step_1, 0, len(grid_1) - 1)
+            i0 = np.minimum(pos_0.astype(int), len(grid_0) - 2)
+            j0 = np.minimum(pos_1.astype(int), len(grid_1) - 2)
+            w0 = (pos_0 - i0)[:, None]
+            w1 = (pos_1 - j0)[:, None]
+            corners = [grads[rows, i, j] for i, j in [(i0, j0), (i0 + 1, j0), (i0, j0 + 1), (i0 + 1, j0 + 1)]]
+            return ((1. - w0) * (1. - w1) * corners[0] + w0 * (1. - w1) * corners[1]
+                    + (1. - w0) * w1 * corners[2] + w0 * w1 * corners[3])
+        return get_marginal
+
+    def allocate(self, users: list, weights: dict, **kwargs):
+        start_time = time.time_ns()
+        num_users = len(users)
+        resource_types = self.get_market_resource_types()
+        lower, upper = self._get_share_bounds(resource_types)
+        # the minimums of a resource may not all fit on a crowded VM: the resource falls back to the equal split
+        infeasible = lower * num_users > 1. + 1e-9
+        if np.any(infeasible):
+            self.logger.log_msg(f"Users {users}: minimum shares of {[key for key, bad in zip(resource_types, infeasible) if bad]} "
+                                f"do not fit ({num_users} x {lower[infeasible].tolist()}), splitting them equally", level='warning')
+            lower = np.where(infeasible, 1. / num_users, lower)
+            upper = np.maximum(upper, lower)
+        # start from the last allocation (or the equal split)
+        shares = np.array([[self.last_allocation.get(user, {}).get(key, 1. / num_users) for key in resource_types]
+                           for user in users], dtype=float)
+        shares = self._project(shares, lower, upper)
+        get_marginal = self._get_marginal_fn(users, resource_types, lower, upper)
+        solve_start_time = time.time_ns()
+
+        budgets = np.array([weights[user] for user in users], dtype=float)
+        bids = budgets[:, None] * shares / shares.sum(axis=1, keepdims=True)
+        prices = np.maximum(bids.sum(axis=0), 1e-12)
+
+        is_converged = False
+        step = 0
+        for step in range(1, self.parameters.max_steps + 1):
+            marginal = np.maximum(0., get_marginal(shares))
+            # proportional response: bid on each resource in proportion to the utility it contributes
+            gains = shares * marginal
+            total_gains = gains.sum(axis=1, keepdims=True)
+            responsive = total_gains[:, 0] > 0.
+            bids[responsive] = budgets[responsive, None] * gains[responsive] / total_gains[responsive]
+            prices = np.maximum(bids.sum(axis=0), 1e-12)
+            # clipping to the limits may over-subscribe a resource again
+            new_shares = self._project(bids / prices, lower, upper)
+            # both ends are within the limits, and so is the damped step
+            new_shares = (1. - self.parameters.damping) * shares + self.parameters.damping * new_shares
+            # relative to the share, so that the test does not loosen as the number of users grows; shares below 1%
+            # of the equal split (users priced out of a resource, which decay geometrically) count from that floor
+            change = float(np.max(np.abs(new_shares - shares) / np.maximum(shares, 0.01 / num_users)))
+            shares = new_shares
+            if change < self.parameters.tolerance:
+                is_converged = True
+                break
+
+        metrics.PRICE_ITERATIONS.observe(step, allocator=type(self).__name__)
+        if not is_converged:
+            metrics.CONVERGENCE_FAILURES.inc(allocator=type(self).__name__)
+        # prices on the same simplex as the price search of SpiritAllocator
+        price_vector = dict(zip(resource_types, (prices / prices.sum()).tolist()))
+        cur_alloc = {}
+        for i, user in enumerate(users):
+            cur_alloc[user] = {key: float(shares[i, j]) for j, key in enumerate(resource_types)}
+            cur_alloc[user]["price"] = price_vector
+        runtime_in_ms = float(time.time_ns() - start_time) / float(1e6)
+        solve_in_ms = float(time.time_ns() - solve_start_time) / float(1e6)
+        self.logger.log_msg(f"Proportional response: {step} steps, converged: {is_converged}, prices: {price_vector}, "
+                            f"sum_alloc: {dict(zip(resource_types, shares.sum(axis=0).tolist()))}, "
+                            f"runtime (ms): {runtime_in_ms:.3f} (tables: {runtime_in_ms - solve_in_ms:.3f}, dynamics: {solve_in_ms:.3f})")
+        return cur_alloc, [runtime_in_ms / max(1, num_users)], [step], is_converged
@@ -1,4 +1,3 @@
-import copy
 import time
 import math
 import numpy as np
@@ -6,38 +5,57 @@ import numpy as np
 class ResourceLimited:
     """
     Data class to indicate if there was resource limiting.
+    Flags are named <resource type>_min_limit / <resource type>_max_limit for any resource type.
     """
     def __init__(self, cache_min_limit=False, cache_max_limit=False,
-                 mem_bw_min_limit=False, mem_bw_max_limit=False):
+                 mem_bw_min_limit=False, mem_bw_max_limit=False, **extra_limits):
+        self.limits = {}
         self.cache_min_limit = cache_min_limit
         self.cache_max_limit = cache_max_limit
         self.mem_bw_min_limit = mem_bw_min_limit
         self.mem_bw_max_limit = mem_bw_max_limit
+        for name, value in extra_limits.items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def _parse_name(name):
+        # <resource type>_min_limit -> (resource type, "min")
+        if name.endswith("_min_limit") or name.endswith("_max_limit"):
+            return name[:-len("_min_limit")], name[-len("min_limit"):-len("_limit")]
+        return None
+
+    def __getattr__(self, name):
+        key = ResourceLimited._parse_name(name)
+        if key is None or name == "limits":
+            raise AttributeError(name)
+        return self.limits.get(key, False)
+
+    def __setattr__(self, name, value):
+        key = ResourceLimited._parse_name(name)
+        if key is None:
+            super().__setattr__(name, value)
+        else:
+            self.limits[key] = bool(value)
 
     def update(self, other):
         """
         Update the resource limits based on another ResourceLimited instance.
         """
-        self.cache_min_limit = self.cache_min_limit or other.cache_min_limit
-        self.cache_max_limit = self.cache_max_limit or other.cache_max_limit
-        self.mem_bw_min_limit = self.mem_bw_min_limit or other.mem_bw_min_limit
-        self.mem_bw_max_limit = self.mem_bw_max_limit or other.mem_bw_max_limit
+        for key, value in other.limits.items():
+            self.limits[key] = self.limits.get(key, False) or value
 
     def is_resource_limited(self):
         """
         Check if any resource is limited.
         """
-        return (
-            self.cache_min_limit or self.cache_max_limit or
-            self.mem_bw_min_limit or self.mem_bw_max_limit
-        )
+        return any(self.limits.values())
 
     # print format
     def __str__(self):
-        return (
-            f"ResourceLimited(cache_limit=({self.cache_min_limit}, {self.cache_max_limit}), "
-            f"mem_bw_limit=({self.mem_bw_min_limit}, {self.mem_bw_max_limit}))"
-        )
+        res_types = list(dict.fromkeys(res_type for res_type, _ in self.limits))
+        return "ResourceLimited({})".format(", ".join(
+            f"{res_type}_limit=({self.limits.get((res_type, 'min'), False)}, {self.limits.get((res_type, 'max'), False)})"
+            for res_type in res_types))
 
 def check_resource_limits(cache_alloc, mem_bw_alloc, resource_scale, max_util=False, resource_limited=None, margin={"cache": 0.0, "mem_bw": 0.0}):
     """
@@ -55,37 +73,30 @@ def check_resource_limits(cache_alloc, mem_bw_alloc, resource_scale, max_util=Fa
     Returns:
     - bool: True if allocation is within limits (or within margin), False otherwise
     """
-    # Calculate actual resource values
-    cache_actual = cache_alloc * resource_scale["cache"]
-    mem_bw_actual = mem_bw_alloc * resource_scale["mem_bw"]
-    cache_margin = margin["cache"] * resource_scale["cache"]
-    mem_bw_margin = margin["mem_bw"] * resource_scale["mem_bw"]
-
-    # Calculate margin-adjusted limits
-    min_cache_with_margin = resource_scale["min_cache"] - cache_margin
-    max_cache_with_margin = resource_scale["max_cache"] + cache_margin
-    min_mem_bw_with_margin = resource_scale["min_mem_bw"] - mem_bw_margin
-    max_mem_bw_with_margin = resource_scale["max_mem_bw"] + mem_bw_margin
-
-    # Check cache limits with margin
-    if (cache_actual < min_cache_with_margin or
-        cache_actual > max_cache_with_margin):
-        # Update resource_limited if provided and the utility is significant
-        if resource_limited is not None and max_util:
-            new_limit = ResourceLimited(cache_min_limit=cache_actual < min_cache_with_margin,
-                                        cache_max_limit=cache_actual > max_cache_with_margin)
-            resource_limited.update(new_limit)
-        return False
-
-    # Check memory bandwidth limits with margin
-    if (mem_bw_actual < min_mem_bw_with_margin or
-        mem_bw_actual > max_mem_bw_with_margin):
-        # Update resource_limited if provided and the utility is significant
-        if resource_limited is not None and max_util:
-            new_limit = ResourceLimited(mem_bw_min_limit=mem_bw_actual < min_mem_bw_with_margin,
-                                        mem_bw_max_limit=mem_bw_actual > max_mem_bw_with_margin)
-            resource_limited.update(new_limit)
-        return False
+    return check_resource_limits_nd({"cache": cache_alloc, "mem_bw": mem_bw_alloc}, resource_scale, max_util, resource_limited, margin)
+
+def check_resource_limits_nd(alloc, resource_scale, max_util=False, resource_limited=None, margin=None):
+    """
+    check_resource_limits() over any number of resources.
+
+    Parameters:
+    @alloc (dict): resource type -> allocation (normalized); resources are checked in this order
+    @margin (dict, optional): resource type -> margin (normalized; 0 if not given)
+    """
+    for res_type, share in alloc.items():
+        # Calculate actual resource values and margin-adjusted limits
+        actual = share * resource_scale[res_type]
+        res_margin = (margin or {}).get(res_type, 0.0) * resource_scale[res_type]
+        min_with_margin = resource_scale[f"min_{res_type}"] - res_margin
+        max_with_margin = resource_scale[f"max_{res_type}"] + res_margin
+
+        if actual < min_with_margin or actual > max_with_margin:
+            # Update resource_limited if provided and the utility is significant
+            if resource_limited is not None and max_util:
+                resource_limited.update(ResourceLimited(**{
+                    f"{res_type}_min_limit": actual < min_with_margin,
+                    f"{res_type}_max_limit": actual > max_with_margin}))
+            return False
 
     return True
 
@@ -137,7 +148,7 @@ def check_last_allocation(
     if last_allocation is None or user_id not in last_allocation:
         return None, max_util
 
-    last_alloc = copy.deepcopy(last_allocation[user_id])
+    last_alloc = dict(last_allocation[user_id])
     cache_alloc = last_alloc["cache"]
     mem_bw_alloc = None
 
@@ -275,7 +286,7 @@ def ptas_algorithm(
     guide_factor=0.1,
     logger=None,
     max_ubound=True,
-    explore_adv=0.025,
+    explore_adv=0.,
     explore_adv_ratio=0.25,    # 0.25; Or 0 to disable
     explore_adv_intense_ratio=0.5,
     verbose_n_user=8,
@@ -294,6 +305,8 @@ def ptas_algorithm(
     Parameters:
     @epsilon (float): The epsilon parameter to control the granularity of the partition.
     @price_vector (dict): A dictionary containing the prices for cache size and memory bandwidth.
+    @explore_adv (float): Weight of the confidence width of the estimation added to each candidate (UCB bonus),
+      so that candidates with sparse data are tried; 0 or an estimator without intervals disables it
     @explore_adv_ratio (float): The ratio of the exploration happens basd on the coverage
       - Set this value to < 0. to disable coverage-based exploration
     @explore_adv_intense_ratio (float): The ratio of the exploration used when the coverage is low
@@ -328,7 +341,7 @@ def ptas_algorithm(
 
     # Check the static allocation
     if last_static_allocation is not None and user_id in last_static_allocation:
-        best_alloc = copy.deepcopy(last_static_allocation[user_id])
+        best_alloc = dict(last_static_allocation[user_id])
         # {"cache": cache_alloc, "mem_bw": mem_bw_alloc}
 
         # if the current allocation is too far from the static allocation,
@@ -362,7 +375,7 @@ def ptas_algorithm(
                 resource_scale["min_cache"] >
                 best_alloc["cache"] * resource_scale["cache"]
             ):
-                best_alloc = copy.deepcopy(last_static_allocation[user_id])
+                best_alloc = dict(last_static_allocation[user_id])
         max_util = estimator.get_estimation(
             user_id,
             best_alloc["cache"] * resource_scale["cache"],
@@ -408,12 +421,10 @@ def ptas_algorithm(
     closest_to_last_util = float("-inf")
     gap_to_last = float("inf")
 
-    for cache in range(1, int(1.0 / cache_chunk_size) + 1):
-        if (
-            cache_chunk_size * cache < search_range["cache"][0]
-            or cache_chunk_size * cache > search_range["cache"][1]
-        ):
-            continue
+    # Only visit the chunks inside the search range
+    first_chunk = max(1, int(math.ceil(search_range["cache"][0] / cache_chunk_size - 1e-9)))
+    last_chunk = min(int(1.0 / cache_chunk_size), int(math.floor(search_range["cache"][1] / cache_chunk_size + 1e-9)))
+    for cache in range(first_chunk, last_chunk + 1):
         checked_point += 1
         if float(cache) * cache_chunk_size * price_vector["cache"] > budget:
             break
@@ -459,11 +470,21 @@ def ptas_algorithm(
         # Check if the allocation is within the budget
         if total_cost * margin_in_budget <= budget:
             # Get utility estimation
-            est_util = estimator.get_estimation(
-                user_id,
-                cache_alloc * resource_scale["cache"],
-                mem_bw_alloc * resource_scale["mem_bw"],
-            )
+            if explore_adv > 0. and hasattr(estimator, "get_estimation_with_confidence"):
+                # optimism under uncertainty: the bonus vanishes as the candidate gets measured
+                est_util, est_width = estimator.get_estimation_with_confidence(
+                    user_id,
+                    cache_alloc * resource_scale["cache"],
+                    mem_bw_alloc * resource_scale["mem_bw"],
+                )
+                if est_util >= 0.:
+                    est_util += explore_adv * est_width
+            else:
+                est_util = estimator.get_estimation(
+                    user_id,
+                    cache_alloc * resource_scale["cache"],
+                    mem_bw_alloc * resource_scale["mem_bw"],
+                )
 
             # If cache size decreases, it may cause temporary slowdown
             if last_allocation and reallocation_threshold > 1.0 and cache_alloc < last_allocation[user_id]["cache"]:
@@ -586,6 +607,28 @@ def get_static_allocation(num_users):
         "mem_bw": 1.0 / float(num_users),
     }
 
+def prune_search_dict(search_dict, prev_alloc, price_direction):
+    """
+    Restrict the cache search range to the half-interval where the new optimum can lie.
+
+    Within one price search the budget is fixed, so the optimal cache share is monotone in
+    the cache/mem_bw price ratio: if the cache price went up (@price_direction > 0) the
+    demand cannot exceed the previous optimum, and if it went down (< 0) it cannot fall below it.
+    """
+    if prev_alloc is None or price_direction == 0:
+        return search_dict
+    pruned = dict(search_dict)
+    low, high = search_dict["cache"]
+    if price_direction > 0:
+        high = min(high, prev_alloc["cache"])
+    else:
+        low = max(low, prev_alloc["cache"])
+    # keep the previous optimum in the range even if it came from outside the window
+    if low > high:
+        low = high = prev_alloc["cache"]
+    pruned["cache"] = [low, high]
+    return pruned
+
 def get_search_dict(cur_alloc, search_range: float):
     """
     Create a search range dictionary based on the current allocation
@@ -593,4 +636,77 @@ def get_search_dict(cur_alloc, search_range: float):
     return {
         "cache": [max(0.0, cur_alloc["cache"] - search_range), min(1.0, cur_alloc["cache"] + search_range)],
         "mem_bw": [max(0.0, cur_alloc["mem_bw"] - search_range), min(1.0, cur_alloc["mem_bw"] + search_range)],
-    }
\ No newline at end of file
+    }
+
+class SearchRangeController:
+    """
+    Per-user trust region for the PTAS search window.
+
+    The window around the last allocation shrinks by @range_delta when the chosen
+    allocation lands in the interior and the estimate agreed with the measurement,
+    and grows by @range_delta (up to @range_max) when the optimum sits on the window
+    boundary. Only the cache dimension is windowed; mem_bw follows from the budget.
+    """
+    def __init__(self, init_range, range_delta, range_max, range_min, agreement_th=0.05):
+        self.init_range = init_range
+        self.range_delta = range_delta
+        self.range_max = max(range_max, init_range)
+        self.range_min = min(range_min, init_range)
+        self.agreement_th = agreement_th
+        # user_id -> current search range
+        self.ranges = {}
+        # user_id -> search dictionary used in the last search
+        self.search_dicts = {}
+
+    def get_range(self, user_id):
+        return self.ranges.get(user_id, self.init_range)
+
+    def get_search_dict(self, user_id, cur_alloc):
+        search_dict = get_search_dict(cur_alloc, self.get_range(user_id))
+        self.search_dicts[user_id] = search_dict
+        return search_dict
+
+    def is_on_boundary(self, user_id, alloc, epsilon):
+        """
+        Check if the allocation sits on an edge of the window that could have been extended.
+        """
+        if user_id not in self.search_dicts or alloc is None:
+            return False
+        low, high = self.search_dicts[user_id]["cache"]
+        cache_alloc = alloc["cache"]
+        return (
+            (cache_alloc <= low + epsilon / 2. and low > epsilon)
+            or (cache_alloc >= high - epsilon / 2. and high < 1.0 - epsilon)
+        )
+
+    def update(self, user_id, alloc, epsilon, estimate_agreed=None):
+        """
+        Update the search range of the user based on the last search result.
+
+        @estimate_agreed: True/False if the last estimate was verified by the measurement,
+                          None if there is no measurement to compare with (no shrinking)
+        Returns the new search range.
+        """
+        cur_range = self.get_range(user_id)
+        if self.is_on_boundary(user_id, alloc, epsilon):
+            cur_range = min(self.range_max, cur_range + self.range_delta)
+        elif estimate_agreed:
+            cur_range = max(self.range_min, cur_range - self.range_delta)
+        self.ranges[user_id] = cur_range
+        return cur_range
+
+    def reset(self, user_id=None):
+        if user_id is None:
+            self.ranges = {}
+            self.search_dicts = {}
+        else:
+            self.ranges.pop(user_id, None)
+            self.search_dicts.pop(user_id, None)
+
+    def is_agreed(self, predicted_ratio, realized_ratio):
+        """
+        Check if the predicted performance ratio matches the realized one.
+        """
+        if predicted_ratio is None or realized_ratio is None or predicted_ratio <= 0:
+            return None
+        return abs(realized_ratio - predicted_ratio) <= self.agreement_th * predicted_ratio
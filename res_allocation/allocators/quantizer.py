@@ -0,0 +1,103 @@
+import math
+from .resources import get_extra_resource_types, get_limits
+
+
+def largest_remainder(values: dict, total: float, quantum: float = 1, min_value: float = 0, max_value: float = float("inf")):
+    """
+    Round the values (user -> amount) to multiples of @quantum without exceeding @total.
+
+    All of @total is handed out, so that no capacity is left idle: the units lost by flooring and the capacity the
+    values leave unclaimed go to the largest remainders first, ties broken by user ID so that the mapping is
+    deterministic. Values are kept within [min_value, max_value] whenever the total allows it, so the units left
+    once every user is at max_value stay unassigned.
+
+    Returns:
+        dict: user -> int amount
+    """
+    if not values:
+        return {}
+    users = sorted(values.keys())
+    cap_units = int(math.floor(total / quantum + 1e-9))
+    lo_units = int(math.ceil(min_value / quantum - 1e-9))
+    hi_units = int(math.floor(max_value / quantum + 1e-9)) if max_value != float("inf") else cap_units
+
+    scaled = {user: max(0., float(values[user])) / quantum for user in users}
+    # an over-subscribed allocation is scaled down to the capacity first
+    value_sum = sum(scaled.values())
+    if value_sum > cap_units:
+        scaled = {user: value * cap_units / value_sum for user, value in scaled.items()}
+        value_sum = cap_units
+    target = cap_units
+
+    units = {user: min(max(int(math.floor(scaled[user] + 1e-9)), lo_units), hi_units) for user in users}
+    diff = target - sum(units.values())
+    if diff > 0:
+        # hand out the units lost by flooring and the unclaimed capacity, largest remainder first
+        order = sorted(users, key=lambda user: (units[user] - scaled[user], user))
+        while diff > 0:
+            candidates = [user for user in order if units[user] < hi_units]
+            if not candidates:
+                break
+            for user in candidates[:diff]:
+                units[user] += 1
+            diff -= min(diff, len(candidates))
+    elif diff < 0:
+        # take back the units gained by the minimums, smallest remainder first
+        order = sorted(users, key=lambda user: (scaled[user] - units[user], user))
+        while diff < 0:
+            candidates = [user for user in order if units[user] > lo_units]
+            if not candidates:
+                break
+            for user in candidates[:-diff]:
+                units[user] -= 1
+            diff += min(-diff, len(candidates))
+    return {user: int(units[user] * quantum) for user in users}
+
+
+class AllocationQuantizer:
+    '''
+    Maps allocations in MB (cache) / Mbps (mem_bw) and the extra resources of the cluster to the units of the enforcer.
+
+    Users of the same VM are rounded together with largest-remainder rounding under the capacity of the VM,
+    so truncation does not strand resources; users without a VM are floored to the quantum.
+    '''
+    def __init__(self, resource_scale: dict, cache_quantum_in_mb: int = 1, mem_bw_quantum_in_mbps: int = 1, extra_quanta: dict = None):
+        self.quanta = {"cache": cache_quantum_in_mb, "mem_bw": mem_bw_quantum_in_mbps}
+        for res_type in get_extra_resource_types(resource_scale):
+            self.quanta[res_type] = (extra_quanta or {}).get(res_type, 1)
+        # limits in enforcer units (resource_scale is in MB and Gbps)
+        self.limits = {res_type: get_limits(resource_scale, res_type) for res_type in self.quanta}
+
+    def quantize(self, allocation: dict, vm_to_app_map: dict, vm_capacities: dict):
+        """
+        Args:
+            allocation: user -> {"cache": MB, "mem_bw": Mbps, <extra resource>: amount, ...}
+            vm_to_app_map: vm_id -> list of user IDs
+            vm_capacities: vm_id -> capacity per resource type in the same units
+
+        Returns:
+            dict: user -> {resource type: int, ...}; entries that are not dicts (e.g., users without an oracle
+            allocation) are dropped, as the deployer skips them
+        """
+        allocation = {user: alloc for user, alloc in allocation.items() if isinstance(alloc, dict)}
+        quantized = {user: dict(alloc) for user, alloc in allocation.items()}
+        grouped_users = set()
+        for vm_id, app_ids in (vm_to_app_map or {}).items():
+            vm_users = [user for user in app_ids if user in allocation]
+            if not vm_users or vm_id not in vm_capacities:
+                continue
+            grouped_users.update(vm_users)
+            for key, quantum in self.quanta.items():
+                if key not in vm_capacities[vm_id]:
+                    continue
+                values = {user: allocation[user][key] for user in vm_users if key in allocation[user]}
+                min_value, max_value = self.limits[key]
+                for user, value in largest_remainder(values, vm_capacities[vm_id][key], quantum, min_value, max_value).items():
+                    quantized[user][key] = value
+        for user in allocation:
+            if user in grouped_users:
+                continue
+            for key, quantum in self.quanta.items():
+                if key in allocation[user]:
+                    quantized[user][key] = int(math.floor(allocation[user][key] / quantum + 1e-9) * quantum)
+        return quantized
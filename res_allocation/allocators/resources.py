@@ -0,0 +1,57 @@
+"""
+Registry of the contended resource types.
+
+cache and mem_bw are always present; a cluster may declare extra resources (e.g., CPU cores, LLC ways of the compute
+VMs) under "extra_resources" in its config, which get_resource_scale() lists in resource_scale["extra_resources"]
+with their capacity and limits ("<type>", "min_<type>", "max_<type>") in enforcer units.
+
+The allocators decide on (cache, mem_bw) only and split the extra resources equally within each VM (see
+ResourceAllocator.fill_extra_resources()); their limits are enforced there, and the deployer sends them next to the
+(cache, mem_bw) allocation map.
+"""
+
+BASE_RESOURCE_TYPES = ("cache", "mem_bw")
+
+
+def get_extra_resource_types(resource_scale: dict):
+    return list(resource_scale.get("extra_resources", ()))
+
+
+def get_resource_types(resource_scale: dict):
+    """
+    Returns:
+        list: all resource types of the cluster; also the order of the values in the deploy format
+    """
+    return list(BASE_RESOURCE_TYPES) + get_extra_resource_types(resource_scale)
+
+
+def get_unit_factor(res_type: str):
+    """
+    Factor from the scale of resource_scale to enforcer units (mem_bw is in Gbps in resource_scale)
+    """
+    return 1024. if res_type == "mem_bw" else 1.  # gb to mb
+
+
+def get_capacity(resource_scale: dict, res_type: str):
+    """
+    Capacity of a resource in enforcer units (MB, Mbps, cores, ways)
+    """
+    return resource_scale[res_type] * get_unit_factor(res_type)
+
+
+def get_limits(resource_scale: dict, res_type: str):
+    """
+    Returns:
+        (min, max) allocation of a user in enforcer units
+    """
+    factor = get_unit_factor(res_type)
+    return (resource_scale.get(f"min_{res_type}", 0) * factor, resource_scale.get(f"max_{res_type}", float("inf")) * factor)
+
+
+def get_share_limits(resource_scale: dict, res_type: str):
+    """
+    Returns:
+        (min, max) allocation of a user as a share of the capacity
+    """
+    return (resource_scale.get(f"min_{res_type}", 0) / resource_scale[res_type],
+            min(1., resource_scale.get(f"max_{res_type}", float("inf")) / resource_scale[res_type]))
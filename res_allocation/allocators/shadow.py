@@ -0,0 +1,111 @@
+import copy
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from utils import metrics
+from utils.logger import Logger
+
+SHADOW_ROUNDS = metrics.REGISTRY.counter("spirit_shadow_rounds_total", "Number of shadow allocation rounds by allocator and status")
+SHADOW_LATENCY = metrics.REGISTRY.histogram("spirit_shadow_allocation_seconds", "Wall time of a shadow allocation round")
+SHADOW_UTILITY = metrics.REGISTRY.gauge("spirit_shadow_predicted_utility", "Predicted relative performance (sum and min over the apps) of the live and shadow allocations")
+
+
+class ShadowEvaluator:
+    '''
+    Runs alternative allocators in shadow next to the live one.
+
+    Once per round, submit() takes a snapshot of the monitor at the decision point of the live allocator, and every
+    shadow allocator computes its own allocation on it in a worker thread. The shadows never deploy: each round
+    logs the live and the shadow allocation side by side with the per-app performance the estimator predicts for
+    them, relative to the allocation in force when the live allocator decided, so allocators can be compared on
+    the same traffic without separate experiment runs.
+
+    The snapshot copies only the containers of the state the allocators read while the monitor lock is held; the
+    record lists stay shared until a worker copies them (see ResourceMonitor.get_snapshot()). Each shadow has its
+    own estimator (see RuntimeEstimator.fork()) whose learned state is reloaded from a copy of the live one taken
+    with the snapshot, whose monitor is the snapshot, and whose current allocation is the one the live allocator
+    started from; its estimations are counted under the name of the shadow.
+    A shadow still busy with an earlier round skips the new one, so slow shadows never queue up behind the live loop.
+    '''
+    def __init__(self, shadows: dict, max_workers: int = 1, logger_name: str = 'shadow_allocators'):
+        """
+        Args:
+            shadows: name -> initialized allocator with its own estimator (see create_shadow_evaluator() of main_memcached)
+        """
+        self.shadows = shadows
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="shadow")
+        # name -> future of the round in flight
+        self.futures = {}
+        self.logger = Logger()
+        self.logger.prepare_logger(logger_name)
+        self.logger.log_msg(f"Shadow allocators: {list(shadows)}, workers: {max_workers}")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.logger.close()
+
+    @staticmethod
+    def _take_snapshot(live_allocator):
+        """
+        (monitor snapshot, learned state of the estimator); the state of the estimator is small (per-app models and
+        calibration windows), the record lists of the monitor are copied by freeze_snapshot() in the workers
+        """
+        return live_allocator.monitor.get_snapshot(), copy.deepcopy(live_allocator.estimator.get_checkpoint_state())
+
+    def submit(self, live_allocator, allocation: dict, iteration: int):
+        """
+        Start a shadow round; call with the monitor lock held, before the live allocation is deployed
+
+        Args:
+            allocation: live allocation of this round (MB, Mbps)
+        """
+        current_allocation = live_allocator.get_last_allocation()
+        if not current_allocation:
+            return
+        snapshot = None
+        for name, shadow in self.shadows.items():
+            if name in self.futures and not self.futures[name].done():
+                SHADOW_ROUNDS.inc(allocator=name, status="skipped")
+                continue
+            if snapshot is None:
+                snapshot, estimator_state = self._take_snapshot(live_allocator)
+            self.futures[name] = self.executor.submit(self._run, name, shadow, snapshot, estimator_state,
+                                                      copy.deepcopy(current_allocation), copy.deepcopy(allocation), iteration)
+
+    def _get_utilities(self, estimator, allocation):
+        return {user: float(estimator.get_estimation(user, alloc["cache"], alloc["mem_bw"] / 1024.))  # mb to gb
+                for user, alloc in allocation.items()}
+
+    def _run(self, name, shadow, snapshot, estimator_state, current_allocation, live_allocation, iteration):
+        start_time = time.perf_counter()
+        try:
+            snapshot.freeze_snapshot()
+            shadow.monitor = snapshot
+            shadow.estimator.set_monitor(snapshot)
+            shadow.estimator.load_checkpoint_state(copy.deepcopy(estimator_state))
+            # estimations are relative to the allocation the live allocator started from
+            shadow.e2e_last_allocation = current_allocation
+            allocation = shadow.quantize_allocation(shadow.allocate_and_parse())
+            elapsed = time.perf_counter() - start_time
+            live_utils = self._get_utilities(shadow.estimator, live_allocation)
+            shadow_utils = self._get_utilities(shadow.estimator, allocation)
+        except Exception as e:
+            SHADOW_ROUNDS.inc(allocator=name, status="failed")
+            self.logger.log_msg(f"Iter: {iteration} | Shadow: {name} | Failed: {e}\n{traceback.format_exc()}", level='warning')
+            return
+        SHADOW_ROUNDS.inc(allocator=name, status="ok")
+        SHADOW_LATENCY.observe(elapsed, allocator=name)
+        summary = {}
+        for label, utils in (("live", live_utils), (name, shadow_utils)):
+            # apps without an estimation (-1) are left out of the summary
+            valid = [util for util in utils.values() if util >= 0]
+            summary[label] = {"sum": round(sum(valid), 4), "min": round(min(valid), 4) if valid else None}
+            for stat, value in summary[label].items():
+                if value is not None:
+                    SHADOW_UTILITY.set(value, allocator=label, stat=stat)
+        self.logger.log_msg(f"Iter: {iteration} | Shadow: {name} | Runtime (ms): {elapsed * 1e3:.3f} | Predicted (live vs shadow): {summary}")
+        for user in sorted(set(live_allocation) | set(allocation)):
+            live_alloc, shadow_alloc = live_allocation.get(user), allocation.get(user)
+            self.logger.log_msg(f"Iter: {iteration} | Shadow: {name} | User: {user} | "
+                                f"live: {live_alloc}, util: {live_utils.get(user, -1.):.4f} | "
+                                f"shadow: {shadow_alloc}, util: {shadow_utils.get(user, -1.):.4f}")
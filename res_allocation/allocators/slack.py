@@ -0,0 +1,143 @@
+from utils import metrics
+
+SLACK_LENT = metrics.REGISTRY.gauge("spirit_slack_lent", "Resources lent from idle allocations (MB for cache, Mbps for mem_bw)")
+SLACK_RECLAIMS = metrics.REGISTRY.counter("spirit_slack_reclaims_total", "Number of loans reclaimed by their owner")
+
+
+class SlackRedistributor:
+    '''
+    Work-conserving stage between the solve and the deployment.
+
+    The allocation of the allocator is the entitlement of each user. A user whose usage stays well below its
+    entitlement for @persistence_rounds rounds lends the slack to the users of the same VM with the highest
+    estimated marginal utility. Loans are recomputed from the entitlements every round and are reclaimed as soon as
+    the owner's usage approaches what it is left with, so an owner is back to its entitlement within one round.
+    The allocator never sees the loans (its own state keeps the entitlements), which keeps the fairness of the CEEI result.
+    '''
+    def __init__(self, resource_scale: dict, slack_ratio: float = 0.3, persistence_rounds: int = 3,
+                 headroom_ratio: float = 0.1, reclaim_ratio: float = 0.05, num_chunks: int = 4, min_gain: float = 0.01):
+        # usage below (1 - slack_ratio) of the entitlement is slack
+        self.slack_ratio = slack_ratio
+        self.persistence_rounds = persistence_rounds
+        # the lender keeps its usage plus this headroom
+        self.headroom_ratio = headroom_ratio
+        # reclaim when the usage is within this ratio of the lender's reduced allocation
+        self.reclaim_ratio = reclaim_ratio
+        self.num_chunks = num_chunks
+        # minimum relative performance gain of a borrower per chunk
+        self.min_gain = min_gain
+        self.limits = {
+            "cache": (resource_scale.get("min_cache", 0), resource_scale.get("max_cache", float("inf"))),
+            "mem_bw": (resource_scale.get("min_mem_bw", 0) * 1024., resource_scale.get("max_mem_bw", float("inf")) * 1024.),
+        }
+        # user -> resource -> consecutive rounds with slack
+        self.slack_rounds = {}
+        # user -> resource -> amount lent (lenders) or borrowed (borrowers) in the last round
+        self.lent = {}
+        self.borrowed = {}
+
+    def get_state(self):
+        return {"slack_rounds": self.slack_rounds, "lent": self.lent, "borrowed": self.borrowed}
+
+    def load_state(self, state):
+        self.slack_rounds = state["slack_rounds"]
+        self.lent = state["lent"]
+        self.borrowed = state["borrowed"]
+
+    def _update_slack_rounds(self, user, key, entitlement, usage):
+        """
+        Returns:
+            bool: True if the user may lend the resource this round
+        """
+        rounds = self.slack_rounds.setdefault(user, {}).get(key, 0)
+        deployed = entitlement - self.lent.get(user, {}).get(key, 0.)
+        if self.lent.get(user, {}).get(key, 0.) > 0. and usage >= deployed * (1. - self.reclaim_ratio):
+            # the owner needs its resource back
+            SLACK_RECLAIMS.inc(resource=key)
+            self.slack_rounds[user][key] = 0
+            return False
+        if usage < entitlement * (1. - self.slack_ratio):
+            rounds += 1
+        else:
+            rounds = 0
+        self.slack_rounds[user][key] = rounds
+        return rounds >= self.persistence_rounds
+
+    def _get_gain(self, estimator, user, alloc, key, amount):
+        base = estimator.get_estimation(user, alloc["cache"], alloc["mem_bw"] / 1024.)   # mb to gb
+        if base <= 0:
+            return -1.
+        target = dict(alloc)
+        target[key] += amount
+        return estimator.get_estimation(user, target["cache"], target["mem_bw"] / 1024.) / base - 1.
+
+    def redistribute(self, allocation: dict, vm_to_app_map: dict, monitor, estimator):
+        """
+        Args:
+            allocation: user -> {"cache": MB, "mem_bw": Mbps} entitlements of this round
+            vm_to_app_map: vm_id -> list of user IDs
+            monitor: resource monitor (get_last_usage())
+            estimator: performance estimator
+
+        Returns:
+            dict: allocation with the loans applied
+        """
+        redistributed = {user: dict(alloc) for user, alloc in allocation.items()}
+        lent, borrowed = {}, {}
+        for vm_id, app_ids in (vm_to_app_map or {}).items():
+            vm_users = sorted(user for user in app_ids if user in allocation)
+            if len(vm_users) < 2:
+                continue
+            for key in ["cache", "mem_bw"]:
+                min_value, max_value = self.limits[key]
+                # collect the slack of the lenders
+                pool = 0.
+                lenders = set()
+                for user in vm_users:
+                    usage = monitor.get_last_usage(user)
+                    if not usage or key not in usage:
+                        continue
+                    entitlement = allocation[user][key]
+                    if not self._update_slack_rounds(user, key, entitlement, usage[key]):
+                        continue
+                    amount = entitlement - max(min_value, usage[key] * (1. + self.headroom_ratio))
+                    if amount <= 0.:
+                        continue
+                    redistributed[user][key] -= amount
+                    lent.setdefault(user, {})[key] = amount
+                    lenders.add(user)
+                    pool += amount
+                if pool <= 0.:
+                    continue
+
+                # lend in chunks to the borrower with the highest marginal utility
+                chunk = pool / self.num_chunks
+                borrowers = [user for user in vm_users if user not in lenders]
+                while pool > 1e-6 and borrowers:
+                    best_user, best_gain = None, self.min_gain
+                    for user in borrowers:
+                        amount = min(chunk, pool, max_value - redistributed[user][key])
+                        if amount <= 0.:
+                            continue
+                        gain = self._get_gain(estimator, user, redistributed[user], key, amount)
+                        if gain > best_gain:
+                            best_user, best_gain = user, gain
+                    if best_user is None:
+                        break
+                    amount = min(chunk, pool, max_value - redistributed[best_user][key])
+                    redistributed[best_user][key] += amount
+                    borrowed.setdefault(best_user, {})[key] = borrowed.get(best_user, {}).get(key, 0.) + amount
+                    pool -= amount
+
+                # slack nobody can use goes back to its owners
+                if pool > 1e-6:
+                    total_lent = sum(lent[user][key] for user in lenders)
+                    for user in lenders:
+                        refund = pool * lent[user][key] / total_lent
+                        redistributed[user][key] += refund
+                        lent[user][key] -= refund
+
+        self.lent, self.borrowed = lent, borrowed
+        for key in ["cache", "mem_bw"]:
+            SLACK_LENT.set(sum(amounts.get(key, 0.) for amounts in lent.values()), resource=key)
+        return redistributed
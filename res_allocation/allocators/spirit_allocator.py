@@ -5,8 +5,11 @@ import math
 import numpy as np
 import numpy as np
 from utils.logger import Logger
+from utils import metrics
 from .allocator_base import ResourceAllocator, AllocatorParams, base_search_granularity
-from .ptas_algorithm import ptas_algorithm, get_static_allocation, get_search_dict, ResourceLimited
+from .allocation_matrix import AllocationMatrix
+from .resources import get_resource_types, get_capacity
+from .ptas_algorithm import ptas_algorithm, get_static_allocation, get_search_dict, prune_search_dict, ResourceLimited, SearchRangeController
 
 _search_granularity = base_search_granularity
 
@@ -19,13 +22,21 @@ class SpiritAllocatorParams(AllocatorParams):
         search_range: float = _search_granularity * 5,      # 3 x search_granularity
         search_range_delta: float = 0.025,
         search_range_max: float = 0.4,
+        search_range_min: float = _search_granularity * 2,
         measurements_per_alloc: float = 0.25,  # it's per second
     ) -> None:
         super().__init__(search_granularity, allocation_interval_in_sec)
         self.init_phase_interval = init_phase_interval
         self.search_range = search_range
+        # trust region of the search window: +/- search_range_delta per allocation,
+        # bounded by [search_range_min, search_range_max]; delta = 0 disables it
         self.search_range_delta = search_range_delta
         self.search_range_max = search_range_max
+        self.search_range_min = search_range_min
+        # relative error between estimated and measured performance change to shrink the window
+        self.search_range_agreement_th = 0.05
+        # scan only the half-interval of the previous optimum within one price search
+        self.monotone_pruning = True
         self.measurements_per_alloc = (
             int(allocation_interval_in_sec * measurements_per_alloc)
         )
@@ -38,6 +49,14 @@ class SpiritAllocatorParams(AllocatorParams):
         self.adaptive_iter=False
         self.min_iter_bound=5
         self.max_iter_bound=25
+        # change gate: reuse the previous allocation while no user's MRC, usage or performance moved by more than
+        # this relative change since the last solve (None disables), re-solving at least every change_gate_max_skips rounds
+        self.change_gate_th = 0.02
+        self.change_gate_max_skips = 10
+        # exploration: weight of the confidence width of the estimations (UCB bonus, 0 disables), given to at most
+        # max_explorers_per_vm users of each VM per round so that concurrent probes do not interfere
+        self.exploration_weight = 1.0
+        self.max_explorers_per_vm = 1
 
 class SpiritAllocator(ResourceAllocator):
     ### ===================== internal functions ====================== ###
@@ -48,21 +67,75 @@ class SpiritAllocator(ResourceAllocator):
         estimator=None,
         monitor=None,
         deployer=None,
+        logger_name: str = 'spirit_ceei_allocator',
     ):
-        super().__init__(config_path, resource_scale, estimator, monitor, deployer)
+        super().__init__(config_path, resource_scale, estimator, monitor, deployer, logger_name)
         self.last_allocation = None
         self.last_static_allocation = None
         self.num_conflict_resolve_th = 3
         self.num_conflict = 0
         self.max_iteration=20
         self.was_converged = True
+        # per-user trust region for the search window
+        self.search_range_ctrl = None
+        # user -> (estimated performance ratio of the deployed allocation, performance before deployment)
+        self.pending_estimates = {}
+        # vm_id -> bandwidth share of the VM from the global market, in which its mem_bw allocations are normalized
+        self.vm_mem_bw_shares = {}
+        # change gate: user -> state at the last solve, and the allocation (MB, Mbps) of that solve
+        self.change_fingerprints = {}
+        self.last_solved_allocation = None
+        self.last_solved_vm_map = None
+        self.num_skipped_rounds = 0
+        # apps admitted after the first dynamic solve that are still in their init phase; their VMs keep the seeded allocation
+        self.warming_apps = set()
+        # users of the VM being solved that get the exploration bonus (see _select_explorers)
+        self.explorers = set()
 
     def initialize(self, param: AllocatorParams = SpiritAllocatorParams(1.0)):
         super().initialize(param)
         self.parameters: SpiritAllocatorParams = param
+        self.search_range_ctrl = SearchRangeController(
+            param.search_range, param.search_range_delta,
+            param.search_range_max, param.search_range_min,
+            agreement_th=param.search_range_agreement_th)
+
+    def get_checkpoint_state(self):
+        state = super().get_checkpoint_state()
+        state.update({
+            "last_allocation": self.last_allocation,
+            "last_static_allocation": self.last_static_allocation,
+            "num_conflict": self.num_conflict,
+            "max_iteration": self.max_iteration,
+            "search_ranges": self.search_range_ctrl.ranges if self.search_range_ctrl else {},
+            "vm_mem_bw_shares": self.vm_mem_bw_shares,
+            "global_market_shares": self.global_market.last_vm_shares if self.global_market else {},
+            "change_fingerprints": self.change_fingerprints,
+            "last_solved_allocation": self.last_solved_allocation,
+            "last_solved_vm_map": self.last_solved_vm_map,
+            "warming_apps": self.warming_apps,
+        })
+        return state
+
+    def load_checkpoint_state(self, state):
+        super().load_checkpoint_state(state)
+        self.last_allocation = state["last_allocation"]
+        self.last_static_allocation = state["last_static_allocation"]
+        self.num_conflict = state["num_conflict"]
+        self.max_iteration = state["max_iteration"]
+        if self.search_range_ctrl is not None:
+            self.search_range_ctrl.ranges = state["search_ranges"]
+        self.vm_mem_bw_shares = state["vm_mem_bw_shares"]
+        if self.global_market is not None:
+            self.global_market.last_vm_shares = state["global_market_shares"]
+        self.change_fingerprints = state["change_fingerprints"]
+        self.last_solved_allocation = state["last_solved_allocation"]
+        self.last_solved_vm_map = state["last_solved_vm_map"]
+        self.warming_apps = state["warming_apps"]
 
     def allocate_and_parse(self, skip_monitoring=False, verbose_n_user=8):
         start_time = time.time_ns()
+        self.round_skipped = False
 
         # Get VM to app mapping
         vm_to_app_map = self.monitor.get_vm_to_app_mapping()
@@ -71,7 +144,7 @@ class SpiritAllocator(ResourceAllocator):
         # allocation
         users = self.estimator.get_app_ids()
         allocation = {}
-        extract_keys = ["cache", "mem_bw"]
+        extract_keys = self.get_market_resource_types()
 
         static_alloc = True
         if not skip_monitoring:
@@ -91,8 +164,10 @@ class SpiritAllocator(ResourceAllocator):
             static_alloc = True if self.last_static_allocation is None else False
 
         is_complete_vm_map = vm_to_app_map and (set(users) - set(user for app_list in vm_to_app_map.values() for user in app_list) == set())
+        # After the first dynamic solve, arrivals and departures are admitted per VM instead of a cluster-wide static reset
+        incremental = not skip_monitoring and bool(vm_to_app_map) and self.last_solved_vm_map is not None
         # If we need to use static allocation or no VM mapping is available
-        if static_alloc or not is_complete_vm_map:
+        if (static_alloc or not is_complete_vm_map) and not incremental:
             self.last_allocation = {}
 
             if not is_complete_vm_map:
@@ -100,53 +175,64 @@ class SpiritAllocator(ResourceAllocator):
                 users_per_vm = max(1, len(users) // num_vms)
                 # No VM mapping - use flat allocation
                 self.logger.log_msg(f"VM to app mapping not available. Using flat allocation across all apps. Number of VMs: {num_vms}")
+                static_groups = {}
                 for idx, user in enumerate(users):
-                    vm_idx = idx // users_per_vm
-                    users_in_this_vm = users_per_vm if vm_idx < num_vms else len(users) - vm_idx * users_per_vm
-                    allocation[user] = {}
-                    self.last_allocation[user] = {}
-                    for key in extract_keys:
-                        allocation[user][key] = float(
-                            self.resource_scale[key] / float(users_in_this_vm)
-                        )
-                        # update latest allocation
-                        if key == "mem_bw":
-                            allocation[user][key] *= 1024  # gb to mb
-                        # enforce int
-                        allocation[user][key] = int(allocation[user][key])
-                        self.last_allocation[user][key] = 1. / float(users_in_this_vm)
+                    static_groups.setdefault(idx // users_per_vm, []).append(user)
             else:
                 # With VM mapping - allocate per VM
                 self.logger.log_msg("Using per-VM static allocation with VM mapping.")
-
-                # Process each VM
+                static_groups = {}
                 for vm_id, app_ids in vm_to_app_map.items():
                     # Filter app IDs to those in our user list
                     vm_apps = [app_id for app_id in app_ids if app_id in users]
                     vm_apps.sort()
-
-                    if not vm_apps:
-                        continue
-
-                    # Each VM gets full resources, divide equally among apps in this VM
-                    for user in vm_apps:
-                        allocation[user] = {}
-                        self.last_allocation[user] = {}
-                        for key in extract_keys:
-                            allocation[user][key] = float(
-                                self.resource_scale[key] / float(len(vm_apps))
-                            )
-                            # update latest allocation
-                            if key == "mem_bw":
-                                allocation[user][key] *= 1024  # gb to mb
-                            # enforce int
-                            allocation[user][key] = int(allocation[user][key])
-                            self.last_allocation[user][key] = 1. / float(len(vm_apps))
+                    if vm_apps:
+                        static_groups[vm_id] = vm_apps
+
+            # With a global market, VMs split the memory-node bandwidth equally
+            self.vm_mem_bw_shares = {}
+            if self.global_market is not None:
+                self.vm_mem_bw_shares = self.global_market.get_equal_shares(list(static_groups.keys()))
+
+            # Each VM gets full resources, divided equally among its apps unless all of them have priors
+            for group_id, group in static_groups.items():
+                shares = self._get_prior_shares(group)
+                if shares is None:
+                    shares = {user: dict.fromkeys(extract_keys, 1. / float(len(group))) for user in group}
+                else:
+                    self.logger.log_msg(f"Using prior allocation for apps {group}: {shares}")
+                vm_resource_scale = self._get_vm_resource_scale(group_id, self.resource_scale)
+                for user in group:
+                    allocation[user] = {}
+                    self.last_allocation[user] = {}
+                    for key in extract_keys:
+                        # priors only cover cache and mem_bw
+                        share = shares[user].get(key, 1. / float(len(group)))
+                        allocation[user][key] = float(share * get_capacity(vm_resource_scale, key))
+                        # update latest allocation
+                        self.last_allocation[user][key] = share
 
             self.logger.log_msg("Static allocation in actual resource unit (MB, Mbps): {}".format(allocation))
             self.last_static_allocation = copy.deepcopy(self.last_allocation)
+            self.last_solved_allocation = None
             return allocation
 
+        # Seed the newcomers of each VM; only the VMs with arrivals or departures (or a phase change) are re-solved
+        resolve_vms = self.out_of_band_vms
+        if incremental:
+            changed_vms = self._admit_vm_changes(vm_to_app_map, users)
+            if changed_vms:
+                resolve_vms = (resolve_vms or set()) | changed_vms
+        active_users = [user for app_ids in vm_to_app_map.values() for user in app_ids if user in users]
+
+        # Nothing moved since the last solve: keep its allocation
+        if resolve_vms is None and self._is_unchanged(active_users, vm_to_app_map):
+            self.num_skipped_rounds += 1
+            self.round_skipped = True
+            metrics.ALLOCATION_SKIPS.inc(allocator=type(self).__name__)
+            self.logger.log_msg(f"Change gate: no change since the last solve, skipped rounds: {self.num_skipped_rounds}")
+            return copy.deepcopy(self.last_solved_allocation)
+
         # Now we have enough data point - dynamic allocation
         # Here, is_complete_vm_map is True
         # Per-VM allocation
@@ -154,6 +240,11 @@ class SpiritAllocator(ResourceAllocator):
         all_runtime_list = []
         all_num_iter_list = []
 
+        # Outer market: divide the memory-node bandwidth across VMs (kept as is while re-solving a subset of VMs)
+        if self.global_market is not None and resolve_vms is None:
+            self._update_vm_mem_bw_shares(vm_to_app_map, users)
+
+        nominal_resource_scale = self.resource_scale
         for vm_id, app_ids in vm_to_app_map.items():
             # Filter app IDs to those in our user list
             vm_apps = [app_id for app_id in app_ids if app_id in users]
@@ -162,7 +253,25 @@ class SpiritAllocator(ResourceAllocator):
             if not vm_apps:
                 continue
 
+            # Only the VMs with a phase change or a membership change are re-solved; the others keep their allocation
+            if resolve_vms is not None and vm_id not in resolve_vms\
+                and self.last_solved_allocation and all(user in self.last_solved_allocation for user in vm_apps):
+                for user in vm_apps:
+                    allocation[user] = dict(self.last_solved_allocation[user])
+                continue
+
+            # The per-VM market clears within the bandwidth share of the VM
+            self.resource_scale = self._get_vm_resource_scale(vm_id, nominal_resource_scale)
+
+            # Newcomers in their init phase: the VM keeps the seeded allocation
+            if self._is_vm_warming(vm_apps):
+                self.logger.log_msg(f"VM {vm_id} - Apps {sorted(self.warming_apps & set(vm_apps))} in init phase, keeping the seeded allocation")
+                for user in vm_apps:
+                    allocation[user] = {key: self.last_allocation[user][key] * get_capacity(self.resource_scale, key) for key in extract_keys}
+                continue
+
             # Perform allocation for this VM's apps
+            self.explorers = self._select_explorers(vm_apps)
             vm_cur_alloc, vm_runtime_list, vm_num_iter_list, vm_converged = self.allocate(
                 vm_apps,
                 dict.fromkeys(vm_apps, 1 / len(vm_apps)),
@@ -179,37 +288,33 @@ class SpiritAllocator(ResourceAllocator):
                     allocation[user] = {}
                     for key in extract_keys:
                         self.last_allocation[user][key] = 1. / float(len(vm_apps))
-                        allocation[user][key] = float(self.resource_scale[key] / float(len(vm_apps)))
-                        if key == "mem_bw":
-                            allocation[user][key] *= 1024  # gb to mb
-                        allocation[user][key] = int(allocation[user][key])
+                        allocation[user][key] = float(get_capacity(self.resource_scale, key) / float(len(vm_apps)))
                 continue
 
             # Update runtime metrics
             all_runtime_list.extend(vm_runtime_list)
             all_num_iter_list.extend(vm_num_iter_list)
 
+            # Adjust the search window for the next allocation
+            if vm_converged:
+                self._update_search_ranges(vm_apps, vm_cur_alloc)
+
             # Update last_allocation with this VM's allocation
-            for user in vm_cur_alloc.keys():
-                if not isinstance(vm_cur_alloc[user], dict):
-                    continue
+            # (the conflict fallback returns the last allocation of all users; the other VMs are scaled by their own share)
+            vm_allocated = [user for user in vm_apps if user in vm_cur_alloc and isinstance(vm_cur_alloc[user], dict)]
+            # resource allocation in actual units (MB, Mbps, ...)
+            vm_allocation = AllocationMatrix.from_dict(vm_cur_alloc, vm_allocated, extract_keys).scale(
+                {key: get_capacity(self.resource_scale, key) for key in extract_keys})
+            for user in vm_allocated:
                 if user not in self.last_allocation:
                     self.last_allocation[user] = {}
                 self.last_allocation[user].update(vm_cur_alloc[user])
-
-                # Create resource allocation for this user
-                allocation[user] = {}
-                for key in extract_keys:
-                    if key in vm_cur_alloc[user]:
-                        allocation[user][key] = (
-                            vm_cur_alloc[user][key] * self.resource_scale[key]
-                        )
-                        if key == "mem_bw":
-                            allocation[user][key] *= 1024.0  # gb to mb
-                        allocation[user][key] = int(allocation[user][key])
+                allocation[user] = vm_allocation.row(user)
                 if user <= verbose_n_user:
                     self.logger.log_msg(f"VM {vm_id} - Current allocation for user {user}: {vm_cur_alloc[user]} // {allocation[user]}")
 
+        self.resource_scale = nominal_resource_scale
+
         # Log metrics for all VMs
         runtime_list = {
             "per-user": np.sum(all_runtime_list),  # aggregate over iterations
@@ -219,8 +324,166 @@ class SpiritAllocator(ResourceAllocator):
         self.logger.log_msg(f"All VMs - Num_iter: {all_num_iter_list}")
         self.logger.log_msg(f"All VMs - Runtime (ms): {runtime_list}")
 
+        self.change_fingerprints = {user: self._get_change_fingerprint(user) for user in active_users}
+        self.last_solved_allocation = copy.deepcopy(allocation)
+        self.last_solved_vm_map = self._get_vm_membership(vm_to_app_map, active_users)
+        self.num_skipped_rounds = 0
         return allocation
 
+    def _admit_vm_changes(self, vm_to_app_map, users):
+        """
+        Apply the arrivals and departures of each VM since the last solve to last_allocation: departed apps are dropped,
+        newcomers are seeded from their prior (or the equal share of the VM) carved proportionally from the incumbents.
+
+        Returns:
+            set: IDs of the VMs whose membership changed
+        """
+        changed_vms = set()
+        active_apps = set(app_id for app_ids in vm_to_app_map.values() for app_id in app_ids if app_id in users)
+        for vm_id, app_ids in vm_to_app_map.items():
+            vm_apps = sorted(app_id for app_id in app_ids if app_id in users)
+            prev_apps = self.last_solved_vm_map.get(vm_id, [])
+            if not vm_apps or vm_apps == prev_apps:
+                continue
+            changed_vms.add(vm_id)
+            newcomers = [user for user in vm_apps if user not in prev_apps]
+            departed = [user for user in prev_apps if user not in vm_apps]
+            incumbents = [user for user in vm_apps if user in prev_apps and user in self.last_allocation]
+            newcomers += [user for user in vm_apps if user in prev_apps and user not in self.last_allocation]
+            self.logger.log_msg(f"VM {vm_id} - Arrivals: {newcomers}, departures: {departed}")
+
+            market_resource_types = self.get_market_resource_types()
+            shares = {}
+            for user in newcomers:
+                prior = self._get_prior_shares([user])
+                prior = prior[user] if prior is not None else {}
+                shares[user] = {key: prior.get(key, 1. / len(vm_apps)) for key in market_resource_types}
+            for key in market_resource_types:
+                if sum(share[key] for share in shares.values()) >= 1.:
+                    for share in shares.values():
+                        share[key] = 1. / len(vm_apps)
+            # the incumbents keep their proportions within what the newcomers leave
+            for key in market_resource_types:
+                remaining = 1. - sum(shares[user][key] for user in newcomers)
+                incumbent_total = sum(self.last_allocation[user].get(key, 0.) for user in incumbents)
+                for user in incumbents:
+                    share = self.last_allocation[user].get(key, 0.) * remaining / incumbent_total if incumbent_total > 0 else remaining / len(incumbents)
+                    shares.setdefault(user, {})[key] = share
+            for user in vm_apps:
+                self.last_allocation.setdefault(user, {}).update(shares[user])
+            self.warming_apps.update(newcomers)
+        # departed apps (an app moving to another VM is admitted there as a newcomer)
+        for prev_apps in self.last_solved_vm_map.values():
+            for user in prev_apps:
+                if user not in active_apps:
+                    self.last_allocation.pop(user, None)
+                    self.warming_apps.discard(user)
+        return changed_vms
+
+    def _select_explorers(self, vm_apps):
+        """
+        Users of a VM that explore this round: the ones with the fewest distinct measured allocations
+        """
+        if self.parameters.exploration_weight <= 0. or self.parameters.max_explorers_per_vm <= 0:
+            return set()
+        num_datapoints = {user: self.monitor.collected_data[user]["total_datapoint"] if user in self.monitor.collected_data else 0
+                          for user in vm_apps}
+        explorers = set(sorted(vm_apps, key=lambda user: (num_datapoints[user], user))[:self.parameters.max_explorers_per_vm])
+        self.logger.log_msg(f"Explorers: {sorted(explorers)} | #datapoints: {num_datapoints}")
+        return explorers
+
+    def _get_vm_membership(self, vm_to_app_map, users):
+        vm_membership = {vm_id: sorted(app_id for app_id in app_ids if app_id in users) for vm_id, app_ids in vm_to_app_map.items()}
+        return {vm_id: vm_apps for vm_id, vm_apps in vm_membership.items() if vm_apps}
+
+    def _is_vm_warming(self, vm_apps):
+        for user in list(self.warming_apps & set(vm_apps)):
+            if user in self.monitor.collected_data and self.monitor.collected_data[user]["total_record"] >= self.parameters.init_phase_interval:
+                self.warming_apps.discard(user)
+        return bool(self.warming_apps & set(vm_apps))
+
+    def _get_change_fingerprint(self, user):
+        """
+        State of a user watched by the change gate: MRC, usage (MB, Mbps) and latest performance
+        """
+        usage = self.monitor.get_last_usage(user) if user in self.monitor.last_usage else None
+        return {
+            "mrc": [float(miss) for _, miss in (self.monitor.get_last_mrc(user) or [])],
+            "usage": dict(usage) if usage else {},
+            "perf": self.monitor.get_latest_perf(user),
+        }
+
+    def _get_change(self, prev, cur):
+        """
+        Largest relative change between two fingerprints (inf if not comparable)
+        """
+        if len(prev["mrc"]) != len(cur["mrc"]) or set(prev["usage"].keys()) != set(cur["usage"].keys()):
+            return float("inf")
+        if (prev["perf"] is None) != (cur["perf"] is None):
+            return float("inf")
+        # miss ratios are already in [0, 1]
+        change = max([abs(a - b) for a, b in zip(prev["mrc"], cur["mrc"])], default=0.)
+        for key, value in cur["usage"].items():
+            change = max(change, abs(value - prev["usage"][key]) / max(1., abs(prev["usage"][key])))
+        if cur["perf"] is not None:
+            change = max(change, abs(cur["perf"] - prev["perf"]) / max(1., abs(prev["perf"])))
+        return change
+
+    def _is_unchanged(self, users, vm_to_app_map):
+        if self.parameters.change_gate_th is None or self.last_solved_allocation is None or self.out_of_band_vms is not None:
+            return False
+        if self.num_skipped_rounds >= self.parameters.change_gate_max_skips:
+            return False
+        # a new app, a departure or a VM change needs a new solve
+        if set(users) != set(self.last_solved_allocation.keys()) or set(users) != set(self.change_fingerprints.keys()):
+            return False
+        if self._get_vm_membership(vm_to_app_map, users) != self.last_solved_vm_map:
+            return False
+        return all(self._get_change(self.change_fingerprints[user], self._get_change_fingerprint(user)) < self.parameters.change_gate_th
+                   for user in users)
+
+    def _get_vm_resource_scale(self, vm_id, nominal_resource_scale):
+        """
+        Resource scale of a VM: the nominal scale, with the memory bandwidth of its share of the memory node
+        """
+        if vm_id not in self.vm_mem_bw_shares:
+            return nominal_resource_scale
+        vm_resource_scale = dict(nominal_resource_scale)
+        vm_resource_scale["mem_bw"] = nominal_resource_scale["mem_bw"] * self.vm_mem_bw_shares[vm_id]
+        return vm_resource_scale
+
+    def get_vm_capacity(self, vm_id):
+        vm_resource_scale = self._get_vm_resource_scale(vm_id, self.resource_scale)
+        return {key: get_capacity(vm_resource_scale, key) for key in get_resource_types(vm_resource_scale)}
+
+    def _update_vm_mem_bw_shares(self, vm_to_app_map, users):
+        """
+        Run the outer market and renormalize the mem_bw allocations of each VM to its new share.
+        """
+        vm_to_users = {vm_id: sorted(app_id for app_id in app_ids if app_id in users)
+                       for vm_id, app_ids in vm_to_app_map.items()}
+        vm_to_users = {vm_id: vm_apps for vm_id, vm_apps in vm_to_users.items() if vm_apps}
+        # the market works on nominal shares
+        nominal_allocation = {}
+        for vm_id, vm_apps in vm_to_users.items():
+            old_share = self.vm_mem_bw_shares.get(vm_id, 1.0)
+            for user in vm_apps:
+                if user in self.last_allocation:
+                    nominal_allocation[user] = {"cache": self.last_allocation[user]["cache"],
+                                                "mem_bw": self.last_allocation[user]["mem_bw"] * old_share}
+        new_shares = self.global_market.get_vm_shares(vm_to_users, self.estimator, nominal_allocation)
+        for vm_id, vm_apps in vm_to_users.items():
+            new_share = new_shares[vm_id]
+            vm_users = [user for user in vm_apps if user in nominal_allocation]
+            fractions = {user: min(1., nominal_allocation[user]["mem_bw"] / new_share) for user in vm_users}
+            # a shrinking share can push the fractions of the VM above 1
+            total = sum(fractions.values())
+            scale = 1. / total if total > 1. else 1.
+            for user in vm_users:
+                self.last_allocation[user]["mem_bw"] = fractions[user] * scale
+        self.vm_mem_bw_shares = new_shares
+        self.logger.log_msg(f"Global market - VM bandwidth shares: {new_shares}")
+
     def allocate(
         self,
         users: list,
@@ -279,6 +542,9 @@ class SpiritAllocator(ResourceAllocator):
         runtime_list = []
         num_iter_list = []
         iteration = 0
+        # previous per-user optimum and cache price for monotone demand pruning
+        prev_optimum = None
+        prev_cache_price = None
         while True:
             iteration += 1
             resource_limited = ResourceLimited()
@@ -287,6 +553,14 @@ class SpiritAllocator(ResourceAllocator):
                 compute_and_update_mid(price_vector)
                 # print("Current price vector: {}".format(price_vector))
 
+            # direction of the cache/mem_bw price ratio since the previous iteration
+            price_direction = 0
+            if prev_cache_price is not None and self.parameters.monotone_pruning:
+                if price_vector["cache"] > prev_cache_price + float_precision:
+                    price_direction = 1
+                elif price_vector["cache"] < prev_cache_price - float_precision:
+                    price_direction = -1
+
             # compute current resource usage and performance estimation
             searched_price.add((price_vector["cache"], price_vector["mem_bw"]))
             cur_alloc, _runtime_list, _num_iter_list, resource_limited_new =\
@@ -298,15 +572,19 @@ class SpiritAllocator(ResourceAllocator):
                     search_granularity,
                     search_range,
                     guide_factors,
+                    prev_optimum=prev_optimum,
+                    price_direction=price_direction,
                 )
             resource_limited.update(resource_limited_new)
+            prev_optimum = cur_alloc
+            prev_cache_price = price_vector["cache"]
             runtime_list.extend(_runtime_list)  # per-user, per iteration
             num_iter_list.extend(_num_iter_list)
             sum_alloc = self.compute_resource_usage(cur_alloc)
             self.logger.log_msg(
                 f"Iteration: {iteration}, price_vector: {price_vector}, sum_alloc: {sum_alloc}, res_limit: {resource_limited}\n"
             )
-            self.logger.log_msg("--- Allocation: {}\n".format(cur_alloc))
+            self.logger.log_msg("--- Allocation: {}\n".format(cur_alloc.to_dict()))
             # update price vector
             if search == "linear":
                 reduce_coeff = False
@@ -409,6 +687,7 @@ class SpiritAllocator(ResourceAllocator):
                     self.num_conflict += 1
                     if self.num_conflict > self.num_conflict_resolve_th:
                         self.num_conflict = 0
+                        metrics.CONFLICT_RESETS.inc(allocator=type(self).__name__)
                         # reset to the static
                         print(f"Warning: Conflict counter is over the threshold {self.num_conflict_resolve_th}.")
                         cur_alloc = self.last_allocation
@@ -425,21 +704,80 @@ class SpiritAllocator(ResourceAllocator):
                     is_converged = False
                 # else, break
                 break
+        metrics.PRICE_ITERATIONS.observe(iteration, allocator=type(self).__name__)
+        if not is_converged:
+            metrics.CONVERGENCE_FAILURES.inc(allocator=type(self).__name__)
+        # the conflict fallback is already in the dict format
+        if isinstance(cur_alloc, AllocationMatrix):
+            cur_alloc = cur_alloc.to_dict()
         # add the current price to cur_alloc
         for user_id in users:
             cur_alloc[user_id]["price"] = price_vector
         return cur_alloc, runtime_list, num_iter_list, is_converged
 
-    def compute_resource_usage(self, allocation: dict):
-        # best_alloc = {'cache': cache_alloc, 'mem_bw': mem_bw_alloc}
-        cache_alloc = sum([alloc["cache"] for alloc in allocation.values()])
-        mem_bw_alloc = sum([alloc["mem_bw"] for alloc in allocation.values()])
-        return {"cache": cache_alloc, "mem_bw": mem_bw_alloc}
+    def _get_prior_shares(self, users: list):
+        """
+        Normalized allocation of the users from their prior profiles, or None if any user has no prior
+        """
+        if not hasattr(self.estimator, "get_prior_allocation"):
+            return None
+        shares = {}
+        for user in users:
+            prior = self.estimator.get_prior_allocation(user)
+            if prior is None:
+                return None
+            shares[user] = {
+                "cache": prior["cache"] / self.resource_scale["cache"],
+                "mem_bw": prior["mem_bw"] / 1024. / self.resource_scale["mem_bw"],  # mb to gb
+            }
+        # priors learned with a different mix of apps may exceed the capacity
+        for key in ["cache", "mem_bw"]:
+            total = sum(share[key] for share in shares.values())
+            if total > 1.:
+                for share in shares.values():
+                    share[key] /= total
+        return shares
+
+    def _update_search_ranges(self, users: list, cur_alloc: dict):
+        """
+        Grow the search window of users whose optimum is on the window boundary and shrink it
+        for users whose allocation is interior and whose last estimate matched the measurement.
+        """
+        if self.parameters.search_range_delta <= 0.:
+            return
+        for user_id in users:
+            if user_id not in cur_alloc or not isinstance(cur_alloc[user_id], dict):
+                continue
+            # compare the last estimate with the measured performance change
+            estimate_agreed = None
+            cur_perf = self.monitor.get_latest_perf(user_id)
+            if user_id in self.pending_estimates and cur_perf is not None:
+                predicted_ratio, base_perf = self.pending_estimates[user_id]
+                if base_perf:
+                    estimate_agreed = self.search_range_ctrl.is_agreed(
+                        predicted_ratio, float(cur_perf) / float(base_perf))
+            new_range = self.search_range_ctrl.update(
+                user_id, cur_alloc[user_id], self.parameters.search_granularity, estimate_agreed)
+            # record the estimate of the new allocation to be verified in the next round
+            predicted_ratio = self.estimator.get_estimation(
+                user_id,
+                cur_alloc[user_id]["cache"] * self.resource_scale["cache"],
+                cur_alloc[user_id]["mem_bw"] * self.resource_scale["mem_bw"])
+            self.pending_estimates[user_id] = (predicted_ratio if predicted_ratio > 0 else None, cur_perf)
+            self.logger.log_msg(f"User {user_id} | Search range: {new_range} | Estimate agreed: {estimate_agreed}")
+
+    def compute_resource_usage(self, allocation):
+        # allocation: AllocationMatrix, or {user: {'cache': cache_alloc, 'mem_bw': mem_bw_alloc}}
+        if not isinstance(allocation, AllocationMatrix):
+            allocation = AllocationMatrix.from_dict(allocation)
+        return allocation.sum()
 
     def _get_static_alloc(self, num_user):
         return get_static_allocation(num_user)
 
-    def _get_search_dict(self, cur_alloc, search_range: float):
+    def _get_search_dict(self, cur_alloc, search_range: float, user_id=None):
+        if user_id is not None and self.search_range_ctrl is not None and self.parameters.search_range_delta > 0.:
+            return self.search_range_ctrl.get_search_dict(user_id, cur_alloc)
         return get_search_dict(cur_alloc, search_range)
 
     # @search_range: the range of search space in [0, 1]
@@ -453,9 +791,11 @@ class SpiritAllocator(ResourceAllocator):
         search_range: float,
         guide_factor: dict,
         logger=None,
+        prev_optimum: AllocationMatrix = None,
+        price_direction: int = 0,
     ):
         # self.estimator.get_estimation(user, 128.0, 2.0)  # cache in mb, bandwidth in gbps
-        allocations = {}
+        allocations = AllocationMatrix(user_ids)
         runtime_list = []
         num_iter_list=[]
 
@@ -464,9 +804,12 @@ class SpiritAllocator(ResourceAllocator):
         resource_limited = ResourceLimited()
         start_time = time.time_ns()
         for user_id in user_ids:
-            search_range_dict = self._get_search_dict(self.last_allocation[user_id], search_range)
+            search_range_dict = self._get_search_dict(self.last_allocation[user_id], search_range, user_id)
+            # only scan the half-interval where the new optimum can lie
+            if prev_optimum is not None and user_id in prev_optimum:
+                search_range_dict = prune_search_dict(search_range_dict, prev_optimum.row(user_id), price_direction)
 
-            allocations[user_id], num_iter, resource_limited_new =\
+            user_alloc, num_iter, resource_limited_new =\
                 ptas_algorithm(
                     self.estimator,
                     user_id,
@@ -481,21 +824,21 @@ class SpiritAllocator(ResourceAllocator):
                     search_range=search_range_dict,
                     guide_factor=guide_factor[user_id],
                     logger=self.logger,
-                    # Disable explore advantage for overhead computaton since there is no monitor anyway
-                    explore_adv=0. if len(user_ids) >= 8 else 0.025,
+                    explore_adv=self.parameters.exploration_weight if user_id in self.explorers else 0.,
                     allocation_update_clip=self.parameters.allocation_update_clip,
             )
             # update resource limited
             resource_limited.update(resource_limited_new)
 
             # check if allocation is None
-            if (allocations[user_id] is None) or (
-                allocations[user_id]["cache"] is None or
-                allocations[user_id]["mem_bw"] is None
+            if (user_alloc is None) or (
+                user_alloc["cache"] is None or
+                user_alloc["mem_bw"] is None
             ):
                 # static allocation
-                allocations[user_id] = self._get_static_alloc(len(user_ids))
+                user_alloc = self._get_static_alloc(len(user_ids))
                 self.logger.log_msg(f"Warning: allocation is None for user {user_id}")
+            allocations.set_row(user_id, user_alloc)
             num_iter_list.append(num_iter)
 
         # runtime
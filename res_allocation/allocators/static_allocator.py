@@ -21,8 +21,9 @@ class StaticAllocatorParams(AllocatorParams):
 
 class StaticAllocator(ResourceAllocator):
 ### ===================== internal functions ====================== ###
-    def __init__(self, config_path: str, resource_scale: {} = { "cache": 1,"mem_bw": 1 }, estimator=None, monitor=None, deployer=None):
-        super().__init__(config_path, resource_scale, estimator, monitor, deployer)
+    def __init__(self, config_path: str, resource_scale: {} = { "cache": 1,"mem_bw": 1 }, estimator=None, monitor=None, deployer=None,
+                 logger_name: str = 'spirit_ceei_allocator'):
+        super().__init__(config_path, resource_scale, estimator, monitor, deployer, logger_name)
 
     def initialize(self, param: AllocatorParams=StaticAllocatorParams(1.0)):
         super().initialize(param)
@@ -54,7 +55,6 @@ class StaticAllocator(ResourceAllocator):
                     allocation[user][key] = self.resource_scale[key] / float(users_in_this_vm)
                     if key == "mem_bw":
                         allocation[user][key] *= 1024   # gb to mb
-                    allocation[user][key] = int(allocation[user][key])
         else:
             self.logger.log_msg(f"Using per-VM resource allocation with VM mapping: {vm_to_app_map}")
             
@@ -74,7 +74,6 @@ class StaticAllocator(ResourceAllocator):
                         allocation[app_id][key] = self.resource_scale[key] / float(len(vm_apps))
                         if key == "mem_bw":
                             allocation[app_id][key] *= 1024  # gb to mb
-                        allocation[app_id][key] = int(allocation[app_id][key])
             
             # Handle any users not assigned to VMs
             unassigned_users = set(users) - set(user for app_list in vm_to_app_map.values() for user in app_list)
@@ -86,7 +85,6 @@ class StaticAllocator(ResourceAllocator):
                         allocation[user][key] = self.resource_scale[key] / float(len(unassigned_users))
                         if key == "mem_bw":
                             allocation[user][key] *= 1024   # gb to mb
-                        allocation[user][key] = int(allocation[user][key])
                 
         self.logger.log_msg(f"Per-VM static allocation: {allocation}")
         return allocation
@@ -0,0 +1,84 @@
+import os
+import time
+import pickle
+import zlib
+from utils.logger import Logger
+
+class ControllerCheckpoint:
+    '''
+    Periodic checkpoint of the controller state (monitor + allocator) for warm restarts.
+
+    File format: magic (4 bytes) | version (1 byte) | zlib-compressed pickle of
+    {"timestamp", "config_path", "allocator", "monitor_state", "allocator_state"}
+    '''
+    MAGIC = b"SPCK"
+    VERSION = 1
+
+    def __init__(self, path: str, max_age_in_sec: float = 600., interval: int = 1):
+        self.path = path
+        self.max_age_in_sec = max_age_in_sec
+        self.interval = max(1, int(interval))
+        self.logger = Logger()
+        self.logger.prepare_logger('controller_checkpoint')
+
+    def cleanup(self):
+        self.logger.close()
+
+    def need_save(self, iteration: int):
+        return (iteration + 1) % self.interval == 0
+
+    def save(self, monitor, allocator):
+        state = {
+            "timestamp": time.time(),
+            "config_path": allocator.config_path,
+            "allocator": type(allocator).__name__,
+            "monitor_state": monitor.get_checkpoint_state(),
+            "allocator_state": allocator.get_checkpoint_state(),
+        }
+        payload = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+        # write to a temporary file first so that a crash never leaves a partial checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC + bytes([self.VERSION]) + payload)
+        os.replace(tmp_path, self.path)
+        self.logger.log_msg(f"Checkpoint saved: {self.path} ({len(payload)} bytes)")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header_len = len(self.MAGIC) + 1
+        if data[:len(self.MAGIC)] != self.MAGIC or len(data) < header_len:
+            self.logger.log_err(f"Invalid checkpoint file: {self.path}")
+            return None
+        if data[len(self.MAGIC)] != self.VERSION:
+            self.logger.log_err(f"Unsupported checkpoint version: {data[len(self.MAGIC)]}")
+            return None
+        try:
+            return pickle.loads(zlib.decompress(data[header_len:]))
+        except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+            self.logger.log_err(f"Failed to decode checkpoint {self.path}: {e}")
+            return None
+
+    def restore(self, monitor, allocator):
+        '''
+        Restore monitor and allocator states if the checkpoint is fresh and matches the allocator.
+
+        Returns:
+            bool: True if the states were restored
+        '''
+        state = self.load()
+        if state is None:
+            return False
+        age = time.time() - state["timestamp"]
+        if age > self.max_age_in_sec:
+            self.logger.log_msg(f"Checkpoint is stale: {age:.1f} sec > {self.max_age_in_sec} sec")
+            return False
+        if state["allocator"] != type(allocator).__name__ or state["config_path"] != allocator.config_path:
+            self.logger.log_msg(f"Checkpoint does not match: {state['allocator']} / {state['config_path']}")
+            return False
+        monitor.load_checkpoint_state(state["monitor_state"])
+        allocator.load_checkpoint_state(state["allocator_state"])
+        self.logger.log_msg(f"Checkpoint restored: {self.path} (age: {age:.1f} sec)")
+        return True
@@ -0,0 +1,35 @@
+import time
+
+class ControllerSnapshot:
+    '''
+    Read-only view of the controller state, published by the allocator once per allocation round.
+
+    The state dict is rebuilt by the control loop and swapped in as a whole, so API readers
+    never take the monitor lock and never see a partially updated round.
+    '''
+    def __init__(self):
+        self._state = {
+            "timestamp": None,
+            "iteration": -1,
+            "allocator": None,
+            "allocation": {},
+            "apps": {},
+        }
+
+    def publish(self, allocator, iteration):
+        state = {
+            "timestamp": time.time(),
+            "iteration": iteration,
+            "allocator": type(allocator).__name__,
+            "allocation": {str(user): dict(alloc) for user, alloc in (allocator.e2e_last_allocation or {}).items()
+                           if isinstance(alloc, dict)},
+            "apps": {str(user): app_state for user, app_state in allocator.monitor.get_app_states().items()},
+        }
+        self._state = state
+
+    def get(self):
+        return self._state
+
+    def get_age_in_sec(self):
+        timestamp = self._state["timestamp"]
+        return None if timestamp is None else time.time() - timestamp
@@ -1,5 +1,7 @@
 from utils.logger import Logger
 import requests
+import time
+from utils import metrics
 from utils.config import Config
 
 class Deployer:
@@ -22,6 +24,7 @@ class MemcachedDeployer(Deployer):
             "4": [500, 620],
             "5": [910, 100]
         }
+        self.extra_allocation_map = {}
         self.timestamp = 0
         self.load_config()
 
@@ -37,6 +40,7 @@ class MemcachedDeployer(Deployer):
             return
         # initial empty allocation map
         self.allocation_map = {}
+        self.extra_allocation_map = {}
         for user, resources in resource_alloc.items():
             if not isinstance(resources, dict):
                 continue
@@ -45,6 +49,13 @@ class MemcachedDeployer(Deployer):
             if not isinstance(cache, int) or not isinstance(mem_bw, int):
                 continue
             self.allocation_map[user] = [cache, mem_bw]
+            # extra resources of the cluster go in a separate map, the enforcers take (cache, mem_bw) pairs
+            extras = {res_type: resources.get(res_type) for res_type in getattr(self.config, "extra_resources", {})}
+            for res_type, value in extras.items():
+                if not isinstance(value, int):
+                    raise ValueError(f"Invalid {res_type} allocation of user {user}: {value} (expected int)")
+            if extras:
+                self.extra_allocation_map[user] = extras
 
     def assemble_command(self, resource_alloc, dummy_vm_id, _append_benchmark):
         self.update_allocation_map(resource_alloc)
@@ -52,6 +63,8 @@ class MemcachedDeployer(Deployer):
         json_alloc_data = {
             "allocation_map": self.allocation_map,
         }
+        if self.extra_allocation_map:
+            json_alloc_data["extra_allocation_map"] = self.extra_allocation_map
 
         return json_alloc_data
 
@@ -64,7 +77,10 @@ class MemcachedDeployer(Deployer):
         headers = {'Content-Type': 'application/json'}
         json_alloc_data = self.assemble_command(resource_alloc, dummy_vm_id, append_benchmark)
         self.logger.log_msg(f"Sending the configuration to the controller: {json_alloc_data} | {url}")
+        start_time = time.perf_counter()
         response = requests.post(url, headers=headers, json=json_alloc_data)
+        metrics.DEPLOY_LATENCY.observe(time.perf_counter() - start_time)
+        metrics.DEPLOY_TOTAL.inc(status="ok" if response.status_code in [200, 202] else "error")
 
         if response.status_code in [200, 202]:
             self.logger.log_msg(f"Succeeded to send allocation: {json_alloc_data}")
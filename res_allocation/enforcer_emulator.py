@@ -0,0 +1,378 @@
+import http.server
+import socketserver
+import json
+import math
+import random
+import threading
+import time
+import argparse
+
+class SyntheticApp:
+    """
+    Synthetic application driven by an exponential MRC and a bandwidth demand proportional to the miss ratio.
+
+    - miss_ratio(cache) = min_miss + (1 - min_miss) * exp(-cache / knee_mb)
+    - bandwidth demand (Mbps) = peak_bw_mbps * miss_ratio(cache)
+    - throughput = peak_perf / (1 + miss_ratio * slowdown), scaled down when the bandwidth allocation is below the demand
+    """
+
+    def __init__(self, app_id, vm_id, knee_mb, peak_bw_mbps, peak_perf=10000, min_miss=0.01, slowdown=2.0, noise=0.01):
+        self.app_id = app_id
+        self.vm_id = vm_id
+        self.knee_mb = knee_mb
+        self.peak_bw_mbps = peak_bw_mbps
+        self.peak_perf = peak_perf
+        self.min_miss = min_miss
+        self.slowdown = slowdown
+        self.noise = noise
+
+    def miss_ratio(self, cache_in_mb):
+        return self.min_miss + (1. - self.min_miss) * math.exp(-max(0., cache_in_mb) / self.knee_mb)
+
+    def get_mrc(self, max_cache_in_mb, num_points=16):
+        # the step follows the cap, so that small caps (many apps per VM) still give a curve of at least 2 points
+        step_in_mb = max(1, int(max_cache_in_mb) // num_points)
+        sizes = list(range(step_in_mb, int(max_cache_in_mb) + step_in_mb, step_in_mb))
+        if len(sizes) < 2:
+            sizes.append(sizes[-1] + step_in_mb)
+        return [[size, self.miss_ratio(size)] for size in sizes]
+
+    def measure(self, cache_in_mb, mem_bw_in_mbps, max_cache_in_mb, rng):
+        miss_ratio = self.miss_ratio(cache_in_mb)
+        demand_mbps = self.peak_bw_mbps * miss_ratio
+        used_bw_mbps = min(float(mem_bw_in_mbps), demand_mbps)
+        bw_ratio = 1. if demand_mbps <= 0 else min(1., mem_bw_in_mbps / demand_mbps)
+        perf = self.peak_perf / (1. + miss_ratio * self.slowdown) * bw_ratio
+        perf *= max(0., 1. + rng.gauss(0., self.noise))
+        access = perf * (1. + miss_ratio)
+        return {
+            "vm_id": self.vm_id, "app_id": self.app_id,
+            "mem_mb": int(cache_in_mb), "bw_mbps": int(used_bw_mbps),
+            "cache_mbps": int(perf),
+            "miss_rate_ops_sec": int(access * miss_ratio), "access_rate_ops_sec": int(access),
+            "hit_rate_percent": round((1. - miss_ratio) * 100., 2),
+            "mrc": self.get_mrc(max_cache_in_mb),
+        }
+
+
+class EnforcerEmulator:
+    """
+    Local stand-in for the enforcers: serves the collect and deploy routes of the controller config.
+    Every collect request returns a new measurement of all synthetic apps under the last deployed allocation.
+    """
+
+    def __init__(self, apps, config, seed=0, phase_change_round=0, churn_rounds=(0, 0)):
+        self.apps = {app.app_id: app for app in apps}
+        # deploy rounds after which the last app leaves and comes back (0: never)
+        self.churn_rounds = churn_rounds
+        self.departed_apps = set()
+        # deploy round after which the first app changes phase (0: never)
+        self.phase_change_round = phase_change_round
+        self.config = config
+        cluster = config["cluster"]
+        num_vms = int(cluster.get("num_vms", 1))
+        apps_per_vm = max(1, math.ceil(len(apps) / num_vms))
+        self.max_cache_in_mb = cluster.get("max_cache_in_mb", cluster["total_cache_in_mb"])
+        # equal share per VM until the controller deploys an allocation
+        self.allocation_map = {
+            str(app.app_id): [cluster["total_cache_in_mb"] // apps_per_vm, cluster["total_mem_bw_in_mbps"] // apps_per_vm]
+            for app in apps}
+        # app_id -> {extra resource: amount}
+        self.extra_allocation_map = {}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.num_collects = 0
+        self.deploy_history = []     # [(timestamp, allocation_map)]
+        self.server = None
+        self.server_thread = None
+
+    def get_status(self):
+        with self.lock:
+            self.num_collects += 1
+            status = {}
+            for app_id, app in self.apps.items():
+                if app_id in self.departed_apps:
+                    continue
+                cache_in_mb, mem_bw_in_mbps = self.allocation_map.get(str(app_id), [0, 0])
+                status.setdefault(str(app.vm_id), {})[str(app_id)] = app.measure(cache_in_mb, mem_bw_in_mbps, self.max_cache_in_mb, self.rng)
+            return {"map": status}
+
+    def set_allocation(self, allocation_map, extra_allocation_map=None):
+        with self.lock:
+            # [cache, mem_bw] as the enforcers take them; the app models only react to cache and mem_bw
+            for app_id, (cache_in_mb, mem_bw_in_mbps) in allocation_map.items():
+                self.allocation_map[str(app_id)] = [int(cache_in_mb), int(mem_bw_in_mbps)]
+            for app_id, extras in (extra_allocation_map or {}).items():
+                self.extra_allocation_map[str(app_id)] = {res_type: int(value) for res_type, value in extras.items()}
+            self.deploy_history.append((time.time(), dict(self.allocation_map)))
+            if self.phase_change_round > 0 and len(self.deploy_history) == self.phase_change_round:
+                self.shift_phase(min(self.apps.keys()))
+            if len(self.deploy_history) == self.churn_rounds[0]:
+                self.departed_apps.add(max(self.apps.keys()))
+            if len(self.deploy_history) == self.churn_rounds[1]:
+                self.departed_apps.discard(max(self.apps.keys()))
+
+    def shift_phase(self, app_id):
+        """New phase of an app: a larger working set with a higher miss ratio floor"""
+        app = self.apps[app_id]
+        app.knee_mb *= 3.
+        app.min_miss = min(0.9, app.min_miss + 0.3)
+
+    def get_convergence_round(self, tolerance=0.02):
+        """
+        First deploy round after which no allocation moves by more than @tolerance of the cluster capacity (None if never)
+        """
+        cluster = self.config["cluster"]
+        scale = [float(cluster["total_cache_in_mb"]), float(cluster["total_mem_bw_in_mbps"])]
+        converged_round = None
+        for i in range(1, len(self.deploy_history)):
+            prev, cur = self.deploy_history[i - 1][1], self.deploy_history[i][1]
+            moved = any(abs(cur[k][r] - prev.get(k, cur[k])[r]) > tolerance * scale[r] for k in cur for r in range(2))
+            if moved:
+                converged_round = None
+            elif converged_round is None:
+                converged_round = i - 1
+        return converged_round
+
+    def _create_handler_class(self):
+        emulator = self
+        collect_route = self.config["resource_controller"]["collect_route"]
+        deploy_route = self.config["resource_controller"]["deploy_route"]
+
+        class EnforcerHandler(http.server.BaseHTTPRequestHandler):
+            def _send_json(self, code, body):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.split('?')[0] != collect_route:
+                    self._send_json(404, {"status": "error", "message": "Endpoint not found"})
+                    return
+                self._send_json(200, emulator.get_status())
+
+            def do_POST(self):
+                if self.path.split('?')[0] != deploy_route:
+                    self._send_json(404, {"status": "error", "message": "Endpoint not found"})
+                    return
+                content_length = int(self.headers.get('Content-Length', 0))
+                try:
+                    data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+                    emulator.set_allocation(data["allocation_map"], data.get("extra_allocation_map"))
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+                    self._send_json(400, {"status": "error", "message": f"Invalid allocation: {e}"})
+                    return
+                self._send_json(200, {"status": "success"})
+
+            def log_message(self, format, *args):
+                # keep the benchmark output clean
+                pass
+
+        return EnforcerHandler
+
+    def start(self, port):
+        class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+        self.server = _ThreadingHTTPServer(('127.0.0.1', port), self._create_handler_class())
+        print(f"Starting enforcer emulator on port {port} ({len(self.apps)} apps)")
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        return self.server
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            print("Enforcer emulator stopped")
+
+
+def generate_apps(num_vms, apps_per_vm, total_cache_in_mb, total_mem_bw_in_mbps, seed=0):
+    """
+    Mix of cache-sensitive apps (knee around the static cache share) and bandwidth-sensitive
+    streaming apps (high miss ratio floor, demand above the static bandwidth share)
+    """
+    rng = random.Random(seed)
+    static_cache = total_cache_in_mb / apps_per_vm
+    static_mem_bw = total_mem_bw_in_mbps / apps_per_vm
+    apps = []
+    for vm_id in range(num_vms):
+        for i in range(apps_per_vm):
+            app_id = vm_id * apps_per_vm + i + 1
+            if rng.random() < 0.5:
+                apps.append(SyntheticApp(app_id, vm_id, knee_mb=rng.uniform(0.5, 1.5) * static_cache,
+                                         peak_bw_mbps=rng.uniform(1., 2.) * static_mem_bw, min_miss=0.01))
+            else:
+                apps.append(SyntheticApp(app_id, vm_id, knee_mb=rng.uniform(0.1, 0.3) * static_cache,
+                                         peak_bw_mbps=rng.uniform(2., 4.) * static_mem_bw, min_miss=rng.uniform(0.3, 0.6)))
+    return apps
+
+
+def generate_config(num_vms, apps_per_vm, port, total_cache_in_mb=10240, total_mem_bw_in_mbps=7680,
+                    allocation_interval_in_sec=10, apps=None, total_node_mem_bw_in_mbps=0, slack_redistribution=False,
+                    change_detection=False, extra_resources=None, estimator="runtime", calibration=False,
+                    shadow_allocators=None, trust_region=False):
+    """Controller config (same layout as configs/*) pointing to the emulator"""
+    num_apps = num_vms * apps_per_vm
+    static_cache = total_cache_in_mb // apps_per_vm
+    static_mem_bw = total_mem_bw_in_mbps // apps_per_vm
+    sensitivity = {}
+    if apps is not None:
+        sensitivity = {app.app_id: "mem_bw" if app.min_miss > 0.1 else "cache" for app in apps}
+    config = {
+        "cluster": {
+            "name": "emulator",
+            "total_cache_in_mb": total_cache_in_mb,
+            "total_mem_bw_in_mbps": total_mem_bw_in_mbps,
+            # same convention as the evaluation configs: min 1/2, max 2x of the static allocation
+            "min_cache_in_mb": static_cache // 2,
+            "max_cache_in_mb": min(total_cache_in_mb, static_cache * 2),
+            "min_mem_bw_in_mbps": static_mem_bw // 2,
+            "max_mem_bw_in_mbps": min(total_mem_bw_in_mbps, static_mem_bw * 2),
+            "num_vms": num_vms
+        },
+        "profiles": [{"user_id": app_id, "file": "dummy.joblib", "sensitivity": sensitivity.get(app_id, "cache")}
+                     for app_id in range(1, num_apps + 1)],
+        "resource_controller": {
+            "base_url": f"http://127.0.0.1:{port}",
+            "deploy_route": "/config",
+            "collect_route": "/status"
+        },
+        "benchmark_map": {str(app_id): f"synthetic_{app_id}" for app_id in range(1, num_apps + 1)},
+        "allocation_parameters": {"allocation_interval_in_sec": allocation_interval_in_sec}
+    }
+    if total_node_mem_bw_in_mbps > 0:
+        config["cluster"]["total_node_mem_bw_in_mbps"] = total_node_mem_bw_in_mbps
+    if slack_redistribution:
+        config["allocation_parameters"]["slack_redistribution"] = True
+    if change_detection:
+        config["allocation_parameters"]["change_detection"] = True
+    if estimator != "runtime":
+        config["allocation_parameters"]["estimator"] = estimator
+    if calibration:
+        config["allocation_parameters"]["calibration"] = True
+    if shadow_allocators:
+        config["allocation_parameters"]["shadow_allocators"] = list(shadow_allocators)
+    if trust_region:
+        config["allocation_parameters"]["trust_region"] = True
+    if extra_resources:
+        config["cluster"]["extra_resources"] = {res_type: {"total": total} for res_type, total in extra_resources.items()}
+    return config
+
+
+def run_benchmark(args):
+    from resource_monitor import MemcachedMindMonitor
+    from deployer import MemcachedDeployer
+    from utils.config import Config
+    from main_memcached import get_search_range_delta, get_resource_scale, create_estimator, create_allocator, initialize_allocator, create_global_market, create_quantizer, create_slack_redistributor, create_shadow_evaluator
+    import contextlib
+    import io
+
+    apps = generate_apps(args.num_vms, args.apps_per_vm, args.total_cache_in_mb, args.total_mem_bw_in_mbps, seed=args.seed)
+    raw_config = generate_config(args.num_vms, args.apps_per_vm, args.port, args.total_cache_in_mb, args.total_mem_bw_in_mbps, apps=apps,
+                                 total_node_mem_bw_in_mbps=args.total_node_mem_bw_in_mbps, slack_redistribution=args.slack_redistribution,
+                                 change_detection=args.change_detection, extra_resources=parse_extra_resources(args.extra_resources),
+                                 estimator=args.estimator, calibration=args.calibration,
+                                 shadow_allocators=args.shadow_allocators, trust_region=args.trust_region)
+    with open(args.config_out, 'w') as f:
+        json.dump(raw_config, f, indent=4)
+    emulator = EnforcerEmulator(apps, raw_config, seed=args.seed, phase_change_round=args.phase_change_round,
+                                    churn_rounds=tuple(args.churn_rounds))
+    emulator.start(args.port)
+
+    allocation_interval_in_sec = raw_config["allocation_parameters"]["allocation_interval_in_sec"]
+    config = Config().load_config(config_path=args.config_out)
+    resource_scale = get_resource_scale(config)
+    monitor = MemcachedMindMonitor(config=config)
+    deployer = MemcachedDeployer(config=config)
+    estimator = create_estimator(config, resource_scale)
+    allocator = create_allocator(args.allocator, args.config_out, estimator, monitor, deployer, resource_scale)
+    allocator.set_global_market(create_global_market(args.allocator, config, resource_scale))
+    allocator.set_quantizer(create_quantizer(config, resource_scale))
+    allocator.set_slack_redistributor(create_slack_redistributor(config, resource_scale))
+    estimator.set_allocator(allocator)
+    estimator.set_monitor(monitor)
+    search_range_delta = get_search_range_delta(config, allocation_interval_in_sec)
+    initialize_allocator(allocator, args.allocator, allocation_interval_in_sec, search_range_delta, init_phase_interval=3)
+    allocator.set_shadow_evaluator(create_shadow_evaluator(config, args.config_out, estimator, monitor, deployer, resource_scale,
+                                                           allocation_interval_in_sec, search_range_delta, init_phase_interval=3))
+
+    start_time = time.perf_counter()
+    # the controller prints every estimation; keep only the summary
+    with contextlib.redirect_stdout(io.StringIO()):
+        allocator.start(max_iteration=args.max_iter, init_timer=0, no_wait=True)
+    elapsed = time.perf_counter() - start_time
+
+    num_rounds = len(emulator.deploy_history)
+    converged_round = emulator.get_convergence_round(tolerance=args.tolerance)
+    print(f"Emulator::Allocator: {args.allocator}, #apps: {len(apps)} ({args.num_vms} VMs x {args.apps_per_vm})")
+    print(f"Emulator::Rounds: {num_rounds}, collects: {emulator.num_collects}, total: {elapsed:.3f} sec, "
+          f"per round: {elapsed / max(1, num_rounds) * 1e3:.1f} ms")
+    print(f"Emulator::Converged at round: {converged_round} (tolerance: {args.tolerance})")
+
+    allocator.cleanup()
+    estimator.cleanup()
+    deployer.cleanup()
+    monitor.cleanup()
+    emulator.stop()
+
+
+def parse_extra_resources(specs):
+    extra_resources = {}
+    for spec in specs:
+        res_type, total = spec.split(":")
+        extra_resources[res_type] = int(total)
+    return extra_resources
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local enforcer emulator with synthetic MRC/bandwidth app models.")
+    parser.add_argument("--num_vms", help="Number of emulated VMs", type=int, default=4)
+    parser.add_argument("--apps_per_vm", help="Number of apps per VM", type=int, default=6)
+    parser.add_argument("--total_cache_in_mb", help="Cache capacity per VM", type=int, default=10240)
+    parser.add_argument("--total_mem_bw_in_mbps", help="Memory bandwidth capacity per VM", type=int, default=7680)
+    parser.add_argument("--total_node_mem_bw_in_mbps", help="Memory-node bandwidth shared by all VMs (0: per-VM capacity only)", type=int, default=0)
+    parser.add_argument("--slack_redistribution", help="Lend idle resources after the solve (see allocators.slack)", action="store_true")
+    parser.add_argument("--change_detection", help="Detect phase changes and reallocate out of band (see utils.change_point)", action="store_true")
+    parser.add_argument("--phase_change_round", help="Deploy round after which the first app changes phase (0: never)", type=int, default=0)
+    parser.add_argument("--churn_rounds", help="Deploy rounds after which the last app leaves and comes back (0 0: never)", type=int, nargs=2, default=[0, 0])
+    parser.add_argument("--extra_resources", help="Extra contended resources per VM as <type>:<total> (e.g., cpu_cores:8 llc_ways:11)", type=str, nargs="*", default=[])
+    parser.add_argument("--estimator", help="Performance estimator in [runtime, rls]", type=str, default="runtime")
+    parser.add_argument("--shadow_allocators", help="Allocators run in shadow next to --allocator (see allocators.shadow)", type=str, nargs="*", default=[])
+    parser.add_argument("--calibration", help="Calibrate the slowdown model per app online (see estimators.calibration)", action="store_true")
+    parser.add_argument("--trust_region", help="Adapt the Spirit search window per app (see SpiritAllocatorParams.search_range_delta)", action="store_true")
+    parser.add_argument("--port", help="Port of the emulator", type=int, default=18000)
+    parser.add_argument("--seed", help="Random seed of the app models and noise", type=int, default=0)
+    parser.add_argument("--config_out", help="Path to write the generated controller config", type=str, default="config_emulator.json")
+    parser.add_argument("--bench", help="Run the controller against the emulator and report timing/convergence", action="store_true")
+    parser.add_argument("--allocator", help="Allocator for --bench in [spirit, static, oracle, inc-trade, fij-trade, prop-response]", type=str, default="spirit")
+    parser.add_argument("--max_iter", help="Allocation rounds for --bench", type=int, default=30)
+    parser.add_argument("--tolerance", help="Convergence tolerance as a fraction of the capacity", type=float, default=0.02)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.bench:
+        run_benchmark(args)
+    else:
+        apps = generate_apps(args.num_vms, args.apps_per_vm, args.total_cache_in_mb, args.total_mem_bw_in_mbps, seed=args.seed)
+        raw_config = generate_config(args.num_vms, args.apps_per_vm, args.port, args.total_cache_in_mb, args.total_mem_bw_in_mbps, apps=apps,
+                                 total_node_mem_bw_in_mbps=args.total_node_mem_bw_in_mbps, slack_redistribution=args.slack_redistribution,
+                                 change_detection=args.change_detection, extra_resources=parse_extra_resources(args.extra_resources),
+                                 estimator=args.estimator, calibration=args.calibration,
+                                 shadow_allocators=args.shadow_allocators, trust_region=args.trust_region)
+        with open(args.config_out, 'w') as f:
+            json.dump(raw_config, f, indent=4)
+        print(f"Controller config written to {args.config_out}")
+        emulator = EnforcerEmulator(apps, raw_config, seed=args.seed, phase_change_round=args.phase_change_round,
+                                    churn_rounds=tuple(args.churn_rounds))
+        emulator.start(args.port)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            emulator.stop()
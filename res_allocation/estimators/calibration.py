@@ -0,0 +1,124 @@
+from collections import deque
+import numpy as np
+from utils import metrics
+from .runtime_estimator import RuntimeEstimator
+
+ESTIMATION_ERROR = metrics.REGISTRY.histogram("spirit_estimation_error", "Relative error of the estimated performance change of a deployed allocation",
+                                              buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.))
+CALIBRATION_ERROR = metrics.REGISTRY.gauge("spirit_calibration_error", "Mean relative error of the calibrated slowdown model over the window of an app")
+CALIBRATED_PARAMS = metrics.REGISTRY.gauge("spirit_calibration_params", "Calibrated slowdown model parameters of an app")
+
+
+def estimate_relative_perfs(cur_mr, tar_mr, cur_bw_mbps, tar_bw_mbps, cur_alloc_bw_mbps, loc_to_ret_slowdown, margin):
+    """
+    Relative performance of RuntimeEstimator._estimate_slow_downs(), whose arguments broadcast over observations and
+    parameters (e.g., (n, 1) against (1, g))
+    """
+    slowdown, _ = RuntimeEstimator._estimate_slow_downs(cur_mr, tar_mr, cur_bw_mbps, tar_bw_mbps, cur_alloc_bw_mbps,
+                                                        loc_to_ret_slowdown=loc_to_ret_slowdown, margin=margin)
+    return 1. / np.maximum(1e-4, slowdown)
+
+
+class SlowdownCalibrator:
+    '''
+    Online per-app calibration of the slowdown model of RuntimeEstimator (loc_to_ret_slowdown and margin).
+
+    When an allocation is deployed, record_deployment() keeps the inputs of the model for each app whose allocation
+    changed (miss rates from the latest MRC, bandwidth usage, previous and new allocation), the estimated
+    performance change, and the performance measured under the previous allocation. After the next consumption,
+    update() pairs the estimate with the realized change (performance measured under the new allocation over the
+    previous one), exports the error, and refits the parameters of the app on its last @window pairs by a grid
+    search minimizing the squared log error. The fit replaces the defaults once there are @min_observations pairs
+    and it lowers the error by @min_improvement; it follows the app as old pairs leave the window.
+    '''
+    def __init__(self, loc_to_ret_grid=None, margin_grid=None, window: int = 20, min_observations: int = 5,
+                 min_improvement: float = 0.1, default_loc_to_ret_slowdown: float = 100., default_margin: float = 0.8):
+        self.loc_to_ret_grid = np.asarray(loc_to_ret_grid if loc_to_ret_grid is not None else np.geomspace(1., 1000., 31), dtype=float)
+        self.margin_grid = np.asarray(margin_grid if margin_grid is not None else np.linspace(0.5, 1.0, 11), dtype=float)
+        self.window = window
+        self.min_observations = min_observations
+        self.min_improvement = min_improvement
+        self.defaults = {"loc_to_ret_slowdown": default_loc_to_ret_slowdown, "margin": default_margin}
+        # app_id -> {"loc_to_ret_slowdown", "margin"} (apps without a fit use the defaults)
+        self.params = {}
+        # app_id -> deque of (cur_mr, tar_mr, cur_bw, tar_bw, cur_alloc_bw, realized relative perf)
+        self.observations = {}
+        # app_id -> (model inputs, estimated relative perf, perf before, deployed (MB, Mbps), iteration) awaiting the measurement
+        self.pending = {}
+
+    def get_params(self, app_id):
+        return self.params.get(app_id, self.defaults)
+
+    def get_state(self):
+        return {"params": self.params, "observations": {app_id: list(obs) for app_id, obs in self.observations.items()}}
+
+    def load_state(self, state):
+        self.params = state["params"]
+        self.observations = {app_id: deque(obs, maxlen=self.window) for app_id, obs in state["observations"].items()}
+        self.pending = {}
+
+    @staticmethod
+    def _get_last_perf(monitor, app_id, cache_in_mb, mem_bw_in_mbps, after_iteration=-1):
+        """
+        Latest consumed performance at the allocation if it was consumed after @after_iteration, else None
+        """
+        records = monitor.collected_data.get(app_id, {}).get("datapoints", {}).get(cache_in_mb, {}).get(mem_bw_in_mbps)
+        if not records or records[-1][1] <= after_iteration or records[-1][0] <= 0:
+            return None
+        return float(records[-1][0])
+
+    def record_deployment(self, estimator, monitor, previous_allocation: dict, allocation: dict):
+        """
+        Args:
+            previous_allocation, allocation: deployed allocations (MB, Mbps) before and after this round
+        """
+        self.pending = {}
+        iteration = monitor.collection_iteration_count
+        for app_id, alloc in allocation.items():
+            prev_alloc = previous_allocation.get(app_id)
+            if not prev_alloc or (prev_alloc["cache"], prev_alloc["mem_bw"]) == (alloc["cache"], alloc["mem_bw"]):
+                continue
+            perf_before = self._get_last_perf(monitor, app_id, prev_alloc["cache"], prev_alloc["mem_bw"])
+            last_mrc = monitor.get_last_mrc(app_id)
+            last_usage = monitor.get_last_usage(app_id)
+            if perf_before is None or not last_mrc or not last_usage or "mem_bw" not in last_usage:
+                continue
+            cur_mr, tar_mr = np.maximum(estimator.estimate_miss_rates(last_mrc, [prev_alloc["cache"], alloc["cache"]]), 1e-12)
+            inputs = (float(cur_mr), float(tar_mr), float(last_usage["mem_bw"]), float(alloc["mem_bw"]), float(prev_alloc["mem_bw"]))
+            params = self.get_params(app_id)
+            estimated = float(estimate_relative_perfs(*inputs, params["loc_to_ret_slowdown"], params["margin"]))
+            self.pending[app_id] = (inputs, estimated, perf_before, (alloc["cache"], alloc["mem_bw"]), iteration)
+
+    def update(self, monitor):
+        """
+        Pair the pending estimates with the measurements consumed since record_deployment() and refit their apps
+        """
+        for app_id, (inputs, estimated, perf_before, deployed, iteration) in list(self.pending.items()):
+            perf_after = self._get_last_perf(monitor, app_id, *deployed, after_iteration=iteration)
+            if perf_after is None:
+                continue
+            del self.pending[app_id]
+            realized = perf_after / perf_before
+            ESTIMATION_ERROR.observe(abs(estimated - realized) / realized)
+            self.observations.setdefault(app_id, deque(maxlen=self.window)).append(inputs + (realized,))
+            self._fit(app_id)
+
+    def _fit(self, app_id):
+        observations = np.array(self.observations[app_id], dtype=float)
+        inputs = [observations[:, i, None] for i in range(5)]
+        realized = observations[:, 5, None]
+        # (observations x loc_to_ret x margin) flattened over the parameters
+        loc_to_ret, margin = (grid.ravel()[None, :] for grid in np.meshgrid(self.loc_to_ret_grid, self.margin_grid, indexing="ij"))
+        estimated = estimate_relative_perfs(*inputs, loc_to_ret, margin)
+        losses = np.mean(np.log(estimated / realized) ** 2, axis=0)
+        default_loss = np.mean(np.log(estimate_relative_perfs(*inputs, self.defaults["loc_to_ret_slowdown"], self.defaults["margin"]) / realized) ** 2)
+        best = int(np.argmin(losses))
+        if len(observations) >= self.min_observations and losses[best] < default_loss * (1. - self.min_improvement):
+            self.params[app_id] = {"loc_to_ret_slowdown": float(loc_to_ret[0, best]), "margin": float(margin[0, best])}
+        else:
+            self.params.pop(app_id, None)
+        params = self.get_params(app_id)
+        fitted = estimate_relative_perfs(*inputs, params["loc_to_ret_slowdown"], params["margin"])
+        CALIBRATION_ERROR.set(float(np.mean(np.abs(fitted - realized) / realized)), app=str(app_id))
+        for name, value in params.items():
+            CALIBRATED_PARAMS.set(value, app=str(app_id), param=name)
@@ -0,0 +1,33 @@
+import os
+import re
+import hashlib
+
+class ProfileLibrary:
+    '''
+    Location of per-application profiles (MRC, sensitivity, usage, allocation) reused across runs.
+    Profiles are keyed by the benchmark identity in the config's benchmark_map,
+    one JSON file per identity in @profile_dir.
+    '''
+    def __init__(self, profile_dir: str, benchmark_map: dict = None):
+        self.profile_dir = profile_dir
+        self.benchmark_map = benchmark_map if benchmark_map is not None else {}
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+
+    def get_identity(self, app_id):
+        '''
+        Benchmark identity of the application, or None if the benchmark_map has no usable entry
+        '''
+        identity = self.benchmark_map.get(str(app_id))
+        if not isinstance(identity, str) or not identity.strip() or identity.strip() == "None":
+            return None
+        return identity.strip()
+
+    def get_profile_path(self, app_id):
+        identity = self.get_identity(app_id)
+        if identity is None:
+            return None
+        # readable prefix + hash to avoid collisions after sanitizing
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', identity)[:64]
+        digest = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.profile_dir, f"{name}_{digest}.json")
@@ -0,0 +1,197 @@
+import numpy as np
+from utils import metrics
+from .estimator import Estimator
+from .runtime_estimator import RuntimeEstimator
+
+MODEL_ERROR = metrics.REGISTRY.gauge("spirit_estimator_model_error", "Relative a priori error of the learned model on the latest record of an app")
+MODEL_FALLBACKS = metrics.REGISTRY.counter("spirit_estimator_fallbacks_total", "Estimations of a trained model answered by the analytical model (non-positive predicted time)")
+
+
+class RLSEstimator(RuntimeEstimator, Estimator):
+    '''
+    Online per-app performance surface over (cache, mem_bw), fit by recursive least squares.
+
+    The model is linear in features derived from the latest MRC of the app: the time per operation (inverse
+    performance, normalized by the first record of the app) at cache c (MB) and bandwidth b (Gbps) is
+        t(c, b) = w0 + w1 * mr(c) + (w2 * mr(c) + w3 * mr(c)^2 + w4) / b
+    i.e., a fixed cost, the cost of the misses, and the stall on the bandwidth of the miss traffic (whose latency
+    grows with the traffic itself) and of the other traffic.
+    Estimations are t(current allocation) / t(target), the relative performance of RuntimeEstimator.
+
+    update_profile() (the retrain path of the allocators) feeds the records consumed since its previous call, so the
+    history is never re-scanned; exponential forgetting lets the fit follow phase changes. An app with fewer than
+    @min_datapoints distinct allocations, or a prediction outside the fitted range, falls back to the analytical model.
+    '''
+    requires_retrain = True
+
+    def __init__(self, estimation_cache=False, init_search_range=1.0, resource_scale={"cache": 1.0, "mem_bw": 1.0},
+                 forgetting_factor: float = 0.98, initial_covariance: float = 100., min_datapoints: int = 3):
+        super().__init__(estimation_cache=estimation_cache, init_search_range=init_search_range, resource_scale=resource_scale)
+        self.forgetting_factor = forgetting_factor
+        self.initial_covariance = initial_covariance
+        self.min_datapoints = min_datapoints
+        # app_id -> {"weights", "covariance", "ref_perf", "num_updates", "datapoints": set of (MB, Mbps), "last_iteration"}
+        self.models = {}
+        # app_id -> [(cache_in_mb, bw_in_gbps, performance)] added since the last update_model()
+        self.measurements = {}
+
+    # = Estimator interface =
+    def add_data(self, app_id: int, cache_in_mb: float, bw_in_gbps: float, performance: float):
+        self.measurements.setdefault(app_id, []).append((float(cache_in_mb), float(bw_in_gbps), float(performance)))
+
+    def update_model(self):
+        for app_id, measurements in self.measurements.items():
+            last_mrc = self.monitor.get_last_mrc(app_id) if self.monitor is not None else None
+            if not last_mrc:
+                continue
+            model = self._get_model(app_id)
+            for cache_in_mb, bw_in_gbps, performance in measurements:
+                self._update(model, last_mrc, cache_in_mb, bw_in_gbps, performance)
+                model["datapoints"].add((int(cache_in_mb), int(bw_in_gbps * 1024.)))  # gb to mb
+            if measurements:
+                MODEL_ERROR.set(model["error"], app=str(app_id))
+        self.measurements = {}
+
+    def update_model_after_reset(self, app_id: int, dataset: list):
+        """
+        Args:
+            dataset: [(cache_in_mb, bw_in_gbps, performance), ...]
+        """
+        self.models.pop(app_id, None)
+        self.measurements[app_id] = []
+        for cache_in_mb, bw_in_gbps, performance in dataset:
+            self.add_data(app_id, cache_in_mb, bw_in_gbps, performance)
+        self.update_model()
+
+    def predict(self, app_id: int, cache_in_mb: float, bw_in_gbps: float):
+        """
+        Predicted performance of the app (in the unit of the monitored metric), or -1 if the model is not ready
+        """
+        if not self._is_ready(app_id):
+            return -1.
+        model = self.models[app_id]
+        times = self._predict_times(model, self.monitor.get_last_mrc(app_id), [cache_in_mb], [bw_in_gbps])
+        if times[0] <= 0.:
+            return -1.
+        return float(model["ref_perf"] / times[0])
+
+    def get_checkpoint_state(self):
+        return {"models": self.models, **super().get_checkpoint_state()}
+
+    def load_checkpoint_state(self, state):
+        self.models = state["models"]
+        super().load_checkpoint_state(state)
+
+    # = Retraining =
+    def update_profile(self, monitor, num_samples_for_init_phase, retraining_interval=5, search_granularity=0.01, retraining_data_size=7):
+        """
+        Feed the records consumed since the previous call to the models
+        """
+        for app_id, entry in monitor.collected_data.items():
+            last_iteration = self.models[app_id]["last_iteration"] if app_id in self.models else 0
+            for cache_size, cache_data in entry["datapoints"].items():
+                for mem_bw_in_mbps, records in cache_data.items():
+                    # records are appended in consumption order: walk back to the last one already fed
+                    for performance, iteration in reversed(records):
+                        if iteration <= last_iteration:
+                            break
+                        self.add_data(app_id, cache_size, mem_bw_in_mbps / 1024., performance)  # mb to gb
+            if app_id in self.measurements:
+                self._get_model(app_id)["last_iteration"] = entry["last_update_iteration"]
+        self.update_model()
+
+    # = Estimations =
+    def get_estimation(self, user_id, cache_in_mb, bw_in_gbps):
+        relative_perf = self._estimate(user_id, [cache_in_mb], [bw_in_gbps])
+        if relative_perf is None:
+            return super().get_estimation(user_id, cache_in_mb, bw_in_gbps)
+        return float(relative_perf[0])
+
+    def get_estimations(self, user_id, cache_in_mb, bw_in_gbps):
+        relative_perf = self._estimate(user_id, cache_in_mb, bw_in_gbps)
+        if relative_perf is None:
+            return super().get_estimations(user_id, cache_in_mb, bw_in_gbps)
+        return relative_perf
+
+    def get_estimation_with_confidence(self, user_id, cache_in_mb, bw_in_gbps):
+        """
+        Half-width of a trained model from the covariance of its fit: residual std * sqrt(f' P f), in relative perf
+        """
+        relative_perf = self._estimate(user_id, [cache_in_mb], [bw_in_gbps])
+        if relative_perf is None:
+            return super().get_estimation_with_confidence(user_id, cache_in_mb, bw_in_gbps)
+        model = self.models[user_id]
+        features = self._get_features(self.monitor.get_last_mrc(user_id), [cache_in_mb], [bw_in_gbps])[0]
+        time_std = np.sqrt(model.get("residual_var", 0.) * max(0., features @ model["covariance"] @ features))
+        return float(relative_perf[0]), float(relative_perf[0] * time_std / (features @ model["weights"]))
+
+    def _estimate(self, user_id, cache_in_mb, bw_in_gbps):
+        """
+        Relative performance from the learned model, or None to fall back to the analytical model
+        """
+        if not self._is_ready(user_id):
+            return None
+        current_alloc = self.allocator.get_last_allocation() if self.allocator is not None else None
+        if not current_alloc or user_id not in current_alloc:
+            return None
+        last_mrc = self.monitor.get_last_mrc(user_id)
+        cache_in_mb = np.asarray(cache_in_mb, dtype=float)
+        bw_in_gbps = np.asarray(bw_in_gbps, dtype=float)
+        model = self.models[user_id]
+        times = self._predict_times(model, last_mrc,
+                                    np.append(cache_in_mb, current_alloc[user_id]["cache"]),
+                                    np.append(bw_in_gbps, current_alloc[user_id]["mem_bw"] / 1024.))  # mb to gb
+        if np.any(times <= 0.):
+            MODEL_FALLBACKS.inc(allocator=self.metrics_label)
+            return None
+        metrics.ESTIMATOR_CALLS.inc(len(cache_in_mb), allocator=self.metrics_label)
+        return np.minimum(1e4, times[-1] / times[:-1])
+
+    # = Model =
+    def _get_model(self, app_id):
+        if app_id not in self.models:
+            self.models[app_id] = {
+                # a flat surface until the first records arrive
+                "weights": np.array([1., 0., 0., 0., 0.]),
+                "covariance": np.eye(5) * self.initial_covariance,
+                "ref_perf": None,
+                "num_updates": 0,
+                "datapoints": set(),
+                "last_iteration": 0,
+                "error": 0.,
+                # running variance of the a priori error (normalized time per operation)
+                "residual_var": 0.,
+            }
+        return self.models[app_id]
+
+    def _is_ready(self, app_id):
+        return app_id in self.models and len(self.models[app_id]["datapoints"]) >= self.min_datapoints\
+            and self.monitor is not None and bool(self.monitor.get_last_mrc(app_id))
+
+    def _get_features(self, last_mrc, cache_in_mb, bw_in_gbps):
+        miss_ratio = np.clip(self.estimate_miss_rates(last_mrc, cache_in_mb), 0., 1.)
+        inv_bw = 1. / np.maximum(np.asarray(bw_in_gbps, dtype=float), 1. / 1024.)
+        return np.stack([np.ones_like(miss_ratio), miss_ratio, miss_ratio * inv_bw, miss_ratio * miss_ratio * inv_bw, inv_bw], axis=-1)
+
+    def _predict_times(self, model, last_mrc, cache_in_mb, bw_in_gbps):
+        return self._get_features(last_mrc, cache_in_mb, bw_in_gbps) @ model["weights"]
+
+    def _update(self, model, last_mrc, cache_in_mb, bw_in_gbps, performance):
+        if performance <= 0.:
+            return
+        if model["ref_perf"] is None:
+            model["ref_perf"] = performance
+        target = model["ref_perf"] / performance
+        features = self._get_features(last_mrc, [cache_in_mb], [bw_in_gbps])[0]
+        covariance = model["covariance"]
+        gain = covariance @ features / (self.forgetting_factor + features @ covariance @ features)
+        error = target - features @ model["weights"]
+        model["weights"] = model["weights"] + gain * error
+        covariance = covariance - np.outer(gain, features @ covariance)
+        # forgetting inflates the covariance along directions without new excitation; stop before it winds up
+        if np.trace(covariance) < self.initial_covariance * len(features):
+            covariance = covariance / self.forgetting_factor
+        model["covariance"] = covariance
+        model["num_updates"] += 1
+        model["residual_var"] = self.forgetting_factor * model.get("residual_var", 0.) + (1. - self.forgetting_factor) * error * error
+        model["error"] = abs(error) / max(1e-9, abs(target))
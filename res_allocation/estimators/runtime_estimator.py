@@ -1,7 +1,10 @@
 import os
+import copy
 import logging
 from utils.plotting import *
 import json
+import numpy as np
+from utils import metrics
 
 class RuntimeEstimator:
     def __init__(self, estimation_cache=False, init_search_range=1.0, resource_scale={"cache": 1.0, "mem_bw": 1.0}):
@@ -21,6 +24,16 @@ class RuntimeEstimator:
         self.allocator = None
         self.search_granularity = 0.01
         self.raw_config = None
+        # app_id -> profile loaded from the profile library (see store_model/load_model)
+        self.priors = {}
+        # half-width of the confidence interval of an estimation without any record near the target (relative perf)
+        self.confidence_width = 0.02
+        # app_id -> (record count of the app, array of measured (MB, Mbps, #records))
+        self.record_index = {}
+        # optional online calibration of the slowdown model per app (see estimators.calibration)
+        self.calibrator = None
+        # allocator label of the estimator metrics ("live", or the name of a shadow allocator)
+        self.metrics_label = "live"
 
     def initialize(self, config_path: str, search_granularity: float):
         # load configuration
@@ -65,6 +78,41 @@ class RuntimeEstimator:
     def set_monitor(self, monitor):
         self.monitor = monitor
 
+    def set_calibrator(self, calibrator):
+        self.calibrator = calibrator
+
+    def _get_slowdown_params(self, user_id):
+        # keyword arguments of _estimate_slow_down(s)(); the defaults without calibration
+        return self.calibrator.get_params(user_id) if self.calibrator is not None else {}
+
+    def record_deployment(self, previous_allocation, allocation):
+        if self.calibrator is not None and self.monitor is not None and previous_allocation:
+            self.calibrator.record_deployment(self, self.monitor, previous_allocation, allocation)
+
+    def update_calibration(self):
+        if self.calibrator is not None and self.monitor is not None:
+            self.calibrator.update(self.monitor)
+
+    def fork(self, metrics_label: str):
+        """
+        Estimator of a shadow allocator: the same configuration, with its own caches, calibrator and learned state
+        (a copy of get_checkpoint_state(), refreshed with load_checkpoint_state()), so it can run on another thread
+        """
+        estimator = copy.copy(self)
+        estimator.record_index = {}
+        estimator.metrics_label = metrics_label
+        if self.calibrator is not None:
+            estimator.calibrator = copy.copy(self.calibrator)
+        estimator.load_checkpoint_state(copy.deepcopy(self.get_checkpoint_state()))
+        return estimator
+
+    def get_checkpoint_state(self):
+        return {"calibration": self.calibrator.get_state()} if self.calibrator is not None else {}
+
+    def load_checkpoint_state(self, state):
+        if self.calibrator is not None and "calibration" in state:
+            self.calibrator.load_state(state["calibration"])
+
     def _estimate_slow_down(self, current_miss_rate, target_miss_rate,
                        current_bw_mbps, target_bw_mbps,
                        current_alloc_bw_mbps,
@@ -124,6 +172,7 @@ class RuntimeEstimator:
         return estimated_miss_rate
 
     def get_estimation(self, user_id, cache_in_mb, bw_in_gbps):
+        metrics.ESTIMATOR_CALLS.inc(allocator=self.metrics_label)
         # Check allocator and the current allocation
         if self.allocator is None:
             print("Allocator is not set.")
@@ -157,12 +206,130 @@ class RuntimeEstimator:
         if tar_mr <= 1e-12:
             tar_mr = 1e-12
         # Estimation based on the collected data
-        slowdown, bw_est = self._estimate_slow_down(cur_mr, tar_mr, last_usage['mem_bw'], bw_in_gbps * 1024., current_alloc['mem_bw'])
+        slowdown, bw_est = self._estimate_slow_down(cur_mr, tar_mr, last_usage['mem_bw'], bw_in_gbps * 1024., current_alloc['mem_bw'],
+                                                  **self._get_slowdown_params(user_id))
         relative_perf = 1. / max(1e-4, slowdown)
         print(f"App: {user_id} | Last usage: {last_usage}, Alloc: {current_alloc}, Tar: {cache_in_mb}, {bw_in_gbps} | Est MR: {cur_mr} -> {tar_mr}, Est bw: {bw_est}, Perf: {relative_perf}")  # in MB, Mbps
 
         return relative_perf
 
+    def estimate_miss_rates(self, mrc_data, cache_sizes):
+        """
+        Vectorized estimate_miss_rate() for multiple cache sizes (same linear interpolation/extrapolation).
+        """
+        mrc = np.asarray(mrc_data, dtype=float)
+        sizes, ratios = mrc[:, 0], mrc[:, 1]
+        cache_sizes = np.asarray(cache_sizes, dtype=float)
+        # interval [x0, x1] per query: the first point >= cache_size, clipped to the first/last interval
+        idx = np.clip(np.searchsorted(sizes, cache_sizes, side='left'), 1, len(sizes) - 1)
+        x0, x1 = sizes[idx - 1], sizes[idx]
+        y0, y1 = ratios[idx - 1], ratios[idx]
+        return y0 + (y1 - y0) * (cache_sizes - x0) / np.maximum(x1 - x0, 1e-6)
+
+    @staticmethod
+    def _estimate_slow_downs(current_miss_rate, target_miss_rates,
+                       current_bw_mbps, target_bw_mbps,
+                       current_alloc_bw_mbps,
+                       loc_to_ret_slowdown = 100,
+                       margin = 0.8):
+        """
+        Vectorized _estimate_slow_down(): all arguments broadcast against each other (e.g., target allocations of
+        one app, or (observations x 1) inputs against (1 x parameters) of the calibration).
+        """
+        target_bw_mbps = np.maximum(1, target_bw_mbps)
+        current_bw_mbps = np.maximum(1, current_bw_mbps)
+        mr_ratio = target_miss_rates / current_miss_rate
+
+        # see _estimate_slow_down(): usage-bound (or shrinking bw) vs. allocation-bound
+        usage_bound = (current_bw_mbps <= current_alloc_bw_mbps * margin) | (current_bw_mbps > target_bw_mbps)
+        alloc_bound_bw = np.where(current_bw_mbps >= current_alloc_bw_mbps * margin, current_alloc_bw_mbps, current_bw_mbps)
+        bw_est = np.where(usage_bound,
+                          current_bw_mbps * mr_ratio,
+                          target_bw_mbps * np.minimum(1., alloc_bound_bw / current_alloc_bw_mbps) * mr_ratio)
+
+        cur_slowdown = 1. + current_miss_rate * loc_to_ret_slowdown * np.maximum(1, bw_est / current_alloc_bw_mbps)
+        slowdown = 1. + target_miss_rates * loc_to_ret_slowdown * np.maximum(1, bw_est / target_bw_mbps)
+
+        return slowdown / cur_slowdown, bw_est
+
+    def get_estimations(self, user_id, cache_in_mb, bw_in_gbps):
+        """
+        Batched get_estimation() for one user over multiple candidate allocations.
+
+        Parameters:
+        - cache_in_mb, bw_in_gbps: sequences of the same length
+
+        Returns:
+        - numpy array of relative performance (-1 for every entry if the estimation is not available)
+        """
+        cache_in_mb = np.asarray(cache_in_mb, dtype=float)
+        bw_in_gbps = np.asarray(bw_in_gbps, dtype=float)
+        failed = np.full(len(cache_in_mb), -1.)
+        metrics.ESTIMATOR_CALLS.inc(len(cache_in_mb), allocator=self.metrics_label)
+        if len(cache_in_mb) == 0:
+            return failed
+        if self.allocator is None:
+            print("Allocator is not set.")
+            return failed
+        current_alloc = self.allocator.get_last_allocation()
+        if user_id not in current_alloc:
+            print(f"User {user_id} not found in the current allocation.")
+            return failed
+        current_alloc = current_alloc[user_id]
+        if self.monitor is None:
+            print("Monitor is not set.")
+            return failed
+        last_mrc = self.monitor.get_last_mrc(user_id)
+        if not last_mrc:
+            print(f"App: {user_id}, Last MRC is not available.")
+            return failed
+        last_usage = self.monitor.get_last_usage(user_id)
+        if not last_usage or 'cache' not in last_usage or 'mem_bw' not in last_usage:
+            print(f"App: {user_id}, Last usage is not available.")
+            return failed
+        cur_mr = float(self.estimate_miss_rates(last_mrc, [current_alloc['cache']])[0])
+        tar_mr = self.estimate_miss_rates(last_mrc, cache_in_mb)
+        if cur_mr < 0 or np.any(tar_mr < 0):
+            print(f"Miss rate estimation failed: {cur_mr}, {tar_mr}")
+            return failed
+        cur_mr = max(cur_mr, 1e-12)
+        tar_mr = np.maximum(tar_mr, 1e-12)
+        slowdown, _ = self._estimate_slow_downs(cur_mr, tar_mr, last_usage['mem_bw'], bw_in_gbps * 1024., current_alloc['mem_bw'],
+                                               **self._get_slowdown_params(user_id))
+        relative_perf = 1. / np.maximum(1e-4, slowdown)
+        print(f"App: {user_id} | Last usage: {last_usage}, Alloc: {current_alloc} | Batched estimation over {len(cache_in_mb)} points, Perf: [{relative_perf.min():.4f}, {relative_perf.max():.4f}]")
+
+        return relative_perf
+
+    def get_estimation_with_confidence(self, user_id, cache_in_mb, bw_in_gbps):
+        """
+        get_estimation() with the half-width of its confidence interval, which shrinks with the records measured
+        within one search step of the target: confidence_width / sqrt(1 + #records)
+
+        Returns:
+        - (relative performance, half-width); the width is 0 if the estimation is not available
+        """
+        estimation = self.get_estimation(user_id, cache_in_mb, bw_in_gbps)
+        if estimation < 0:
+            return estimation, 0.
+        num_records = self._get_num_records_near(user_id, cache_in_mb, bw_in_gbps * 1024.)
+        return estimation, self.confidence_width / np.sqrt(1. + num_records)
+
+    def _get_num_records_near(self, user_id, cache_in_mb, bw_in_mbps):
+        if self.monitor is None or user_id not in getattr(self.monitor, "collected_data", {}):
+            return 0
+        entry = self.monitor.collected_data[user_id]
+        # rebuilt only when the app has new records
+        if user_id not in self.record_index or self.record_index[user_id][0] != entry["total_record"]:
+            points = [(cache_size, mem_bw_in_mbps, len(records)) for cache_size, cache_data in entry["datapoints"].items()
+                      for mem_bw_in_mbps, records in cache_data.items()]
+            self.record_index[user_id] = (entry["total_record"], np.array(points, dtype=float).reshape(-1, 3))
+        points = self.record_index[user_id][1]
+        cache_radius = self.search_granularity * self.resource_scale["cache"]
+        bw_radius = self.search_granularity * self.resource_scale["mem_bw"] * 1024.  # gb to mb
+        near = (np.abs(points[:, 0] - cache_in_mb) <= cache_radius) & (np.abs(points[:, 1] - bw_in_mbps) <= bw_radius)
+        return int(points[near, 2].sum())
+
     def get_util_from_allocation(self, allocation: {}):
         utility = {}
         for user_id in allocation.keys():
@@ -175,6 +342,96 @@ class RuntimeEstimator:
     def update_profile(self, monitor, num_samples_for_init_phase, retraining_interval=5, search_granularity=0.01, retraining_data_size=7):
         print(f"Not implemented yet :: {self.update_profile.__name__}")
 
+    def get_profile(self, app_id):
+        """
+        Current profile of the application: last MRC, usage, deployed allocation and sensitivity.
+        Returns None if the application has not been observed yet.
+        """
+        if self.monitor is None or self.allocator is None:
+            return None
+        last_mrc = self.monitor.get_last_mrc(app_id)
+        last_usage = self.monitor.get_last_usage(app_id)
+        current_alloc = self.allocator.get_last_allocation()
+        if not last_mrc or not last_usage or not current_alloc or app_id not in current_alloc:
+            return None
+        alloc = current_alloc[app_id]
+        # sensitivity: estimated perf after trading one search step of mem_bw for cache, and vice versa
+        cache_step = self.search_granularity * self.resource_scale["cache"]
+        bw_step = self.search_granularity * self.resource_scale["mem_bw"]
+        cache_in_mb = float(alloc["cache"])
+        bw_in_gbps = float(alloc["mem_bw"]) / 1024.
+        more_cache_perf = self.get_estimation(app_id, cache_in_mb + cache_step, max(bw_step, bw_in_gbps - bw_step))
+        more_bw_perf = self.get_estimation(app_id, max(cache_step, cache_in_mb - cache_step), bw_in_gbps + bw_step)
+        return {
+            "mrc": [[float(size), float(ratio)] for size, ratio in last_mrc],
+            "usage": {"cache": float(last_usage["cache"]), "mem_bw": float(last_usage["mem_bw"])},
+            # in MB and Mbps
+            "allocation": {"cache": float(alloc["cache"]), "mem_bw": float(alloc["mem_bw"])},
+            "sensitivity": "cache" if more_cache_perf >= more_bw_perf else "mem_bw",
+            "sensitivity_scores": {"cache": more_cache_perf, "mem_bw": more_bw_perf},
+        }
+
+    def store_model(self, app_id: int, model_path: str, identity: str = None):
+        profile = self.get_profile(app_id)
+        if profile is None:
+            print(f"App: {app_id}, No profile to store.")
+            return False
+        profile["identity"] = identity
+        tmp_path = f"{model_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(profile, f)
+        os.replace(tmp_path, model_path)
+        return True
+
+    def load_model(self, app_id: int, model_path: str, identity: str = None):
+        if not os.path.exists(model_path):
+            return False
+        with open(model_path, 'r') as f:
+            profile = json.load(f)
+        if identity is not None and profile.get("identity") != identity:
+            print(f"App: {app_id}, Profile identity mismatch: {profile.get('identity')} != {identity}")
+            return False
+        self.set_prior(app_id, profile)
+        return True
+
+    def set_prior(self, app_id, profile):
+        """
+        Use the profile as a prior: seed the monitor with the MRC and usage so that
+        the allocator can skip the static init phase for this application.
+        """
+        self.priors[app_id] = profile
+        if self.monitor is not None:
+            num_records = 1
+            if self.allocator is not None and getattr(self.allocator, "parameters", None) is not None:
+                num_records = getattr(self.allocator.parameters, "init_phase_interval", 1)
+            self.monitor.load_prior(app_id, profile["mrc"], profile["usage"], num_records=num_records)
+
+    def get_prior_allocation(self, app_id):
+        """
+        Allocation (MB, Mbps) stored in the prior profile, or None if there is no prior
+        """
+        if app_id not in self.priors:
+            return None
+        return self.priors[app_id].get("allocation")
+
+    def store_profiles(self, library):
+        stored = []
+        for app_id in self.get_app_ids():
+            path = library.get_profile_path(app_id)
+            if path is not None and self.store_model(app_id, path, identity=library.get_identity(app_id)):
+                stored.append(app_id)
+        print(f"Stored profiles: {stored}")
+        return stored
+
+    def load_profiles(self, library):
+        loaded = []
+        for app_id in self.get_app_ids():
+            path = library.get_profile_path(app_id)
+            if path is not None and self.load_model(app_id, path, identity=library.get_identity(app_id)):
+                loaded.append(app_id)
+        print(f"Loaded profiles: {loaded}")
+        return loaded
+
     def get_sensitivity(self):
         sensitivity = {}
         for entry in self.profiles_config:
@@ -4,16 +4,175 @@ from utils.config import Config
 import argparse
 from estimators.runtime_estimator import RuntimeEstimator
 from metrics_reset_server import MetricsResetServer
+from checkpoint import ControllerCheckpoint
+from controller_snapshot import ControllerSnapshot
+from utils.profiling import ProfileCapture
+from estimators.profile_library import ProfileLibrary
+from allocators.allocator_base import base_search_granularity
+from utils.collect_trace import CollectRecorder
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Parse log files for experiment setup and result.")
     parser.add_argument("--config", help="Path to the configuration file.",
                             type=str, default="config.json")
-    parser.add_argument("--allocator", help="Type of allocator to use in [spirit, static, partial, oracle, inc-trade, fij-trade]", type=str, default="none")
+    parser.add_argument("--allocator", help="Type of allocator to use in [spirit, static, partial, oracle, inc-trade, fij-trade, prop-response]", type=str, default="none")
     parser.add_argument("--alloc_interval", help="Allocation interval in seconds", type=int, default=15)
     parser.add_argument("--max_iter", help="Max iterations", type=int, default=150)
+    parser.add_argument("--checkpoint", help="Path to the controller checkpoint file (disabled if empty)", type=str, default="")
+    parser.add_argument("--checkpoint_max_age", help="Max age of a checkpoint to warm restart from, in seconds", type=float, default=600.)
+    parser.add_argument("--checkpoint_interval", help="Checkpoint interval in allocation iterations", type=int, default=1)
+    parser.add_argument("--profile_dir", help="Directory of the per-application profile library (disabled if empty)", type=str, default="")
+    parser.add_argument("--record", help="Path to record raw /collect responses for replay (disabled if empty)", type=str, default="")
     return parser.parse_args()
 
+def get_resource_scale(config: Config):
+    # NOTE) reseource scale should be matched to the scale in the profile data (*.joblib)
+    return {"cache": float(config.cache_in_mb), "min_cache": float(config.min_cache_in_mb),
+            "max_cache": float(config.max_cache_in_mb),
+            # so mem bw in "gbps" in this case
+            "mem_bw": float(config.mem_bw_in_mbps) / 1024., "min_mem_bw": float(config.min_mem_bw_in_mbps) / 1024.,
+            "max_mem_bw": float(config.max_mem_bw_in_mbps) / 1024.,
+            **get_extra_resource_scale(config)}
+
+def get_extra_resource_scale(config: Config):
+    # extra resources are kept in enforcer units (see allocators.resources)
+    extra_resources = getattr(config, "extra_resources", {})
+    if not extra_resources:
+        return {}
+    resource_scale = {"extra_resources": list(extra_resources.keys())}
+    for res_type, spec in extra_resources.items():
+        resource_scale[res_type] = float(spec["total"])
+        resource_scale[f"min_{res_type}"] = float(spec.get("min", 0))
+        resource_scale[f"max_{res_type}"] = float(spec.get("max", spec["total"]))
+    return resource_scale
+
+def create_allocator(allocator_type: str, config_path: str, estimator, monitor, deployer, resource_scale: dict, logger_name: str = 'spirit_ceei_allocator'):
+    if allocator_type == "spirit":
+        from allocators.spirit_allocator import SpiritAllocator
+        allocator = SpiritAllocator(config_path, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale, logger_name=logger_name)
+    elif allocator_type == "static":
+        from allocators.static_allocator import StaticAllocator
+        allocator = StaticAllocator(config_path, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale, logger_name=logger_name)
+    elif allocator_type == "oracle":
+        from allocators.oracle_allocator import OracleAllocator
+        allocator = OracleAllocator(config_path, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale, logger_name=logger_name)
+    elif allocator_type == "inc-trade":
+        from allocators.inc_trade_allocator import IncrementalTradeAllocator
+        allocator = IncrementalTradeAllocator(config_path, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale, logger_name=logger_name)
+    elif allocator_type == "fij-trade":
+        from allocators.fij_trade_allocator import FijTradeAllocator
+        allocator = FijTradeAllocator(config_path, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale, logger_name=logger_name)
+    elif allocator_type == "prop-response":
+        from allocators.proportional_response_allocator import ProportionalResponseAllocator
+        allocator = ProportionalResponseAllocator(config_path, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale, logger_name=logger_name)
+    else:
+        raise Exception(f"Unknown allocator type: {allocator_type}")
+    return allocator
+
+def initialize_allocator(allocator, allocator_type: str, allocation_interval_in_sec: int, search_range_delta: float, init_phase_interval: int):
+    if allocator_type == "spirit":
+        from allocators.spirit_allocator import SpiritAllocatorParams
+        allocator.initialize(SpiritAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, search_range_delta=search_range_delta, init_phase_interval=init_phase_interval))
+    elif allocator_type == "static":
+        from allocators.static_allocator import StaticAllocatorParams
+        allocator.initialize(StaticAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval))
+    elif allocator_type == "oracle":
+        from allocators.oracle_allocator import OracleAllocatorParams
+        allocator.initialize(OracleAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval))
+    elif allocator_type == "inc-trade":
+        from allocators.inc_trade_allocator import IncrementalTradeAllocatorParams
+        # 3 was for 30 sec interval, so we will use 9 for 10 sec interval
+        allocator.initialize(IncrementalTradeAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval * 3))
+    elif allocator_type == "fij-trade":
+        from allocators.fij_trade_allocator import FijTradeAllocatorParams
+        allocator.initialize(FijTradeAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval))
+    elif allocator_type == "prop-response":
+        from allocators.proportional_response_allocator import ProportionalResponseAllocatorParams
+        allocator.initialize(ProportionalResponseAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, search_range_delta=search_range_delta, init_phase_interval=init_phase_interval))
+    # online estimators learn from the retrain path of the allocation loop
+    if getattr(allocator.estimator, "requires_retrain", False) and allocator.parameters is not None:
+        allocator.parameters.retrain = True
+
+def create_global_market(allocator_type: str, config: Config, resource_scale: dict):
+    # memory-node bandwidth shared across VMs; disabled unless configured
+    total_node_mem_bw_in_mbps = getattr(config, "total_node_mem_bw_in_mbps", None)
+    if total_node_mem_bw_in_mbps is None:
+        return None
+    if allocator_type not in ["spirit", "prop-response"]:
+        print(f"Warning: global bandwidth market is only supported by the spirit and prop-response allocators; ignored for {allocator_type}.")
+        return None
+    from allocators.global_market import GlobalBandwidthMarket
+    print(f"Config::Global bandwidth market over {total_node_mem_bw_in_mbps} Mbps of the memory node.")
+    return GlobalBandwidthMarket(float(total_node_mem_bw_in_mbps) / 1024., resource_scale)  # mb to gb
+
+def create_quantizer(config: Config, resource_scale: dict):
+    from allocators.quantizer import AllocationQuantizer
+    return AllocationQuantizer(resource_scale, cache_quantum_in_mb=getattr(config, "cache_quantum_in_mb", 1),
+                               mem_bw_quantum_in_mbps=getattr(config, "mem_bw_quantum_in_mbps", 1),
+                               extra_quanta={res_type: spec.get("quantum", 1) for res_type, spec in getattr(config, "extra_resources", {}).items()})
+
+def create_estimator(config: Config, resource_scale: dict):
+    # allocation_parameters.estimator: "runtime" (default, analytical) or "rls" (or a dict with "type" and RLSEstimator arguments)
+    estimator_config = (config.allocation_parameters or {}).get("estimator", "runtime")
+    estimator_args = dict(estimator_config) if isinstance(estimator_config, dict) else {"type": estimator_config}
+    estimator_type = estimator_args.pop("type", "runtime")
+    if estimator_type == "runtime":
+        estimator = RuntimeEstimator(resource_scale=resource_scale)
+    elif estimator_type == "rls":
+        from estimators.rls_estimator import RLSEstimator
+        print(f"Config::Online RLS estimator: {estimator_args}")
+        estimator = RLSEstimator(resource_scale=resource_scale, **estimator_args)
+    else:
+        raise Exception(f"Unknown estimator type: {estimator_type}")
+    # per-app calibration of the slowdown model; disabled unless configured (true or a dict of SlowdownCalibrator arguments)
+    calibration_config = (config.allocation_parameters or {}).get("calibration")
+    if calibration_config:
+        from estimators.calibration import SlowdownCalibrator
+        print(f"Config::Slowdown model calibration is enabled: {calibration_config}")
+        estimator.set_calibrator(SlowdownCalibrator(**(calibration_config if isinstance(calibration_config, dict) else {})))
+    return estimator
+
+def create_slack_redistributor(config: Config, resource_scale: dict):
+    # lending of idle resources; disabled unless configured (true or a dict of SlackRedistributor arguments)
+    slack_config = (config.allocation_parameters or {}).get("slack_redistribution")
+    if not slack_config:
+        return None
+    from allocators.slack import SlackRedistributor
+    print(f"Config::Slack redistribution is enabled: {slack_config}")
+    return SlackRedistributor(resource_scale, **(slack_config if isinstance(slack_config, dict) else {}))
+
+def get_search_range_delta(config: Config, allocation_interval_in_sec: int, base_alloc_int: int = 10):
+    # trust region of the Spirit search window; disabled unless configured (allocation_parameters.trust_region: true)
+    if not (config.allocation_parameters or {}).get("trust_region"):
+        return 0.
+    # Scan range increase is based on wall clock time -> longer interval, larger delta
+    # (one search step per base allocation interval)
+    search_range_delta = base_search_granularity * allocation_interval_in_sec / base_alloc_int
+    print(f"Config::Trust region of the search window is enabled: +/- {search_range_delta} per allocation")
+    return search_range_delta
+
+def create_shadow_evaluator(config: Config, config_path: str, estimator, monitor, deployer, resource_scale: dict,
+                            allocation_interval_in_sec: int, search_range_delta: float, init_phase_interval: int):
+    # allocators run in shadow next to the live one; disabled unless configured (a list of allocator types, or a dict
+    # with "allocators" and the other ShadowEvaluator arguments)
+    shadow_config = (config.allocation_parameters or {}).get("shadow_allocators")
+    if not shadow_config:
+        return None
+    from allocators.shadow import ShadowEvaluator
+    shadow_args = dict(shadow_config) if isinstance(shadow_config, dict) else {"allocators": shadow_config}
+    shadows = {}
+    for allocator_type in shadow_args.pop("allocators"):
+        # own estimator per shadow: its monitor, learned state and current allocation are set by the evaluator every round
+        shadow_estimator = estimator.fork(allocator_type)
+        shadow = create_allocator(allocator_type, config_path, shadow_estimator, monitor, deployer, resource_scale, logger_name=f"shadow_{allocator_type}")
+        shadow.set_global_market(create_global_market(allocator_type, config, resource_scale))
+        shadow.set_quantizer(create_quantizer(config, resource_scale))
+        shadow_estimator.set_allocator(shadow)
+        initialize_allocator(shadow, allocator_type, allocation_interval_in_sec, search_range_delta, init_phase_interval)
+        shadows[allocator_type] = shadow
+    print(f"Config::Shadow allocators: {list(shadows)}")
+    return ShadowEvaluator(shadows, **shadow_args)
+
 def run_evaluation(args, allocation_interval_in_sec: int=10, move_logs=True):
     # max_iteration = 100 for 300 iteraions; 50 for 150 iterations
 
@@ -33,75 +192,65 @@ def run_evaluation(args, allocation_interval_in_sec: int=10, move_logs=True):
     # = 16 iterations at 60 sec interval
     max_iteration = max_iteration * base_alloc_int // allocation_interval_in_sec
 
-    # Scan range increase is based on wall clock time -> longer interval, larger delta
-    search_range_delta = 0. # No dynamic search range
+    search_range_delta = get_search_range_delta(config, allocation_interval_in_sec, base_alloc_int)
     print(f"Config: base_alloc_int: {base_alloc_int}, alloc_int: {allocation_interval_in_sec},\
           max_iteration: {max_iteration}, search_range_delta: {search_range_delta}")
     print(f"Config::Num applications: {len(config.benchmark_map)}")
-    # NOTE) reseource scale should be matched to the scale in the profile data (*.joblib)
-    resource_scale = {"cache": float(config.cache_in_mb), "min_cache": float(config.min_cache_in_mb),
-                      "max_cache": float(config.max_cache_in_mb),
-                      # so mem bw in "gbps" in this case
-                      "mem_bw": float(config.mem_bw_in_mbps) / 1024., "min_mem_bw": float(config.min_mem_bw_in_mbps) / 1024.,
-                      "max_mem_bw": float(config.max_mem_bw_in_mbps) / 1024.}
+    resource_scale = get_resource_scale(config)
     # Monitor (collecting resource usage from the controller)
     monitor = MemcachedMindMonitor(config=config)
+    if args.record:
+        monitor.set_recorder(CollectRecorder(args.record))
     # Deployer (sending allocation to the controller)
     deployer = MemcachedDeployer(config=config)
     # Estimator
-    estimator = RuntimeEstimator(resource_scale=resource_scale)
+    estimator = create_estimator(config, resource_scale)
 
     # Allocator
-    if args.allocator == "spirit":
-        from allocators.spirit_allocator import SpiritAllocator
-        allocator = SpiritAllocator(args.config, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale)
-    elif args.allocator == "static":
-        from allocators.static_allocator import StaticAllocator
-        allocator = StaticAllocator(args.config, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale)
-    elif args.allocator == "oracle":
-        from allocators.oracle_allocator import OracleAllocator
-        allocator = OracleAllocator(args.config, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale)
-    elif args.allocator == "inc-trade":
-        from allocators.inc_trade_allocator import IncrementalTradeAllocator
-        allocator = IncrementalTradeAllocator(args.config, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale)
-    elif args.allocator == "fij-trade":
-        from allocators.fij_trade_allocator import FijTradeAllocator
-        allocator = FijTradeAllocator(args.config, estimator=estimator, monitor=monitor, deployer=deployer, resource_scale=resource_scale)
-    else:
-        raise Exception(f"Unknown allocator type: {args.allocator}")
+    allocator = create_allocator(args.allocator, args.config, estimator, monitor, deployer, resource_scale)
+    allocator.set_global_market(create_global_market(args.allocator, config, resource_scale))
+    allocator.set_quantizer(create_quantizer(config, resource_scale))
+    allocator.set_slack_redistributor(create_slack_redistributor(config, resource_scale))
 
     # = Initialization/Parameters =
     init_phase_interval = 3     # default = 3
     estimator.set_allocator(allocator)
     if hasattr(estimator, "set_monitor"):
         estimator.set_monitor(monitor)
-    if args.allocator == "spirit":
-        from allocators.spirit_allocator import SpiritAllocatorParams
-        allocator.initialize(SpiritAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, search_range_delta=search_range_delta, init_phase_interval=init_phase_interval))
-    elif args.allocator == "static":
-        from allocators.static_allocator import StaticAllocatorParams
-        allocator.initialize(StaticAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval))
-    elif args.allocator == "oracle":
-        from allocators.oracle_allocator import OracleAllocatorParams
-        allocator.initialize(OracleAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval))
-    elif args.allocator == "inc-trade":
-        from allocators.inc_trade_allocator import IncrementalTradeAllocatorParams
-        # 3 was for 30 sec interval, so we will use 9 for 10 sec interval
-        allocator.initialize(IncrementalTradeAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval * 3))
-    elif args.allocator == "fij-trade":
-        from allocators.fij_trade_allocator import FijTradeAllocatorParams
-        allocator.initialize(FijTradeAllocatorParams(allocation_interval_in_sec=allocation_interval_in_sec, init_phase_interval=init_phase_interval))
+    initialize_allocator(allocator, args.allocator, allocation_interval_in_sec, search_range_delta, init_phase_interval)
+    allocator.set_shadow_evaluator(create_shadow_evaluator(config, args.config, estimator, monitor, deployer, resource_scale,
+                                                           allocation_interval_in_sec, search_range_delta, init_phase_interval))
+
+    # Load per-application profiles from previous runs as priors
+    profile_library = None
+    if args.profile_dir:
+        profile_library = ProfileLibrary(args.profile_dir, config.benchmark_map)
+        estimator.load_profiles(profile_library)
 
     # = Start =
     # Start the metrics reset API server
-    metrics_server = MetricsResetServer(monitor)
+    snapshot = ControllerSnapshot()
+    allocator.set_snapshot(snapshot)
+    profile_capture = ProfileCapture(output_dir="./logs/profiles")
+    allocator.set_profile_capture(profile_capture)
+    metrics_server = MetricsResetServer(monitor, snapshot=snapshot, profile_capture=profile_capture)
     metrics_server.start()
-    allocator.start(max_iteration=max_iteration)
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = ControllerCheckpoint(args.checkpoint, max_age_in_sec=args.checkpoint_max_age, interval=args.checkpoint_interval)
+    allocator.start(max_iteration=max_iteration, checkpoint=checkpoint)
+    if monitor.recorder is not None:
+        monitor.recorder.close()
+    if profile_library is not None:
+        estimator.store_profiles(profile_library)
 
     if not move_logs:
         metrics_server.stop()
         return
 
+    if checkpoint is not None:
+        checkpoint.cleanup()
+
     # deallocate monitor, deployer, estimator, allocator
     allocator.cleanup()
     estimator.cleanup()
@@ -0,0 +1,109 @@
+import argparse
+import json
+from utils.config import Config
+from checkpoint import ControllerCheckpoint
+from estimators.runtime_estimator import RuntimeEstimator
+from estimators.profile_library import ProfileLibrary
+from allocators.oracle_solver import OracleSolver, OBJECTIVES
+from main_memcached import get_resource_scale
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline optimal (oracle) allocations per VM from measured performance surfaces or MRC profiles.")
+    parser.add_argument("--config", help="Path to the configuration file.", type=str, default="config.json")
+    parser.add_argument("--checkpoint", help="Controller checkpoint whose measurements are the performance surfaces", type=str, default="")
+    parser.add_argument("--profile_dir", help="Profile library whose MRCs give the performance surfaces (slowdown model)", type=str, default="")
+    parser.add_argument("--objective", help=f"Objective of the written oracle_allocation in {list(OBJECTIVES)}", type=str, default="max-min")
+    parser.add_argument("--num_steps", help="Lattice steps per resource over the VM capacity", type=int, default=32)
+    parser.add_argument("--output", help="Path to write the config with the oracle_allocation entries (not written if empty)", type=str, default="")
+    return parser.parse_args()
+
+def get_vm_groups(app_ids, num_vms, vm_to_app_map=None):
+    # VM mapping of the monitor if complete, else the flat split of the allocators
+    if vm_to_app_map and set(app_ids) <= {app_id for apps in vm_to_app_map.values() for app_id in apps}:
+        return {vm_id: [app_id for app_id in apps if app_id in app_ids] for vm_id, apps in vm_to_app_map.items()}
+    users_per_vm = max(1, len(app_ids) // num_vms)
+    groups = {}
+    for idx, app_id in enumerate(app_ids):
+        groups.setdefault(idx // users_per_vm, []).append(app_id)
+    return groups
+
+def get_tables(args, config: Config, solver: OracleSolver, app_ids):
+    """
+    Returns:
+        (app_id -> utility table, VM mapping of the monitor or None)
+    """
+    tables = {}
+    if args.checkpoint:
+        state = ControllerCheckpoint(args.checkpoint).load()
+        if state is None:
+            raise Exception(f"Failed to load the checkpoint: {args.checkpoint}")
+        collected_data = state["monitor_state"]["collected_data"]
+        for app_id in app_ids:
+            if app_id in collected_data:
+                tables[app_id] = solver.tabulate_measurements(collected_data[app_id]["datapoints"])
+        return tables, state["monitor_state"].get("vm_to_app_map")
+    library = ProfileLibrary(args.profile_dir, config.benchmark_map)
+    estimator = RuntimeEstimator(resource_scale=solver.resource_scale)
+    for app_id in app_ids:
+        path = library.get_profile_path(app_id)
+        if path is None:
+            continue
+        try:
+            with open(path) as f:
+                profile = json.load(f)
+        except FileNotFoundError:
+            continue
+        tables[app_id] = solver.tabulate_profile(profile, estimator)
+    return tables, None
+
+def run_oracle(args):
+    if bool(args.checkpoint) == bool(args.profile_dir):
+        raise Exception("Exactly one of --checkpoint and --profile_dir is required.")
+    if args.objective not in OBJECTIVES:
+        raise Exception(f"Unknown objective: {args.objective} (expected one of {list(OBJECTIVES)})")
+    config = Config().load_config(config_path=args.config)
+    resource_scale = get_resource_scale(config)
+    solver = OracleSolver(resource_scale, num_steps=args.num_steps)
+    app_ids = [entry["user_id"] for entry in config.raw_json["profiles"]]
+    tables, vm_to_app_map = get_tables(args, config, solver, app_ids)
+    missing = [app_id for app_id in app_ids if app_id not in tables]
+    if missing:
+        print(f"Oracle::No performance surface for apps {missing}; they keep their equal share of the VM")
+    num_vms = int(config.raw_json.get("cluster", {}).get("num_vms", 1))
+
+    oracle_allocation = {}
+    for vm_id, vm_apps in get_vm_groups(app_ids, num_vms, vm_to_app_map).items():
+        if not vm_apps:
+            continue
+        vm_tables = {app_id: tables[app_id] if app_id in tables else solver.tabulate_equal_share(len(vm_apps))
+                     for app_id in vm_apps}
+        for objective in OBJECTIVES:
+            allocation, utilities = solver.solve(vm_tables, objective)
+            if allocation is None:
+                print(f"Oracle::VM {vm_id} | {objective}: infeasible under the limits")
+                continue
+            # the equal shares have no utility of their own
+            values = [utilities[app_id] for app_id in allocation if app_id in tables]
+            summary = f"sum {sum(values):.4f}, min {min(values):.4f}" if values else "no performance surface"
+            print(f"Oracle::VM {vm_id} | {objective}: {summary} | "
+                  + ", ".join(f"{app_id}: {alloc} ({f'{utilities[app_id]:.4f}' if app_id in tables else 'equal share'})"
+                              for app_id, alloc in allocation.items()))
+            if objective == args.objective:
+                oracle_allocation.update(allocation)
+
+    unsolved = [app_id for app_id in app_ids if app_id not in oracle_allocation]
+    if unsolved and args.output:
+        raise Exception(f"No {args.objective} oracle_allocation for apps {unsolved}; not writing an incomplete config to {args.output}")
+    if args.output:
+        raw_config = json.loads(json.dumps(config.raw_json))
+        for entry in raw_config["profiles"]:
+            if entry["user_id"] in oracle_allocation:
+                entry["oracle_allocation"] = oracle_allocation[entry["user_id"]]
+        with open(args.output, 'w') as f:
+            json.dump(raw_config, f, indent=4)
+        print(f"Oracle::Wrote {args.objective} oracle_allocation of {len(oracle_allocation)} apps to {args.output}")
+    return oracle_allocation
+
+
+if __name__ == "__main__":
+    run_oracle(parse_args())
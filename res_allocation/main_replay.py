@@ -0,0 +1,65 @@
+from resource_monitor import ReplayMonitor
+from deployer import DummyDeployer
+from utils.config import Config
+from utils.collect_trace import load_collect_trace
+import argparse
+import time
+from main_memcached import get_search_range_delta, get_resource_scale, create_estimator, create_allocator, initialize_allocator, create_global_market, create_quantizer, create_slack_redistributor, create_shadow_evaluator
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay recorded /collect responses through the controller (no enforcer, no sleeps).")
+    parser.add_argument("--config", help="Path to the configuration file.",
+                            type=str, default="config.json")
+    parser.add_argument("--allocator", help="Type of allocator to use in [spirit, static, oracle, inc-trade, fij-trade, prop-response]", type=str, default="spirit")
+    parser.add_argument("--trace", help="Recorded trace (--record of main_memcached) or main log of a previous run", type=str, required=True)
+    parser.add_argument("--measurements_per_alloc", help="Recorded responses consumed per allocation (default: allocator's setting)", type=int, default=0)
+    parser.add_argument("--max_iter", help="Max iterations (default: until the trace is exhausted)", type=int, default=0)
+    return parser.parse_args()
+
+def run_replay(args):
+    config = Config().load_config(config_path=args.config)
+    allocation_interval_in_sec = 10
+    if config.allocation_parameters is not None and "allocation_interval_in_sec" in config.allocation_parameters:
+        allocation_interval_in_sec = config.allocation_parameters["allocation_interval_in_sec"]
+    base_alloc_int = int(10)
+    search_range_delta = get_search_range_delta(config, allocation_interval_in_sec, base_alloc_int)
+
+    entries = load_collect_trace(args.trace)
+    print(f"Replay::Loaded {len(entries)} recorded responses from {args.trace}", flush=True)
+    if not entries:
+        return
+
+    resource_scale = get_resource_scale(config)
+    monitor = ReplayMonitor(config=config, entries=entries)
+    deployer = DummyDeployer(config=config)
+    estimator = create_estimator(config, resource_scale)
+    allocator = create_allocator(args.allocator, args.config, estimator, monitor, deployer, resource_scale)
+    allocator.set_global_market(create_global_market(args.allocator, config, resource_scale))
+    allocator.set_quantizer(create_quantizer(config, resource_scale))
+    allocator.set_slack_redistributor(create_slack_redistributor(config, resource_scale))
+
+    init_phase_interval = 3     # same as main_memcached
+    estimator.set_allocator(allocator)
+    if hasattr(estimator, "set_monitor"):
+        estimator.set_monitor(monitor)
+    initialize_allocator(allocator, args.allocator, allocation_interval_in_sec, search_range_delta, init_phase_interval)
+    allocator.set_shadow_evaluator(create_shadow_evaluator(config, args.config, estimator, monitor, deployer, resource_scale,
+                                                           allocation_interval_in_sec, search_range_delta, init_phase_interval))
+    if args.measurements_per_alloc > 0:
+        allocator.parameters.measurements_per_alloc = args.measurements_per_alloc
+
+    max_iteration = args.max_iter if args.max_iter > 0 else len(entries)
+    start_time = time.perf_counter()
+    allocator.start(max_iteration=max_iteration, init_timer=0, no_wait=True)
+    elapsed = time.perf_counter() - start_time
+    print(f"Replay::Consumed {monitor.replay_index} / {len(entries)} responses in {elapsed:.3f} sec "
+          f"({elapsed / max(1, monitor.replay_index) * 1e3:.3f} ms per response)", flush=True)
+
+    allocator.cleanup()
+    estimator.cleanup()
+    deployer.cleanup()
+    monitor.cleanup()
+
+
+if __name__ == "__main__":
+    run_replay(parse_args())
@@ -2,121 +2,229 @@ import http.server
 import json
 import threading
 from urllib.parse import urlparse, parse_qs
+from utils import metrics
 
 class MetricsResetHandler(http.server.BaseHTTPRequestHandler):
-    """HTTP request handler for metrics reset API"""
+    """
+    HTTP request handler of the controller API.
+    Requests are dispatched by (method, path) through the route table of the MetricsResetServer.
+    """
+
+    # set by MetricsResetServer._create_handler_class
+    monitor = None
+    snapshot = None
+    profile_capture = None
+    routes = {}
+
+    def _send_json(self, code, response):
+        payload = json.dumps(response).encode()
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
 
-    def __init__(self, *args, monitor=None, **kwargs):
-        # If monitor is None, check if it's available as a class attribute
-        if monitor is None:
-            monitor = getattr(self.__class__, 'monitor', None)
+    def _send_text(self, code, text, content_type='text/plain; charset=utf-8'):
+        payload = text.encode()
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
 
-        self.monitor = monitor
-        # Initialize the parent class without passing monitor
-        # This is a workaround since BaseHTTPRequestHandler doesn't accept custom params
-        super().__init__(*args, **kwargs)
+    def _read_body(self):
+        """Parse the JSON request body, or None if the body is empty or not JSON"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        post_data = self.rfile.read(content_length).decode('utf-8')
+        try:
+            data = json.loads(post_data)
+        except json.JSONDecodeError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _dispatch(self, method):
+        parsed_url = urlparse(self.path)
+        route = self.routes.get((method, parsed_url.path))
+        if route is None:
+            self._send_json(404, {"status": "error", "message": "Endpoint not found"})
+            return
+        query_params = parse_qs(parsed_url.query)
+        body = self._read_body() if method == "POST" else None
+        try:
+            route(self, query_params, body)
+        except Exception as e:
+            self._send_json(500, {"status": "error", "message": f"{type(e).__name__}: {e}"})
 
     def do_GET(self):
-        """Handle GET requests to check server status"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        # polling clients would flood the main log
+        pass
 
+    # === Routes ===
+    def handle_status(self, query_params, body):
+        """Handle GET requests to check server status"""
         response = {
             "status": "ok",
             "message": "Metrics reset API is running",
-            "usage": "Send a POST request to /reset_metrics with app_id parameter"
+            "usage": "POST /reset_metrics with app_id or app_ids; POST /profile with rounds; GET /allocation, /apps[?app_id=..], /healthz[?max_age=..], /metrics, /profile",
+            "routes": sorted(f"{method} {path}" for method, path in self.routes.keys())
         }
-        self.wfile.write(json.dumps(response).encode())
+        self._send_json(200, response)
+
+    def handle_healthz(self, query_params, body):
+        """Liveness of the API; with max_age (sec), also fails if the control loop has not published a round since then"""
+        age = self.snapshot.get_age_in_sec() if self.snapshot is not None else None
+        state = self.snapshot.get() if self.snapshot is not None else {}
+        response = {"status": "ok", "iteration": state.get("iteration"), "last_round_age_sec": age}
+        max_age = query_params.get('max_age', [None])[0]
+        if max_age is not None and (age is None or age > float(max_age)):
+            response["status"] = "stale"
+            self._send_json(503, response)
+            return
+        self._send_json(200, response)
 
-    def do_POST(self):
-        """Handle POST requests to reset metrics for an application"""
-        parsed_url = urlparse(self.path)
+    def handle_metrics(self, query_params, body):
+        # Prometheus text exposition format
+        self._send_text(200, metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        # Check if the path is correct
-        if parsed_url.path != '/reset_metrics':
-            self.send_response(404)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            response = {"status": "error", "message": "Endpoint not found"}
-            self.wfile.write(json.dumps(response).encode())
+    def handle_allocation(self, query_params, body):
+        if self.snapshot is None:
+            self._send_json(503, {"status": "error", "message": "Snapshot not available"})
             return
+        state = self.snapshot.get()
+        self._send_json(200, {key: state[key] for key in ["timestamp", "iteration", "allocator", "allocation"]})
 
-        # Get the content length to read request body
-        content_length = int(self.headers.get('Content-Length', 0))
-        post_data = self.rfile.read(content_length).decode('utf-8')
+    def handle_apps(self, query_params, body):
+        if self.snapshot is None:
+            self._send_json(503, {"status": "error", "message": "Snapshot not available"})
+            return
+        state = self.snapshot.get()
+        apps = state["apps"]
+        if 'app_id' in query_params:
+            app_ids = [app_id.strip() for value in query_params['app_id'] for app_id in value.split(',') if app_id.strip()]
+            missing = [app_id for app_id in app_ids if app_id not in apps]
+            if missing:
+                self._send_json(404, {"status": "error", "message": f"Application(s) not found: {missing}"})
+                return
+            apps = {app_id: apps[app_id] for app_id in app_ids}
+        self._send_json(200, {"timestamp": state["timestamp"], "iteration": state["iteration"], "apps": apps})
+
+    def handle_profile_status(self, query_params, body):
+        if self.profile_capture is None:
+            self._send_json(503, {"status": "error", "message": "Profiling not available"})
+            return
+        self._send_json(200, self.profile_capture.get_status())
 
+    def handle_profile(self, query_params, body):
+        """Arm a cProfile/tracemalloc capture for the next N allocation rounds"""
+        if self.profile_capture is None:
+            self._send_json(503, {"status": "error", "message": "Profiling not available"})
+            return
+        rounds = body.get('rounds') if body is not None else query_params.get('rounds', [1])[0]
         try:
-            # Try to parse JSON request body
-            data = json.loads(post_data)
-            app_id = data.get('app_id')
-        except json.JSONDecodeError:
+            armed = self.profile_capture.arm(rounds if rounds is not None else 1)
+        except (TypeError, ValueError):
+            self._send_json(400, {"status": "error", "message": "rounds must be a positive integer"})
+            return
+        if not armed:
+            self._send_json(409, {"status": "error", "message": "A capture is already armed or running", **self.profile_capture.get_status()})
+            return
+        self._send_json(202, {"status": "armed", "output_dir": self.profile_capture.output_dir, **self.profile_capture.get_status()})
+
+    def handle_reset_metrics(self, query_params, body):
+        """Handle POST requests to reset metrics for one (app_id) or many (app_ids) applications"""
+        app_ids = None
+        if body is not None:
+            if body.get('app_ids') is not None:
+                app_ids = body.get('app_ids')
+            elif body.get('app_id') is not None:
+                app_ids = [body.get('app_id')]
+        else:
             # If not JSON, try to parse query parameters
-            query_params = parse_qs(parsed_url.query)
-            app_id = query_params.get('app_id', [None])[0]
+            if 'app_ids' in query_params:
+                app_ids = [app_id for value in query_params['app_ids'] for app_id in value.split(',') if app_id]
+            elif 'app_id' in query_params:
+                app_ids = [query_params['app_id'][0]]
 
         # Handle case when app_id is not provided
-        if not app_id:
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            response = {"status": "error", "message": "Missing required parameter: app_id"}
-            self.wfile.write(json.dumps(response).encode())
+        if not app_ids or not isinstance(app_ids, list):
+            self._send_json(400, {"status": "error", "message": "Missing required parameter: app_id or app_ids"})
             return
 
         # Convert app_id to integer
         try:
-            app_id = int(app_id)
-        except ValueError:
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            response = {"status": "error", "message": "app_id must be an integer"}
-            self.wfile.write(json.dumps(response).encode())
+            app_ids = [int(app_id) for app_id in app_ids]
+        except (TypeError, ValueError):
+            self._send_json(400, {"status": "error", "message": "app_id must be an integer"})
             return
 
-        # Reset metrics for the specified application
-        if self.monitor and hasattr(self.monitor, 'reset_metrics_for_app'):
-            success = self.monitor.reset_metrics_for_app(app_id)
+        if not self.monitor or not hasattr(self.monitor, 'reset_metrics_for_apps'):
+            self._send_json(500, {"status": "error", "message": "Monitor not available or reset_metrics_for_apps method not implemented"})
+            return
 
-            if success:
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = {"status": "success", "message": f"Metrics reset for application {app_id}"}
-                self.wfile.write(json.dumps(response).encode())
+        # Reset metrics for the specified applications (single lock acquisition)
+        results = self.monitor.reset_metrics_for_apps(app_ids)
+        not_found = [app_id for app_id, success in results.items() if not success]
+        if len(app_ids) == 1:
+            if not_found:
+                self._send_json(404, {"status": "error", "message": f"Application {app_ids[0]} not found"})
             else:
-                self.send_response(404)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = {"status": "error", "message": f"Application {app_id} not found"}
-                self.wfile.write(json.dumps(response).encode())
-        else:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            response = {"status": "error", "message": "Monitor not available or reset_metrics_for_app method not implemented"}
-            self.wfile.write(json.dumps(response).encode())
+                self._send_json(200, {"status": "success", "message": f"Metrics reset for application {app_ids[0]}"})
+            return
+        if len(not_found) == len(results):
+            self._send_json(404, {"status": "error", "message": f"Applications not found: {not_found}"})
+            return
+        self._send_json(200, {
+            "status": "success" if not not_found else "partial",
+            "reset": [app_id for app_id, success in results.items() if success],
+            "not_found": not_found})
+
+DEFAULT_ROUTES = {
+    ("GET", "/"): MetricsResetHandler.handle_status,
+    ("GET", "/healthz"): MetricsResetHandler.handle_healthz,
+    ("GET", "/metrics"): MetricsResetHandler.handle_metrics,
+    ("GET", "/allocation"): MetricsResetHandler.handle_allocation,
+    ("GET", "/apps"): MetricsResetHandler.handle_apps,
+    ("POST", "/reset_metrics"): MetricsResetHandler.handle_reset_metrics,
+    ("GET", "/profile"): MetricsResetHandler.handle_profile_status,
+    ("POST", "/profile"): MetricsResetHandler.handle_profile,
+}
 
 class MetricsResetServer:
-    """Server class for metrics reset API"""
+    """Threaded server class for the controller API (metrics reset, state reads, health probes)"""
 
-    def __init__(self, monitor, port=60000):
-        """Initialize the server with the monitor instance and port"""
+    def __init__(self, monitor, port=60000, snapshot=None, profile_capture=None):
+        """Initialize the server with the monitor instance, port, the optional ControllerSnapshot for reads and ProfileCapture"""
         self.monitor = monitor
         self.port = port
+        self.snapshot = snapshot
+        self.profile_capture = profile_capture
+        self.routes = dict(DEFAULT_ROUTES)
         self.server = None
         self.server_thread = None
 
-    @staticmethod
-    def _create_handler_class(monitor):
-        """Create a handler class with access to the monitor instance"""
-        return type('BoundMetricsResetHandler', (MetricsResetHandler,), {'monitor': monitor})
+    def add_route(self, method, path, route):
+        """
+        Register a route before start(); @route is called as route(handler, query_params, body)
+        """
+        self.routes[(method.upper(), path)] = route
+
+    def _create_handler_class(self):
+        """Create a handler class with access to the monitor, snapshot and routes"""
+        return type('BoundMetricsResetHandler', (MetricsResetHandler,),
+                    {'monitor': self.monitor, 'snapshot': self.snapshot, 'profile_capture': self.profile_capture,
+                     'routes': dict(self.routes)})
 
     def start(self):
         """Start the HTTP server in a separate thread"""
-        handler = self._create_handler_class(self.monitor)
-        self.server = http.server.HTTPServer(('0.0.0.0', self.port), handler)
+        handler = self._create_handler_class()
+        self.server = http.server.ThreadingHTTPServer(('0.0.0.0', self.port), handler)
+        self.server.daemon_threads = True
 
         print(f"Starting metrics reset API server on port {self.port}")
         self.server_thread = threading.Thread(target=self.server.serve_forever)
@@ -5,17 +5,38 @@ from utils.logger import Logger
 import re
 import json
 import numpy as np
+import time
+import threading
+from utils import metrics
+from utils.change_point import PageHinkley
 
 class ResourceMonitor:
     def __init__(self, config):
         self.config = config
+        # guards the monitor state between the control loop and the API server threads
+        self.lock = threading.RLock()
+        # allocation rounds may stretch up to this many times the nominal interval while no app changes phase
+        self.max_cadence_backoff = 1
+        # the memory footprint walks the whole monitor state: sampled once every this many rounds
+        self.footprint_interval = 10
+        self.footprint_rounds = 0
 
     def initialize(self, config: str):
         raise NotImplementedError
 
+    def pop_change_points(self):
+        """
+        Apps with a detected phase change since the last call (app_id -> collection iteration)
+        """
+        return {}
+
     def collect(self, verification_th):
         raise NotImplementedError
 
+    def is_exhausted(self):
+        # live monitors never run out of data
+        return False
+
 class MemcachedMindMonitor(ResourceMonitor):
     def __init__(self, config):
         super().__init__(config)
@@ -45,10 +66,24 @@ class MemcachedMindMonitor(ResourceMonitor):
         self.recent_window = 24 # 2 min for 5 sec alloc interval
         self.recent_data_count = 2
         self.vm_to_app_map = {}  # Mapping from VM ID to list of App IDs
+        self.recorder = None    # optional CollectRecorder for raw /collect responses
+        # phase change detection (allocation_parameters.change_detection: true or a dict of PageHinkley arguments
+        # and max_cadence_backoff); user -> {"perf": PageHinkley, "miss_ratio": PageHinkley, "allocation": (cache, mem_bw)}
+        self.change_detection = None
+        self.change_detectors = {}
+        self.change_points = {}
+        change_detection = (self.config.allocation_parameters or {}).get("change_detection")
+        if change_detection:
+            self.change_detection = dict(change_detection) if isinstance(change_detection, dict) else {}
+            self.max_cadence_backoff = int(self.change_detection.pop("max_cadence_backoff", 4))
+            self.logger.log_msg(f"Change detection: {self.change_detection}, max cadence backoff: {self.max_cadence_backoff}")
 
     def cleanup(self):
         self.logger.close()
 
+    def set_recorder(self, recorder):
+        self.recorder = recorder
+
     def load_config(self):
         self.logger.log_msg(f"Monitor configuration: deploy URL: {self.config.url}{self.config.collect_route}")
         self.logger.log_msg(f"Full config: {self.config}")
@@ -99,6 +134,33 @@ class MemcachedMindMonitor(ResourceMonitor):
     def get_app_ids(self):
         return list(self.collected_data.keys())
 
+    def get_app_states(self):
+        '''
+        Per-application state for the controller API (JSON serializable)
+        '''
+        app_to_vm = {app_id: vm_id for vm_id, app_ids in self.vm_to_app_map.items() for app_id in app_ids}
+        states = {}
+        for user_id in set(self.collected_data.keys()) | set(self.last_usage.keys()):
+            entry = self.collected_data.get(user_id, {})
+            states[user_id] = {
+                "vm_id": app_to_vm.get(user_id),
+                "total_record": entry.get("total_record", 0),
+                "total_datapoint": entry.get("total_datapoint", 0),
+                "last_update_iteration": entry.get("last_update_iteration", 0),
+                "last_usage": dict(self.last_usage[user_id]) if user_id in self.last_usage else None,
+                "latest_perf": self.get_latest_perf(user_id),
+                "allocation": dict(self.last_allocation[user_id]) if user_id in self.last_allocation else None,
+            }
+        return states
+
+    def update_footprint_metrics(self):
+        metrics.MONITOR_APPS.set(len(self.collected_data))
+        metrics.MONITOR_DATAPOINTS.set(sum(entry["total_datapoint"] for entry in self.collected_data.values()))
+        if self.footprint_rounds % self.footprint_interval == 0:
+            metrics.MONITOR_MEMORY.set(metrics.get_deep_size(
+                [self.collected_data, self.buffered_data, self.buffered_mrc, self.recent_measurement, self.last_usage]))
+        self.footprint_rounds += 1
+
     def get_vm_to_app_mapping(self):
         """
         Returns the current mapping of VM IDs to App IDs
@@ -147,6 +209,17 @@ class MemcachedMindMonitor(ResourceMonitor):
                     res_data[cache_size][mem_bw_in_mbps].append(perf[0])
         return res_data
 
+    def get_latest_perf(self, user_id):
+        '''
+        Median performance of the most recent consumed measurement, or None if not available.
+        '''
+        if user_id not in self.recent_measurement or not self.recent_measurement[user_id]:
+            return None
+        perfs = [entry["perf"] for entry in self.recent_measurement[user_id][-1]]
+        if not perfs:
+            return None
+        return statistics.median(perfs)
+
     def get_num_recent_data(self, user_id):
         if user_id not in self.recent_measurement:
             return 0
@@ -160,20 +233,32 @@ class MemcachedMindMonitor(ResourceMonitor):
         url = f"{self.config.url}{self.config.collect_route}"
         headers = {'Content-Type': 'application/json'}
         self.logger.log_msg(f"Sending a data collect request to {url} w/ {headers}")
+        start_time = time.perf_counter()
         response = requests.get(url, headers=headers)
+        metrics.COLLECT_LATENCY.observe(time.perf_counter() - start_time)
+        metrics.COLLECT_TOTAL.inc(status="ok" if response.status_code in [200, 202] else "error")
         if response.status_code in [200, 202]:
             # decode response's content (it's b'...')
             data = response.content.decode('utf-8')
-            if data:
-                if data.strip() == "" or data.strip() == '\"\"':
-                    self.logger.log_msg("Received empty string.")
-                    return
-                # parse the data
-                print(data)     # to the main log
+            if self.recorder is not None and data:
+                self.recorder.record(data)
+            self.process_payload(data, verification_th=verification_th)
+
+    def process_payload(self, data, verification_th=0.025):
+        '''
+        Parse and buffer a raw /collect response (shared by the live and replay paths)
+        '''
+        if data:
+            if data.strip() == "" or data.strip() == '\"\"':
+                self.logger.log_msg("Received empty string.")
+                return
+            # parse the data
+            print(data)     # to the main log
+            with self.lock:
                 data = self.parse_log_entries(data)
                 self.buffer_collected_data(data, verification_th=verification_th)
-            else:
-                self.logger.log_msg(f"No allocation found: {data}")
+        else:
+            self.logger.log_msg(f"No allocation found: {data}")
 
     def _weighted_update_list(self, old_list, new_list, alpha=0.95):
         """
@@ -341,6 +426,7 @@ class MemcachedMindMonitor(ResourceMonitor):
                         continue;
                     # we ingores the exactly the same value as the previous record (most likely redundant record)
                 self.buffered_data[user_id][cache_size][mem_bw_in_mbps].append(perf)
+                self._detect_change(user_id, (cache_size_alloc, mem_bw_in_mbps_alloc), cache_size, mem_bw_in_mbps, perf, entry.get("mrc"))
 
                 # Compute and print MR: faults = 1024 (to Kbps) / 8 (to kB/s) / 4 (to pages), access = 1024 * 1024 (to Bps) / 8 (to B/s) / 64 (to cache lines)
                 # faults / access = 1024 / 8 / 4 / (1024 * 1024 / 8 / 64) = 1 / (1024 * 16)
@@ -370,6 +456,61 @@ class MemcachedMindMonitor(ResourceMonitor):
                 self.logger.log_msg(f"Error processing entry: {e}")
                 self.logger.log_msg(f"Current usage: {self.last_usage}")
 
+    def _detect_change(self, user_id, allocation, cache_size, mem_bw_in_mbps, perf, mrc):
+        '''
+        Feed the phase detectors of a user with a new measurement; on a change, age out the data of the previous phase.
+        Performance is compared only under the same allocation; the mean miss ratio of the MRC does not depend on it.
+        '''
+        if self.change_detection is None:
+            return
+        if user_id not in self.change_detectors:
+            self.change_detectors[user_id] = {
+                "perf": PageHinkley(**self.change_detection),
+                "miss_ratio": PageHinkley(**self.change_detection),
+                "allocation": None}
+        detectors = self.change_detectors[user_id]
+        if detectors["allocation"] != allocation:
+            detectors["perf"].reset()
+            detectors["allocation"] = allocation
+        changed = detectors["perf"].update(perf)
+        if mrc:
+            changed = detectors["miss_ratio"].update(np.mean([miss for _, miss in mrc])) or changed
+        if not changed:
+            return
+        self.logger.log_msg(f"User: {user_id} | Phase change detected at iteration {self.collection_iteration_count}")
+        metrics.CHANGE_POINTS.inc()
+        self.change_points[user_id] = self.collection_iteration_count
+        self._age_out_app(user_id, self.collection_iteration_count + 1)
+        # the measurements of this round before the change are stale as well
+        self.buffered_data[user_id] = {cache_size: {mem_bw_in_mbps: [perf]}}
+
+    def _age_out_app(self, app_id, before_iteration):
+        '''
+        Drop the consumed records of an app older than @before_iteration (the MRC and usage are kept)
+        '''
+        entry = self.collected_data.get(app_id)
+        if entry is not None:
+            for cache_size in list(entry["datapoints"].keys()):
+                for mem_bw_in_mbps in list(entry["datapoints"][cache_size].keys()):
+                    records = [record for record in entry["datapoints"][cache_size][mem_bw_in_mbps] if record[1] >= before_iteration]
+                    if records:
+                        entry["datapoints"][cache_size][mem_bw_in_mbps] = records
+                    else:
+                        del entry["datapoints"][cache_size][mem_bw_in_mbps]
+                        entry["last_updated"][cache_size].pop(mem_bw_in_mbps, None)
+                if not entry["datapoints"][cache_size]:
+                    del entry["datapoints"][cache_size]
+                    entry["last_updated"].pop(cache_size, None)
+            entry["total_record"] = sum(len(records) for cache_data in entry["datapoints"].values() for records in cache_data.values())
+            entry["total_datapoint"] = sum(len(cache_data) for cache_data in entry["datapoints"].values())
+        if app_id in self.recent_measurement:
+            self.recent_measurement[app_id] = []
+
+    def pop_change_points(self):
+        with self.lock:
+            change_points, self.change_points = self.change_points, {}
+        return change_points
+
     def _update_recent_measurement(self):
         for user_id, user_data in self.buffered_data.items():
             if user_id not in self.recent_measurement:
@@ -561,6 +702,104 @@ class MemcachedMindMonitor(ResourceMonitor):
         else:
             raise ValueError(f"Log entry does not match expected format: {log_entry}")
 
+    def load_prior(self, user_id, mrc, usage, num_records=1):
+        """
+        Seed the learned state of a user from a stored profile
+
+        :param mrc: List of [cache_size, miss_ratio] pairs
+        :param usage: {"cache": MB, "mem_bw": Mbps}
+        :param num_records: Number of records to account for the prior (to skip the init phase)
+        """
+        if user_id in self.collected_data and self.collected_data[user_id]["total_record"] > 0:
+            # measured data takes precedence over the prior
+            return
+        self.collected_data[user_id] = {
+            "total_record": num_records,
+            "total_datapoint": 0,
+            "datapoints": {},
+            "last_updated": {},
+            "last_update_iteration": self.collection_iteration_count,
+            "last_mrc": mrc
+        }
+        self.last_usage[user_id] = dict(usage)
+        self.logger.log_msg(f"Loaded prior for user {user_id}: usage: {usage}, mrc size: {len(mrc)}")
+
+    def get_checkpoint_state(self):
+        """
+        Learned state of the monitor to be stored in a checkpoint
+        """
+        return {
+            "collected_data": self.collected_data,
+            "buffered_mrc": self.buffered_mrc,
+            "last_usage": self.last_usage,
+            "recent_measurement": self.recent_measurement,
+            "collection_iteration_count": self.collection_iteration_count,
+            "last_allocation": self.last_allocation,
+            "vm_to_app_map": self.vm_to_app_map,
+        }
+
+    def get_snapshot(self):
+        """
+        Copy of the monitor with private containers of the state the allocators read, for readers on other threads
+        (see allocators.shadow); call with the lock held.
+
+        Only the containers are copied, in O(#apps + #measured allocations): the record lists of the datapoints are
+        shared, as consumption only appends to them or replaces them, until freeze_snapshot() cuts them to their
+        length at the snapshot, which can run after the lock is released.
+        """
+        snapshot = copy.copy(self)
+        snapshot.lock = threading.RLock()
+        snapshot.collected_data = {}
+        snapshot.shared_records = []
+        for app_id, entry in self.collected_data.items():
+            datapoints = {cache_size: dict(cache_data) for cache_size, cache_data in entry["datapoints"].items()}
+            last_updated = {cache_size: dict(cache_data) for cache_size, cache_data in entry["last_updated"].items()}
+            snapshot.collected_data[app_id] = dict(entry, datapoints=datapoints, last_updated=last_updated)
+            snapshot.shared_records.extend((cache_data, mem_bw_in_mbps, len(records))
+                                           for cache_data in datapoints.values() for mem_bw_in_mbps, records in cache_data.items())
+        snapshot.last_usage = dict(self.last_usage)
+        snapshot.recent_measurement = {app_id: list(window) for app_id, window in self.recent_measurement.items()}
+        snapshot.vm_to_app_map = dict(self.vm_to_app_map) if self.vm_to_app_map else self.vm_to_app_map
+        # nothing is consumed from a snapshot
+        snapshot.buffered_data = {}
+        snapshot.num_buffered_data = 0
+        snapshot.buffered_mrc = {}
+        return snapshot
+
+    def freeze_snapshot(self):
+        """
+        Private copies of the record lists a snapshot shares with the monitor (see get_snapshot())
+        """
+        with self.lock:
+            shared_records, self.shared_records = getattr(self, "shared_records", []), []
+            for cache_data, mem_bw_in_mbps, length in shared_records:
+                cache_data[mem_bw_in_mbps] = cache_data[mem_bw_in_mbps][:length]
+
+    def load_checkpoint_state(self, state):
+        """
+        Restore the monitor state from a checkpoint (see get_checkpoint_state)
+        """
+        self.collected_data = state["collected_data"]
+        self.buffered_mrc = state["buffered_mrc"]
+        self.last_usage = state["last_usage"]
+        self.recent_measurement = state["recent_measurement"]
+        self.collection_iteration_count = state["collection_iteration_count"]
+        self.last_allocation = state["last_allocation"]
+        self.vm_to_app_map = state["vm_to_app_map"]
+        # data buffered before the restart is not consumed
+        self.buffered_data = {}
+        self.num_buffered_data = 0
+
+    def reset_metrics_for_apps(self, app_ids):
+        """
+        Reset metrics for multiple applications at once (e.g., on a phase change)
+
+        Returns:
+            dict: app_id -> True if metrics were reset, False if app_id was not found
+        """
+        with self.lock:
+            return {int(app_id): self.reset_metrics_for_app(app_id) for app_id in app_ids}
+
     def reset_metrics_for_app(self, app_id):
         """
         Reset metrics for a specific application
@@ -571,7 +810,10 @@ class MemcachedMindMonitor(ResourceMonitor):
         Returns:
             bool: True if metrics were reset, False if app_id was not found
         """
-        app_id = int(app_id)  # Ensure app_id is an integer
+        with self.lock:
+            return self._reset_metrics_for_app(int(app_id))
+
+    def _reset_metrics_for_app(self, app_id):
 
         reset_occurred = False
 
@@ -617,4 +859,24 @@ class DummyMonitor(MemcachedMindMonitor):
     '''Dummy monitor for algorithm overhead evaluation.'''
     def collect(self, verification_th=0.025):
         # dummy collect
-        pass
\ No newline at end of file
+        pass
+
+class ReplayMonitor(MemcachedMindMonitor):
+    '''
+    Monitor fed by recorded /collect responses instead of a live enforcer.
+    Each collect() consumes the next recorded payload; the controller loop stops once the trace is exhausted.
+    '''
+    def __init__(self, config, entries):
+        super().__init__(config)
+        self.entries = entries
+        self.replay_index = 0
+
+    def collect(self, verification_th=0.025):
+        if self.is_exhausted():
+            return
+        _, data = self.entries[self.replay_index]
+        self.replay_index += 1
+        self.process_payload(data, verification_th=verification_th)
+
+    def is_exhausted(self):
+        return self.replay_index >= len(self.entries)
@@ -0,0 +1,52 @@
+"""
+Online change-point detection of application phases (two-sided Page-Hinkley test).
+"""
+
+
+class PageHinkley:
+    """
+    Two-sided Page-Hinkley test on the relative deviation of a signal from its running mean.
+
+    - delta: tolerated relative drift per sample
+    - threshold: cumulative relative deviation that signals a change
+    - min_samples: samples before a change can be signaled
+    """
+
+    def __init__(self, delta=0.02, threshold=0.5, min_samples=3):
+        self.delta = delta
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.reset()
+
+    def reset(self):
+        self.num_samples = 0
+        self.mean = 0.
+        # cumulative sums of the upward and downward deviations, and their extrema
+        self.sum_up = 0.
+        self.min_up = 0.
+        self.sum_down = 0.
+        self.max_down = 0.
+
+    def update(self, value):
+        """
+        Returns:
+            bool: True if a change is detected (the test restarts from this sample)
+        """
+        value = float(value)
+        self.num_samples += 1
+        if self.num_samples == 1:
+            self.mean = value
+            return False
+        deviation = (value - self.mean) / max(1e-9, abs(self.mean))
+        self.mean += (value - self.mean) / self.num_samples
+        self.sum_up += deviation - self.delta
+        self.min_up = min(self.min_up, self.sum_up)
+        self.sum_down += deviation + self.delta
+        self.max_down = max(self.max_down, self.sum_down)
+        if self.num_samples < self.min_samples:
+            return False
+        if self.sum_up - self.min_up > self.threshold or self.max_down - self.sum_down > self.threshold:
+            self.reset()
+            self.update(value)
+            return True
+        return False
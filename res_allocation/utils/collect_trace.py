@@ -0,0 +1,52 @@
+"""
+Record and load raw /collect responses for offline replay of the controller.
+
+A trace is a JSON-lines file with one {"ts": <unix time>, "payload": <raw response string>} per line.
+Main logs of previous runs can be loaded as well: the monitor prints every raw response
+(a single-line JSON starting with {"map") to the main log.
+"""
+
+import json
+import time
+
+
+class CollectRecorder:
+    """Append raw /collect responses with their timestamps to a trace file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.num_records = 0
+        self._file = open(path, 'a')
+
+    def record(self, payload, ts=None):
+        entry = {"ts": time.time() if ts is None else ts, "payload": payload}
+        self._file.write(json.dumps(entry) + "\n")
+        # flush per record so that the trace survives a crashed controller
+        self._file.flush()
+        self.num_records += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def load_collect_trace(path):
+    """
+    Load a recorded trace or a main log of a previous run.
+
+    Returns:
+        list: [(timestamp or None, raw payload string)] in the recorded order
+    """
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{"ts"'):
+                entry = json.loads(line)
+                entries.append((entry["ts"], entry["payload"]))
+            elif line.startswith('{"map"'):
+                # raw response printed to the main log (no timestamp)
+                entries.append((None, line))
+    return entries
@@ -24,6 +24,13 @@ class Config:
                 self.max_cache_in_mb = data["cluster"]["max_cache_in_mb"] if "max_cache_in_mb" in data["cluster"].keys() else data["cluster"]["total_cache_in_mb"]
                 self.min_mem_bw_in_mbps = data["cluster"]["min_mem_bw_in_mbps"]
                 self.max_mem_bw_in_mbps = data["cluster"]["max_mem_bw_in_mbps"] if "max_mem_bw_in_mbps" in data["cluster"].keys() else data["cluster"]["total_mem_bw_in_mbps"]
+                # bandwidth of the memory node shared by all compute VMs (None: each VM has its own total_mem_bw_in_mbps)
+                self.total_node_mem_bw_in_mbps = data["cluster"]["total_node_mem_bw_in_mbps"] if "total_node_mem_bw_in_mbps" in data["cluster"].keys() else None
+                # allocation granularity of the enforcer
+                self.cache_quantum_in_mb = data["cluster"]["cache_quantum_in_mb"] if "cache_quantum_in_mb" in data["cluster"].keys() else 1
+                self.mem_bw_quantum_in_mbps = data["cluster"]["mem_bw_quantum_in_mbps"] if "mem_bw_quantum_in_mbps" in data["cluster"].keys() else 1
+                # other contended resources of the compute VMs: type -> {"total": .., "min": .., "max": .., "quantum": ..} in enforcer units
+                self.extra_resources = data["cluster"]["extra_resources"] if "extra_resources" in data["cluster"].keys() else {}
             # resource controller related
             if "resource_controller" in data:
                 self.url = data["resource_controller"]["base_url"]
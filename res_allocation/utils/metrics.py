@@ -0,0 +1,167 @@
+"""
+Lightweight runtime metrics of the controller in the Prometheus text exposition format.
+Metrics are registered in the module-level REGISTRY and exposed via GET /metrics of the MetricsResetServer.
+"""
+
+import sys
+import threading
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}   # sorted label tuple -> value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0., "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def get_count(self, **labels):
+        with self._lock:
+            entry = self._values.get(tuple(sorted(labels.items())))
+            return 0 if entry is None else entry["count"]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for labels, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(float(entry['sum']))}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {entry['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, documentation, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, **kwargs)
+            metric = self._metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as {metric.metric_type}")
+        return metric
+
+    def counter(self, name, documentation):
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name, documentation):
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def get_deep_size(obj, seen=None):
+    """Approximate memory footprint (bytes) of nested dicts/lists of plain values"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_deep_size(k, seen) + get_deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(get_deep_size(v, seen) for v in obj)
+    return size
+
+
+REGISTRY = MetricsRegistry()
+
+# Controller metrics (shared by monitor, deployer, estimator and allocators)
+COLLECT_LATENCY = REGISTRY.histogram("spirit_collect_latency_seconds", "Latency of /collect requests to the enforcer")
+COLLECT_TOTAL = REGISTRY.counter("spirit_collect_total", "Number of /collect requests by status")
+DEPLOY_LATENCY = REGISTRY.histogram("spirit_deploy_latency_seconds", "Latency of /deploy requests to the enforcer")
+DEPLOY_TOTAL = REGISTRY.counter("spirit_deploy_total", "Number of /deploy requests by status")
+ALLOCATION_LATENCY = REGISTRY.histogram("spirit_allocation_seconds", "Wall time of a single allocation round")
+ALLOCATION_ROUNDS = REGISTRY.counter("spirit_allocation_rounds_total", "Number of allocation rounds")
+ALLOCATION_SKIPS = REGISTRY.counter("spirit_allocation_skips_total", "Number of allocation rounds reusing the previous allocation (change gate)")
+DEPLOY_SKIPS = REGISTRY.counter("spirit_deploy_skips_total", "Number of rounds without redeploying an unchanged allocation")
+PRICE_ITERATIONS = REGISTRY.histogram("spirit_price_iterations", "Price search iterations per VM allocation",
+                                      buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+ESTIMATOR_CALLS = REGISTRY.counter("spirit_estimator_calls_total", "Number of performance estimations by allocator (live, or the name of a shadow allocator)")
+CONVERGENCE_FAILURES = REGISTRY.counter("spirit_convergence_failures_total", "Number of VM allocations without price convergence")
+CONFLICT_RESETS = REGISTRY.counter("spirit_conflict_resets_total", "Number of resets after repeated allocation conflicts")
+CHANGE_POINTS = REGISTRY.counter("spirit_change_points_total", "Number of detected application phase changes")
+OUT_OF_BAND_ROUNDS = REGISTRY.counter("spirit_out_of_band_rounds_total", "Number of allocation rounds started early by a phase change")
+MONITOR_APPS = REGISTRY.gauge("spirit_monitor_apps", "Number of applications tracked by the monitor")
+MONITOR_DATAPOINTS = REGISTRY.gauge("spirit_monitor_datapoints", "Number of distinct (cache, mem_bw) datapoints kept by the monitor")
+MONITOR_MEMORY = REGISTRY.gauge("spirit_monitor_memory_bytes", "Approximate memory footprint of the monitor state (sampled every few rounds)")
@@ -0,0 +1,130 @@
+"""
+Profiling hooks of the control loop: per-phase timers for every allocation round and
+an on-demand cProfile/tracemalloc capture armed through the controller API.
+"""
+
+import os
+import io
+import time
+import pstats
+import cProfile
+import datetime
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from utils import metrics
+
+PHASE_LATENCY = metrics.REGISTRY.histogram("spirit_phase_seconds", "Wall time of each phase of an allocation round")
+
+
+class PhaseTimer:
+    """Wall time per phase (allocate, deploy, collect, consume, ...) of the current allocation round"""
+
+    def __init__(self):
+        self.round_start = None
+        self.phases = {}
+
+    def start_round(self):
+        self.round_start = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            # phases can repeat within a round (e.g., multiple collects)
+            self.phases[name] = self.phases.get(name, 0.) + elapsed
+            PHASE_LATENCY.observe(elapsed, phase=name)
+
+    def end_round(self):
+        """
+        Returns:
+            dict: phase -> wall time in ms, including "total" for the whole round
+        """
+        result = {name: elapsed * 1e3 for name, elapsed in self.phases.items()}
+        if self.round_start is not None:
+            result["total"] = (time.perf_counter() - self.round_start) * 1e3
+        return result
+
+
+class ProfileCapture:
+    """
+    cProfile + tracemalloc capture of the next N allocation rounds.
+
+    arm() may be called from any thread (e.g., the API server); the capture itself is started and
+    stopped by the control loop via on_round_start()/on_round_end(), since cProfile only profiles the
+    thread that enables it.
+    """
+
+    def __init__(self, output_dir="./logs/profiles", top_n=30):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self.pending_rounds = 0
+        self.remaining_rounds = 0
+        self.profiler = None
+        self.last_outputs = []
+
+    def arm(self, num_rounds):
+        num_rounds = int(num_rounds)
+        if num_rounds <= 0:
+            raise ValueError("Number of rounds should be positive.")
+        with self._lock:
+            if self.profiler is not None or self.pending_rounds > 0:
+                return False
+            self.pending_rounds = num_rounds
+        return True
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "armed_rounds": self.pending_rounds,
+                "running": self.profiler is not None,
+                "remaining_rounds": self.remaining_rounds,
+                "last_outputs": list(self.last_outputs),
+            }
+
+    def on_round_start(self):
+        with self._lock:
+            if self.profiler is not None or self.pending_rounds <= 0:
+                return
+            self.remaining_rounds = self.pending_rounds
+            self.pending_rounds = 0
+            self.profiler = cProfile.Profile()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler.enable()
+
+    def on_round_end(self):
+        if self.profiler is None:
+            return
+        with self._lock:
+            self.remaining_rounds -= 1
+            if self.remaining_rounds > 0:
+                return
+        self.profiler.disable()
+        memory_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        outputs = self._dump(self.profiler, memory_snapshot)
+        with self._lock:
+            self.profiler = None
+            self.last_outputs = outputs
+
+    def _dump(self, profiler, memory_snapshot):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        prefix = os.path.join(self.output_dir, f"controller_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        # binary stats for snakeviz/pstats, plus human-readable summaries
+        profiler.dump_stats(f"{prefix}.prof")
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(self.top_n)
+        with open(f"{prefix}_cpu.txt", 'w') as f:
+            f.write(stream.getvalue())
+        memory_snapshot.dump(f"{prefix}.tracemalloc")
+        with open(f"{prefix}_mem.txt", 'w') as f:
+            for stat in memory_snapshot.statistics("lineno")[:self.top_n]:
+                f.write(f"{stat}\n")
+        return [f"{prefix}.prof", f"{prefix}_cpu.txt", f"{prefix}.tracemalloc", f"{prefix}_mem.txt"]